@@ -0,0 +1,175 @@
+#### Scaling benchmark for tbf_analyses.py #####################################################
+## Generates synthetic histories of several sizes with gen_gc_history.py and times each stage of
+## the TBF pipeline on them: wall time, CPU time and peak memory per stage, plus row/event counts.
+## Results are written as JSON (one record per size and stage) so runs can be compared.
+##
+## Stages are the ones reported by the tbf_instrument hooks in tbf_analyses.py.
+## Each size runs in separate python processes so memory numbers do not leak between sizes: one
+## pass with tracing off for the times, then one with tracemalloc for the peak memory of each
+## stage (tracing slows the pipeline several times over, so its times are not kept).
+## A run where the pipeline fails, or misses a stage of the baseline, exits with code 1.
+##
+## usage: python bench_tbf.py --sizes 0.25,1,4 --out bench.json
+##        python bench_tbf.py --sizes 1 --baseline bench.json   (exit code 1 on regression)
+####
+
+#### package imports ############################################################################
+import argparse
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import gc_data
+import gen_gc_history
+import tbf_instrument as instr
+
+SCRIPT_LOCATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tbf_analyses.py')
+
+#### worker: run the pipeline once with instrumentation enabled ################################
+## output: list of stage records (see tbf_instrument.py), plus a 'total' record ('error' is set
+##         when the pipeline raised)
+def runStages(csv_path, figs_dir, memory=False):
+    os.environ['TBF_CSV_FILE'] = csv_path
+    os.environ['TBF_FIGS_DIR'] = figs_dir
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    results = []
+    instr.enable(results, memory=memory)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    error = None
+    try:
+        runpy.run_path(SCRIPT_LOCATION, run_name='__main__')
+    except Exception as e:  # keep the stages that finished
+        error = '%s: %s' % (type(e).__name__, e)
+    total = {'stage': 'total', 'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu}
+    if error is not None:
+        total['error'] = error
+    instr.disable()
+    return results + [total]
+
+## worker entry point, prints JSON to stdout
+def workerMain(csv_path, figs_dir, memory):
+    # the script prints progress; keep stdout for the JSON result
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        results = runStages(csv_path, figs_dir, memory)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on linux
+    json.dump({'stages': results, 'maxrss_mb': maxrss}, sys.stdout)
+
+#### driver #####################################################################################
+## runs the pipeline in a worker process, returns its parsed output
+def runWorker(csv_path, figs_dir, workdir, memory):
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', csv_path, '--figs', figs_dir]
+    if memory:
+        cmd.append('--memory')
+    proc = subprocess.run(cmd, cwd=workdir, stdout=subprocess.PIPE, check=True)
+    return json.loads(proc.stdout)
+
+## runs one size and returns its records: times from an untraced pass, peak_mb of each stage
+## from a traced one (memory=True)
+def benchSize(scale, seed, workdir, memory=True):
+    gpus = max(1, int(round(scale * gc_data.TITAN_TOTAL_NODES)))
+    csv_path = os.path.join(workdir, 'gc_full_%d.csv' % gpus)
+    figs_dir = os.path.join(workdir, 'figs_%d' % gpus)
+    os.makedirs(figs_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    rows = gen_gc_history.generate(csv_path, gpus=gpus, seed=seed)
+    gen_s = time.perf_counter() - t0
+
+    result = runWorker(csv_path, figs_dir, workdir, memory=False)
+    peaks = {}
+    if memory:
+        traced = runWorker(csv_path, figs_dir, workdir, memory=True)
+        peaks = dict((r['stage'], r['peak_mb']) for r in traced['stages'] if 'peak_mb' in r)
+        if 'error' in traced['stages'][-1] and 'error' not in result['stages'][-1]:
+            result['stages'][-1]['error'] = 'traced pass: ' + traced['stages'][-1]['error']
+
+    common = {'scale': scale, 'positions': gpus, 'csv_rows': rows, 'seed': seed}
+    records = [dict(common, stage='generate', wall_s=gen_s)]
+    for record in result['stages']:
+        record.pop('run', None)
+        if record['stage'] in peaks:
+            record['peak_mb'] = peaks[record['stage']]
+        records.append(dict(common, **record))
+    records[-1]['maxrss_mb'] = result['maxrss_mb']
+    return records
+
+## input: current and baseline records, relative tolerance on wall time
+## output: list of (scale, stage, baseline seconds, current seconds) that got slower; current
+##         seconds is None for a baseline stage the run did not reach (at the sizes that were run)
+def findRegressions(records, baseline, tolerance, min_seconds=0.05):
+    base = {(r['scale'], r['stage']): r['wall_s'] for r in baseline}
+    current = {(r['scale'], r['stage']): r['wall_s'] for r in records}
+    scales = set(r['scale'] for r in records)
+    slower = []
+    for key in sorted(base):
+        scale, stage = key
+        if scale not in scales or stage == 'generate':
+            continue
+        if key not in current:
+            slower.append((scale, stage, base[key], None))
+        elif current[key] > base[key] * (1 + tolerance) and current[key] - base[key] > min_seconds:
+            slower.append((scale, stage, base[key], current[key]))
+    return slower
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time and memory-profile tbf_analyses.py stages across sizes.')
+    parser.add_argument('--sizes', default='0.25,1,4',
+                        help='comma separated sizes as multiples of Titan (%d GPUs)' % gc_data.TITAN_TOTAL_NODES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_tbf.json', help='results file (JSON)')
+    parser.add_argument('--workdir', help='where to keep generated histories (default: temporary)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass (no peak_mb per stage)')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--figs', help=argparse.SUPPRESS)
+    parser.add_argument('--memory', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        workerMain(args.worker, args.figs, args.memory)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        records = []
+        for scale in [float(x) for x in args.sizes.split(',')]:
+            size_records = benchSize(scale, args.seed, workdir, not args.no_memory)
+            for r in size_records:
+                print('%8.2fx %-18s %9.3f s' % (r['scale'], r['stage'], r['wall_s']) +
+                      ('  %8.1f MB' % r['peak_mb'] if 'peak_mb' in r else '') +
+                      ('  ' + r['error'] if 'error' in r else ''))
+            records.extend(size_records)
+
+    with open(args.out, 'w') as f:
+        json.dump(records, f, indent=1)
+    print('Wrote', len(records), 'records to', args.out)
+
+    failed = [r for r in records if 'error' in r]
+    for r in failed:
+        print('FAILED: %.2fx: %s' % (r['scale'], r['error']))
+    slower = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = findRegressions(records, baseline, args.tolerance)
+        for scale, stage, before, after in slower:
+            if after is None:
+                print('REGRESSION: %.2fx %s: %.3f s -> stage not reached' % (scale, stage, before))
+            else:
+                print('REGRESSION: %.2fx %s: %.3f s -> %.3f s' % (scale, stage, before, after))
+    if failed or slower:
+        sys.exit(1)
@@ -0,0 +1,164 @@
+#### Multi-horizon censoring sweep ##############################################################
+## Sensitivity of the survival estimates to censoring the old batch at a horizon h, as
+## gc_summary_loc_censor1 .. gc_summary_loc_censor4 in TitanGPUmodel.Rmd (h = 1..4 years), but
+## for any number of horizons and without copying the table per horizon.
+##
+## Censoring old-batch GPUs at h (dead = FALSE, years = h if years > h) changes the risk set only
+## after h: at times t <= h an old GPU is at risk and fails exactly as before, after h no old GPU
+## is at risk. So the table is sorted by years once, the at-risk and failure counts per distinct
+## time are kept per batch, and each horizon is
+##   at risk(t) = new(t) + [t <= h] old(t),   failures(t) = new(t) + [t <= h] old(t)
+## from which the Kaplan-Meier survival and Nelson-Aalen cumulative hazard follow. Exposure
+## (GPU-years) per horizon comes from prefix sums of the sorted old-batch years.
+## Memory is one table plus one curve at a time, whatever the number of horizons.
+##
+## Cohorts: all (both batches), old, new. Event columns: dead, dead_dbe, dead_otb (the other
+## failure type is then censored, as Surv(years, dead_dbe) in R).
+##
+## usage: python censor_sweep.py ../../data/gc_summary_loc.csv --horizons 0.5:5:0.25 --out censor
+####
+
+#### package imports ############################################################################
+import argparse
+import csv
+
+import numpy as np
+
+import gc_data
+
+EVENT_COLUMNS = ('dead', 'dead_dbe', 'dead_otb')
+COHORTS = ('all', 'old', 'new')
+
+#### risk sets ##################################################################################
+## input: years (float array), old (bool array), dict of event name -> bool array
+## output: dict with the distinct times (sorted) and, per batch, at-risk counts at each time
+##         ('n_old', 'n_new') and failures at each time per event name ('d_old:dead', ...)
+##         plus sorted old-batch years and their prefix sums for exposure
+def riskSets(years, old, events):
+    order = np.argsort(years, kind='stable')
+    years = years[order]
+    old = old[order]
+    times, first = np.unique(years, return_index=True)
+    sets = {'times': times}
+    for batch, mask in (('old', old), ('new', ~old)):
+        exits = np.add.reduceat(mask.astype('int64'), first) if len(first) else np.zeros(0, 'int64')
+        sets['n_' + batch] = np.cumsum(exits[::-1])[::-1]  # at risk: years >= t
+        for name, dead in events.items():
+            hits = (dead[order] & mask).astype('int64')
+            sets['d_%s:%s' % (batch, name)] = np.add.reduceat(hits, first) if len(first) else hits
+    sets['old_years'] = years[old]
+    sets['old_prefix'] = np.concatenate([[0.0], np.cumsum(years[old])])
+    sets['new_years_total'] = float(years[~old].sum())
+    sets['n_total'] = len(years)
+    return sets
+
+## at-risk and failure counts of a cohort censored at horizon h (old batch only)
+## output: times, at risk, failures; times after h are dropped for the old cohort
+def censoredCounts(sets, h, event, cohort):
+    k = np.searchsorted(sets['times'], h, side='right')  # times <= h
+    n_old, d_old = sets['n_old'], sets['d_old:' + event]
+    n_new, d_new = sets['n_new'], sets['d_new:' + event]
+    if cohort == 'new':
+        return sets['times'], n_new, d_new
+    if cohort == 'old':
+        return sets['times'][:k], n_old[:k], d_old[:k]
+    n = n_new.copy()
+    d = d_new.copy()
+    n[:k] += n_old[:k]
+    d[:k] += d_old[:k]
+    return sets['times'], n, d
+
+#### estimates ##################################################################################
+## input: at risk and failures at each time
+## output: Kaplan-Meier survival and Nelson-Aalen cumulative hazard just after each time
+def survivalCurves(n, d):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(n > 0, d / n, 0.0)
+    return np.cumprod(1.0 - ratio), np.cumsum(ratio)
+
+## input: a curve at its distinct times, grid of times (sorted)
+## output: the curve at the grid times up to the last time: at risk at the grid time, failures
+##         since the previous grid time, survival and cumulative hazard (step functions)
+def onGrid(times, n, d, surv, cumhaz, grid):
+    if len(times) == 0:
+        return grid[:0], n, d, surv, cumhaz
+    grid = grid[grid <= times[-1]]
+    last = np.searchsorted(times, grid, side='right') - 1   # last time <= grid point
+    nxt = np.searchsorted(times, grid, side='left')         # first time >= grid point
+    before = last < 0
+    last = np.maximum(last, 0)
+    failed = np.where(before, 0, np.cumsum(d)[last])
+    return (grid, n[nxt], np.diff(failed, prepend=0),
+            np.where(before, 1.0, surv[last]), np.where(before, 0.0, cumhaz[last]))
+
+## failures and exposure (GPU-years) of a cohort censored at horizon h
+def exposure(sets, h, event, cohort):
+    times, n, d = censoredCounts(sets, h, event, cohort)
+    k = np.searchsorted(sets['old_years'], h, side='right')
+    old = sets['old_prefix'][k]  # sum of min(years, h)
+    if k < len(sets['old_years']):
+        old += h * (len(sets['old_years']) - k)
+    years = {'old': old, 'new': sets['new_years_total'], 'all': old + sets['new_years_total']}[cohort]
+    return int(d.sum()), years
+
+## input: risk sets, horizons (years; inf for no censoring), event names, cohorts, optional grid
+## output: yields one dict per (horizon, event, cohort) with the curve (at the distinct times, or
+##         at the grid times if given) and the totals; one curve is in memory at a time
+def sweep(sets, horizons, events=EVENT_COLUMNS, cohorts=COHORTS, grid=None):
+    for h in horizons:
+        for event in events:
+            for cohort in cohorts:
+                times, n, d = censoredCounts(sets, h, event, cohort)
+                surv, cumhaz = survivalCurves(n, d)
+                if grid is not None:
+                    times, n, d, surv, cumhaz = onGrid(times, n, d, surv, cumhaz, grid)
+                failures, years = exposure(sets, h, event, cohort)
+                yield {'horizon': h, 'event': event, 'cohort': cohort,
+                       'times': times, 'at_risk': n, 'failures': d, 'survival': surv, 'cum_hazard': cumhaz,
+                       'total_failures': failures, 'exposure_years': years}
+
+#### command line ###############################################################################
+## 'a:b:step' (inclusive) or a comma separated list; 'inf' is no censoring
+def parseHorizons(text):
+    if ':' in text:
+        start, stop, step = (float(x) for x in text.split(':'))
+        return list(np.round(np.arange(start, stop + step / 2, step), 10))
+    return [float(x) for x in text.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Survival and hazard estimates for many old-batch censoring horizons.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_summary_loc.csv')
+    parser.add_argument('--horizons', default='1,2,3,4,inf',
+                        help="years, 'a:b:step' or a comma separated list; inf = no censoring (default: %(default)s)")
+    parser.add_argument('--events', default=','.join(EVENT_COLUMNS))
+    parser.add_argument('--cohorts', default=','.join(COHORTS))
+    parser.add_argument('--grid', type=float, help='report the curves every GRID years instead of at each time')
+    parser.add_argument('--out', default='censor_sweep', help='prefix of the csv outputs')
+    args = parser.parse_args()
+
+    table = gc_data.loadSummary(args.path)
+    events = args.events.split(',')
+    cohorts = args.cohorts.split(',')
+    sets = riskSets(table['years'], table['batch'] == 'old', dict((e, table[e]) for e in events))
+    grid = None
+    if args.grid:
+        grid = np.arange(0.0, sets['times'][-1] + args.grid, args.grid)
+
+    curves_file = args.out + '_curves.csv'
+    totals_file = args.out + '_totals.csv'
+    with open(curves_file, 'w', newline='') as cf, open(totals_file, 'w', newline='') as tf:
+        curves = csv.writer(cf)
+        totals = csv.writer(tf)
+        curves.writerow(['horizon', 'event', 'cohort', 'years', 'at_risk', 'failures', 'survival', 'cum_hazard'])
+        totals.writerow(['horizon', 'event', 'cohort', 'failures', 'exposure_years', 'rate_per_year',
+                         'survival_at_horizon'])
+        for est in sweep(sets, parseHorizons(args.horizons), events, cohorts, grid):
+            h = est['horizon']
+            for row in zip(est['times'], est['at_risk'], est['failures'], est['survival'], est['cum_hazard']):
+                curves.writerow([h, est['event'], est['cohort']] + [x.item() for x in row])
+            k = np.searchsorted(est['times'], h, side='right') - 1
+            surv_h = est['survival'][k] if k >= 0 else 1.0
+            rate = est['total_failures'] / est['exposure_years'] if est['exposure_years'] > 0 else float('nan')
+            totals.writerow([h, est['event'], est['cohort'], est['total_failures'], est['exposure_years'],
+                             rate, surv_h])
+    print('Wrote', curves_file, 'and', totals_file)
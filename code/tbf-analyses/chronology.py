@@ -0,0 +1,178 @@
+#### Fleet lifeline chronology ##################################################################
+## Draws the lifelines of all GPUs (or all locations), as plot.life_ev() in TitanGPUsetup.R does
+## for a sample of 90: one line per serial (or location) over time, overlaps in red, DBE as red
+## triangles, OTB as blue squares, last seen (out) as black ']'.
+##
+## The lifelines are rasterized into a unit-by-time grid: every stint adds +1 at its first time
+## bin and -1 after its last one (np.add.at into a difference array), and a cumulative sum along
+## time gives the number of stints covering each pixel (2 or more is an overlap). The grid is shown
+## as one image; the markers are one scatter collection per kind. No artist per lifeline.
+##
+## Units are sorted by the location hierarchy (col, row, cage, slot, node; for serials, by the
+## location of their first stint), by first insert, or by name. Output is an overview image of all
+## units (rows merged so it fits --height pixels: gray level is the fraction of merged units with
+## a stint, overlaps and markers are kept) and, with
+## --tile-rows, tiles of that many units at full resolution, which can be zoomed in time with
+## --since/--until.
+##
+## usage: python chronology.py ../../data/gc_full.csv --by serial --out chronology_sn
+##        python chronology.py ../../data/gc_full.csv --by location --tile-rows 2000 --since 2016-01-01
+####
+
+#### package imports ############################################################################
+import argparse
+import os
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+
+import gc_data
+
+MARKERS = {'dbe': dict(marker='^', color='red'), 'otb': dict(marker='s', color='blue'),
+           'out': dict(marker='$]$', color='black'), 'start': dict(marker='.', color='gray')}
+
+#### units ######################################################################################
+## input: loaded gc_full table, 'serial' or 'location', sort 'hierarchy', 'first' or 'name'
+## output: per table row, the display row of its unit; unit labels in display order
+def unitOrder(table, by='serial', sort='hierarchy'):
+    has = table['insert'] != gc_data.MISSING
+    if by == 'location':
+        names, code = table['locations'], table['loc_code']
+    else:
+        names, code = np.unique(table['sn'], return_inverse=True)
+    n = len(names)
+    first = np.full(n, np.iinfo('int64').max, dtype='int64')  # first insert of each unit
+    np.minimum.at(first, code[has], table['insert'][has])
+    if sort == 'name':
+        order = np.arange(n)
+    elif sort == 'first':
+        order = np.lexsort((np.arange(n), first))
+    else:  # hierarchy; a serial goes where its first stint is (or its first event without one)
+        when = np.where(has, table['insert'], np.iinfo('int64').max)
+        rows = np.lexsort((when, code))
+        _, pick = np.unique(code[rows], return_index=True)
+        rep = rows[pick]
+        keys = tuple(table[k][rep] for k in ('node', 'slot', 'cage', 'row', 'col'))
+        order = np.lexsort((first,) + keys)
+    display = np.empty(n, dtype='int64')
+    display[order] = np.arange(n)
+    return display[code], names[order]
+
+#### rasterizing ################################################################################
+## input: display row per stint, start and stop epochs, number of units, time range and bins
+## output: int8 grid (units x bins), number of stints covering each pixel
+def rasterize(units, starts, stops, n_units, t0, t1, bins):
+    keep = (stops >= t0) & (starts <= t1)
+    scale = bins / float(t1 - t0)
+    b0 = np.clip(((starts[keep] - t0) * scale).astype('int64'), 0, bins - 1)
+    b1 = np.clip(((stops[keep] - t0) * scale).astype('int64'), 0, bins - 1) + 1
+    diff = np.zeros((n_units, bins + 1), dtype='int8')
+    np.add.at(diff, (units[keep], b0), 1)
+    np.add.at(diff, (units[keep], b1), -1)
+    return np.cumsum(diff[:, :bins], axis=1, dtype='int8')
+
+## input: grid, rows per output row
+## output: RGB image: gray level is the fraction of the merged units with a stint (black: all),
+##         red where any of them has an overlap
+def toImage(grid, factor=1):
+    starts = np.arange(0, grid.shape[0], factor)
+    alive = np.add.reduceat((grid > 0).astype('float32'), starts, axis=0)
+    alive /= np.diff(np.append(starts, grid.shape[0]))[:, None]
+    overlap = np.maximum.reduceat(grid, starts, axis=0) > 1
+    image = np.repeat((255 * (1.0 - alive)).astype('uint8')[:, :, None], 3, axis=2)
+    image[overlap] = (255, 0, 0)
+    return image
+
+## markers of each kind: display rows and times
+def markers(table, display, t0, t1):
+    kinds = {'dbe': table['event'] == gc_data.EVENT_DBE, 'otb': table['event'] == gc_data.EVENT_OTB,
+             'out': table['out'] == 1}
+    out = {}
+    for kind, mask in kinds.items():
+        mask = mask & (table['remove'] >= t0) & (table['remove'] <= t1)
+        out[kind] = (display[mask], table['remove'][mask])
+    mask = (table['insert'] != gc_data.MISSING) & (table['insert'] >= t0) & (table['insert'] <= t1)
+    out['start'] = (display[mask], table['insert'][mask])
+    return out
+
+#### drawing ####################################################################################
+def toDays(epochs):
+    return mdates.date2num(np.asarray(epochs, dtype='int64').astype('datetime64[s]'))
+
+## input: grid (rows x bins) of units lo..hi, rows merged by factor, markers, time range, labels
+## draws one image and one collection per marker kind; y grows downwards as in the R plots
+def drawChronology(path, grid, lo, hi, factor, marks, t0, t1, labels, title, width=12, dpi=150):
+    rows = -(-grid.shape[0] // factor)
+    height = max(3.0, min(rows, 20000) / float(dpi) + 1.0)
+    fig, ax = plt.subplots(figsize=(width, height))
+    ax.imshow(toImage(grid, factor), aspect='auto', interpolation='nearest',
+              extent=[toDays(t0), toDays(t1), hi - lo, 0])
+    size = 4 if factor <= 1 and rows <= 5000 else 1
+    for kind, (units, times) in marks.items():
+        if kind == 'start' and factor > 1:
+            continue
+        inside = (units >= lo) & (units < hi)
+        ax.scatter(toDays(times[inside]), units[inside] - lo + 0.5, s=size, linewidths=0, **MARKERS[kind])
+    ax.xaxis_date()
+    ax.xaxis.set_major_locator(mdates.YearLocator())
+    ax.set_xlim(toDays(t0), toDays(t1))
+    ax.set_ylim(hi - lo, 0)
+    if labels is not None and hi - lo <= 120:
+        ax.set_yticks(np.arange(hi - lo) + 0.5)
+        ax.set_yticklabels(labels[lo:hi], fontsize=4)
+    else:
+        ax.set_ylabel('%d units (%s to %s)' % (hi - lo, labels[lo], labels[hi - 1]))
+    ax.set_title(title)
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi)
+    plt.close(fig)
+
+## input: loaded table, options (see the command line)
+## output: list of files written
+def renderChronology(table, prefix, by='serial', sort='hierarchy', since=None, until=None, bins=2000,
+                     height=3000, tile_rows=None, fmt='png'):
+    display, labels = unitOrder(table, by, sort)
+    has = table['insert'] != gc_data.MISSING
+    t0 = since if since is not None else int(table['insert'][has].min())
+    t1 = until if until is not None else int(table['remove'].max())
+    grid = rasterize(display[has], table['insert'][has], table['remove'][has], len(labels), t0, t1, bins)
+    marks = markers(table, display, t0, t1)
+    n = len(labels)
+    written = []
+
+    factor = max(1, -(-n // height))
+    path = '%s_overview.%s' % (prefix, fmt)
+    drawChronology(path, grid, 0, n, factor, marks, t0, t1, labels,
+                   'GPU lifelines by %s: %d units, %d per pixel row' % (by, n, factor))
+    written.append(path)
+
+    if tile_rows:
+        for k, lo in enumerate(range(0, n, tile_rows)):
+            hi = min(n, lo + tile_rows)
+            path = '%s_%03d.%s' % (prefix, k, fmt)
+            drawChronology(path, grid[lo:hi], lo, hi, 1, marks, t0, t1, labels,
+                           'GPU lifelines by %s: units %d to %d of %d' % (by, lo, hi - 1, n))
+            written.append(path)
+    return written
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Chronology of all GPU lifelines, rasterized.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--by', choices=('serial', 'location'), default='serial')
+    parser.add_argument('--sort', choices=('hierarchy', 'first', 'name'), default='hierarchy')
+    parser.add_argument('--since', help='start of the time range (UTC)')
+    parser.add_argument('--until', help='end of the time range (UTC)')
+    parser.add_argument('--bins', type=int, default=2000, help='time bins (pixels) across the range')
+    parser.add_argument('--height', type=int, default=3000, help='pixel rows of the overview')
+    parser.add_argument('--tile-rows', type=int, help='also write tiles of this many units each')
+    parser.add_argument('--format', default='png')
+    parser.add_argument('--out', default=os.path.join('../../figs', 'chronology'), help='prefix of the output files')
+    args = parser.parse_args()
+
+    table = gc_data.loadGcFull(args.path)
+    since = gc_data.parseUTC(args.since) if args.since else None
+    until = gc_data.parseUTC(args.until) if args.until else None
+    for path in renderChronology(table, args.out, args.by, args.sort, since, until, args.bins,
+                                 args.height, args.tile_rows, args.format):
+        print('Wrote', path)
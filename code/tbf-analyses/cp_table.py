@@ -0,0 +1,230 @@
+#### Counting-process (start/stop) table ########################################################
+## Turns the per-stint records of gc_full.csv into a start/stop table for survival fitting with
+## time-dependent location covariates (TitanGPUmodel.Rmd uses only max_loc, the longest stint).
+## One row per (start, stop] interval of one GPU at one location:
+##   - every stint (row with an insert time) is an interval from insert to remove;
+##   - stints of a serial are sorted by insert and clipped where they overlap the previous ones
+##     (start = max(insert, latest earlier remove)), zero length stints are dropped;
+##   - a DBE/OTB on a row without an insert time gets its start from a stint of the same serial and
+##     location, as the parser in tbf_analyses.py does; here the stint that contains the event time.
+##     The stint is split at the event. Events with no such stint are reported (as bad_serials.dat)
+##     and left out;
+##   - events at the same time on one interval are counted once per type.
+## Covariates per interval: location (code and col, row, cage, slot, node), stint number, batch
+## (old/new), out (last seen, on the last interval of a stint), DBE and OTB counts.
+## Time scales: calendar (epochs) and age (GPU-years of life before the interval, over all stints).
+##
+## Everything is done with sorts over the whole table (serials are groups in one lexsort),
+## no per-serial python loop.
+##
+## usage: python cp_table.py ../../data/gc_full.csv --out cp_table.npz [--csv cp_table.csv]
+####
+
+#### package imports ############################################################################
+import argparse
+import csv
+import time
+
+import numpy as np
+
+import gc_data
+
+SECONDS_PER_YEAR = 60*60*24*365
+
+## input: group codes (sorted, consecutive) and int64 values
+## output: running maximum of the values within each group
+def groupRunningMax(groups, values):
+    if len(values) == 0:
+        return values.copy()
+    low = values.min()
+    span = values.max() - low + 1
+    offset = groups.astype('int64') * span
+    return np.maximum.accumulate(offset + (values - low)) - offset + low
+
+## input: group keys (int64) and times of sorted items; query keys and times
+## output: per query, index of the last item with the same key and time <= query time, -1 if none
+def lastAtOrBefore(keys, times, qkeys, qtimes):
+    groups, rank = np.unique(keys, return_inverse=True)
+    qrank = np.searchsorted(groups, qkeys)  # == rank of the key, if the key is present
+    low = min(times.min() if len(times) else 0, qtimes.min() if len(qtimes) else 0)
+    span = max(times.max() if len(times) else 0, qtimes.max() if len(qtimes) else 0) - low + 1
+    combined = rank.astype('int64') * span + (times - low)
+    order = np.argsort(combined, kind='stable')
+    pos = np.searchsorted(combined[order], qrank.astype('int64') * span + (qtimes - low), side='right') - 1
+    hit = order[np.maximum(pos, 0)] if len(order) else pos
+    ok = pos >= 0
+    ok[ok] &= (rank[hit[ok]] == qrank[ok]) & (groups[rank[hit[ok]]] == qkeys[ok])
+    return np.where(ok, hit, -1)
+
+## first index of each run of equal keys in sorted arrays
+def runStarts(*keys):
+    change = np.zeros(len(keys[0]), dtype=bool)
+    if len(change):
+        change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return change
+
+#### stints #####################################################################################
+## input: loaded gc_full table (gc_data.loadGcFull), cutoff for the old/new batch
+## output: dict of arrays, one per stint sorted by (serial, insert): row (in the table), sn_code,
+##         start (clipped), stop, insert; 'serials' holds the sorted unique serials
+def buildStints(table, cutoff=gc_data.OLD_NEW_CUTOFF):
+    serials, sn_code = np.unique(table['sn'], return_inverse=True)
+    rows = np.flatnonzero(table['insert'] != gc_data.MISSING)
+    rows = rows[np.lexsort((table['remove'][rows], table['insert'][rows], sn_code[rows]))]
+    sn = sn_code[rows]
+    insert = table['insert'][rows]
+    stop = table['remove'][rows]
+    first = runStarts(sn)
+    # latest remove of the earlier stints of the same serial
+    before = groupRunningMax(sn, stop)
+    before = np.concatenate([[gc_data.MISSING], before[:-1]])
+    before[first] = gc_data.MISSING
+    start = np.maximum(insert, before)
+    keep = start < stop
+    old = gc_data.oldBatch(table, cutoff)
+    return {'row': rows[keep], 'sn_code': sn[keep], 'start': start[keep], 'stop': stop[keep],
+            'insert': insert[keep], 'batch': old[rows[keep]], 'serials': serials,
+            'clipped': int((start > insert).sum()), 'dropped': int((~keep).sum())}
+
+#### events #####################################################################################
+## input: table, stints
+## output: per event (DBE/OTB rows): stint index (-1 if not matched), time, type
+##   rows with an insert time belong to their own stint (event at its remove);
+##   rows without one go to the stint of the same serial and location containing the event time
+def matchEvents(table, stints):
+    ev = np.flatnonzero(table['event'] != gc_data.EVENT_NONE)
+    t = table['remove'][ev]
+
+    # own stint: map table row -> stint index
+    own = np.full(len(table['sn']), -1, dtype='int64')
+    own[stints['row']] = np.arange(len(stints['row']))
+    stint = own[ev]
+
+    # blank-insert rows: latest stint of the same (serial, location) that started by the event
+    blank = np.flatnonzero(table['insert'][ev] == gc_data.MISSING)
+    nloc = len(table['locations'])
+    keys = stints['sn_code'].astype('int64') * nloc + table['loc_code'][stints['row']]
+    sn = np.searchsorted(stints['serials'], table['sn'][ev[blank]])
+    qkeys = sn.astype('int64') * nloc + table['loc_code'][ev[blank]]
+    cand = lastAtOrBefore(keys, stints['insert'], qkeys, t[blank])
+    inside = (cand >= 0) & (t[blank] > stints['start'][cand]) & (t[blank] <= stints['stop'][cand])
+    stint[blank] = np.where(inside, cand, -1)
+    return {'row': ev, 'stint': stint, 'time': t, 'event': table['event'][ev]}
+
+#### start/stop table ###########################################################################
+## input: loaded gc_full table, cutoff for the old/new batch
+## output: dict of arrays, one per interval sorted by (serial, start):
+##   sn_code (index into 'serials'), loc_code (index into 'locations'), col, row, cage, slot, node,
+##   stint (number of the stint within the serial, from 0), batch (1 old, 0 new),
+##   start, stop (epochs), age_start, age_stop (years of life before start/stop),
+##   dbe, otb (events at stop), event (1 if any), out (1 on the last interval of a stint marked out)
+##   plus 'serials', 'locations' and 'counts' (stints clipped/dropped, events matched/unmatched)
+def buildTable(table, cutoff=gc_data.OLD_NEW_CUTOFF):
+    stints = buildStints(table, cutoff)
+    events = matchEvents(table, stints)
+    ns = len(stints['row'])
+    matched = events['stint'] >= 0
+
+    # cut points: the end of every stint and every matched event time, unique per stint
+    cut_stint = np.concatenate([np.arange(ns), events['stint'][matched]])
+    cut_time = np.concatenate([stints['stop'], events['time'][matched]])
+    order = np.lexsort((cut_time, cut_stint))
+    cut_stint, cut_time = cut_stint[order], cut_time[order]
+    keep = runStarts(cut_stint, cut_time)
+    stint, stop = cut_stint[keep], cut_time[keep]
+    first = runStarts(stint)
+    start = np.concatenate([[0], stop[:-1]])
+    start[first] = stints['start'][stint[first]]
+
+    # events per interval: interval index of each (stint, time)
+    interval_key = np.rec.fromarrays([stint, stop])
+    ev_key = np.rec.fromarrays([events['stint'][matched], events['time'][matched]])
+    at = np.searchsorted(interval_key, ev_key)
+    ev_type = events['event'][matched]
+    pair = np.unique(np.stack([at, ev_type]), axis=1)  # same type, same time: once
+    dbe = np.bincount(pair[0][pair[1] == gc_data.EVENT_DBE], minlength=len(stop))
+    otb = np.bincount(pair[0][pair[1] == gc_data.EVENT_OTB], minlength=len(stop))
+
+    # age: life on earlier stints of the serial plus time into this one
+    lengths = stints['stop'] - stints['start']
+    sn = stints['sn_code']
+    lived = np.cumsum(lengths) - lengths
+    lived -= np.repeat(lived[runStarts(sn)], np.diff(np.append(np.flatnonzero(runStarts(sn)), ns)))
+    into = start - stints['start'][stint]
+
+    last = np.append(stint[1:] != stint[:-1], True)
+    row = stints['row'][stint]
+    out = (table['out'][row] == 1) & last
+    stint_no = np.arange(ns) - np.flatnonzero(runStarts(sn)).repeat(
+        np.diff(np.append(np.flatnonzero(runStarts(sn)), ns)))
+
+    cp = {'sn_code': sn[stint].astype('int32'), 'loc_code': table['loc_code'][row],
+          'stint': stint_no[stint].astype('int32'), 'batch': stints['batch'][stint],
+          'start': start, 'stop': stop,
+          'age_start': (lived[stint] + into) / SECONDS_PER_YEAR,
+          'age_stop': (lived[stint] + into + stop - start) / SECONDS_PER_YEAR,
+          'dbe': dbe.astype('int16'), 'otb': otb.astype('int16'),
+          'event': ((dbe + otb) > 0).astype('int8'), 'out': out.astype('int8')}
+    for name in ('col', 'row', 'cage', 'slot', 'node'):
+        cp[name] = table[name][row]
+    cp['serials'] = stints['serials']
+    cp['locations'] = table['locations']
+    cp['counts'] = {'intervals': len(stop), 'stints': ns, 'clipped': stints['clipped'],
+                    'dropped': stints['dropped'], 'events': int(matched.sum()),
+                    'unmatched': int((~matched).sum())}
+    return cp, events
+
+#### output #####################################################################################
+COLUMNS = ('sn_code', 'loc_code', 'col', 'row', 'cage', 'slot', 'node', 'stint', 'batch',
+           'start', 'stop', 'age_start', 'age_stop', 'dbe', 'otb', 'event', 'out')
+
+## numpy archive with one array per column (np.load gives them back without parsing)
+def writeNpz(path, cp):
+    np.savez(path, serials=cp['serials'], locations=cp['locations'], **dict((c, cp[c]) for c in COLUMNS))
+
+## input: path of a file written by writeNpz
+## output: dict of arrays as returned by buildTable (without 'counts')
+def readNpz(path):
+    with np.load(path) as f:
+        return dict((name, f[name]) for name in f.files)
+
+def writeCsv(path, cp):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['SN', 'location'] + [c for c in COLUMNS if c not in ('sn_code', 'loc_code')])
+        columns = [cp['serials'][cp['sn_code']], cp['locations'][cp['loc_code']]] + \
+                  [cp[c] for c in COLUMNS if c not in ('sn_code', 'loc_code')]
+        writer.writerows(zip(*[c.tolist() for c in columns]))
+
+## unmatched events, in the format of bad_serials.dat written by tbf_analyses.py
+def writeUnmatched(path, table, events):
+    rows = events['row'][events['stint'] < 0]
+    with open(path, 'w', newline='') as f:
+        f.write('# no record for loc insert found for following GPU Serial Numbers:\n')
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerows(sorted(set(zip(table['sn'][rows].tolist(), table['location'][rows].tolist()))))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a start/stop (counting-process) table from gc_full.csv.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--cutoff', type=int, default=gc_data.OLD_NEW_CUTOFF, help='old/new batch cutoff epoch')
+    parser.add_argument('--out', default='cp_table.npz', help='numpy archive with one array per column')
+    parser.add_argument('--csv', help='also write the table as csv')
+    parser.add_argument('--unmatched', help='write serial/location of events with no stint here')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    table = gc_data.loadGcFull(args.path)
+    t1 = time.perf_counter()
+    cp, events = buildTable(table, args.cutoff)
+    t2 = time.perf_counter()
+    writeNpz(args.out, cp)
+    if args.csv:
+        writeCsv(args.csv, cp)
+    if args.unmatched:
+        writeUnmatched(args.unmatched, table, events)
+    print('Built %(intervals)d intervals from %(stints)d stints (%(clipped)d clipped, %(dropped)d dropped), '
+          '%(events)d events matched, %(unmatched)d unmatched' % cp['counts'])
+    print('Load %.3f s, build %.3f s' % (t1 - t0, t2 - t1))
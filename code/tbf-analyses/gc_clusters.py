@@ -0,0 +1,229 @@
+#### Spatio-temporal failure clusters ##########################################################
+## Looks for bursts of DBE/OTB failures on neighboring nodes, to tell environmental causes
+## (cooling, power, a bad blade) from random wear.
+##
+## Locations are decoded into (col, row, cage, slot) coordinates (see gc_data.py). The distance
+## between two failures is the largest coordinate difference (Chebyshev distance): 0 is the same
+## blade (4 nodes), 1 includes the neighboring slots, cages and cabinets.
+## A burst: a failure with earlier failures within distance d and the preceding window w, such
+## that at least k distinct nodes failed (repeated failures of one node count once).
+## Failures linked by bursts form clusters (union-find).
+##
+## Detection is one sweep over the failures sorted by time. Failures in the current window are
+## kept in a grid hashed by coordinates // (d+1), so only the 3^4 neighboring grid cells are
+## examined for each failure, never all pairs.
+##
+## Significance: the failing nodes are randomly relocated among the failing locations (each node
+## keeps its own failure times, so both the spatial and the temporal distribution are kept),
+## clusters are detected again, and
+##   - overall p-value: fraction of permutations with at least as many clustered failures,
+##   - per-cluster p-value: fraction of permutations whose largest cluster spans at least as
+##     many distinct nodes.
+## Permutations run in parallel processes.
+##
+## usage: python gc_clusters.py ../../data/gc_full.csv --k 3 --d 1 --window-hours 24 --perms 199
+####
+
+#### package imports ############################################################################
+import argparse
+import collections
+import concurrent.futures
+import csv
+import itertools
+import os
+
+import numpy as np
+
+import gc_data
+
+SECONDS_PER_HOUR = 60*60
+
+#### failures ###################################################################################
+## input: loaded gc_full table (gc_data.loadGcFull), optional time range
+## output: dict of arrays sorted by time: sn, location, loc_code, time, event,
+##         coords (n x 4: col,row,cage,slot)
+##         repeated entries (same SN, type and time) are counted once
+def failureEvents(table, since=None, until=None):
+    ev = np.flatnonzero((table['event'] != gc_data.EVENT_NONE) & (table['col'] >= 0))
+    if since is not None:
+        ev = ev[table['remove'][ev] >= since]
+    if until is not None:
+        ev = ev[table['remove'][ev] < until]
+    keys = np.rec.fromarrays([table['sn'][ev], table['event'][ev], table['remove'][ev]])
+    _, first = np.unique(keys, return_index=True)
+    ev = ev[first]
+    ev = ev[np.argsort(table['remove'][ev], kind='stable')]
+    coords = np.stack([table[k][ev] for k in ('col', 'row', 'cage', 'slot')], axis=1)
+    return {'sn': table['sn'][ev], 'location': table['location'][ev], 'loc_code': table['loc_code'][ev],
+            'time': table['remove'][ev],
+            'event': table['event'][ev], 'coords': coords.astype('int64')}
+
+#### detection ##################################################################################
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+## input: times (sorted), coords (n x 4), node ids (n), k, d, window (seconds)
+## output: cluster label per failure (-1 if not in a cluster), labels numbered 0.. by first failure
+def detectClusters(times, coords, nodes, k, d, window):
+    n = len(times)
+    size = d + 1
+    cells = [tuple(c) for c in (coords // size).tolist()]
+    points = coords.tolist()
+    nodes = nodes.tolist()
+    times = times.tolist()
+    offsets = list(itertools.product((-1, 0, 1), repeat=coords.shape[1]))
+    grid = collections.defaultdict(collections.deque)
+    parent = list(range(n))
+    linked = [False] * n
+    left = 0
+    for i in range(n):
+        t = times[i]
+        while times[left] < t - window:  # expire failures older than the window
+            grid[cells[left]].popleft()
+            left += 1
+        p = points[i]
+        near = []
+        for off in offsets:
+            cell = tuple(c + o for c, o in zip(cells[i], off))
+            if cell in grid:
+                for j in grid[cell]:
+                    q = points[j]
+                    if max(abs(a - b) for a, b in zip(p, q)) <= d:
+                        near.append(j)
+        if len(near) + 1 >= k and len(set(nodes[j] for j in near) | {nodes[i]}) >= k:
+            linked[i] = True
+            for j in near:
+                linked[j] = True
+                ri, rj = _find(parent, i), _find(parent, j)
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+        grid[cells[i]].append(i)
+
+    labels = np.full(n, -1, dtype='int64')
+    roots = {}
+    for i in range(n):
+        if linked[i]:
+            r = _find(parent, i)
+            if r not in roots:
+                roots[r] = len(roots)
+            labels[i] = roots[r]
+    return labels
+
+## distinct nodes in each cluster
+def clusterNodes(labels, nodes):
+    inside = labels >= 0
+    if not inside.any():
+        return np.zeros(0, dtype='int64')
+    pairs = np.unique(np.stack([labels[inside], nodes[inside]]), axis=1)
+    return np.bincount(pairs[0])
+
+## number of clustered failures and distinct nodes in the largest cluster
+def clusterStats(labels, nodes):
+    sizes = clusterNodes(labels, nodes)
+    return int((labels >= 0).sum()), int(sizes.max()) if len(sizes) else 0
+
+#### permutation baseline #######################################################################
+## one batch of permutations, run in a worker process
+def _permutationBatch(args):
+    times, coords, nodes, k, d, window, seeds = args
+    out = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        unique, first, inverse = np.unique(nodes, return_index=True, return_inverse=True)
+        moved = rng.permutation(len(unique))[inverse]  # node -> another failing location
+        labels = detectClusters(times, coords[first][moved], unique[moved], k, d, window)
+        out.append(clusterStats(labels, unique[moved]))
+    return out
+
+## output: array (perms x 2) of (clustered failures, largest cluster) under random placement
+def permutationBaseline(times, coords, nodes, k, d, window, perms, seed=0, jobs=None):
+    seeds = np.random.SeedSequence(seed).spawn(perms)
+    jobs = jobs or os.cpu_count() or 1
+    batches = [seeds[i::jobs] for i in range(jobs) if seeds[i::jobs]]
+    tasks = [(times, coords, nodes, k, d, window, b) for b in batches]
+    if jobs == 1:
+        results = [_permutationBatch(t) for t in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_permutationBatch, tasks))
+    return np.array([r for batch in results for r in batch], dtype='int64').reshape(-1, 2)
+
+#### report #####################################################################################
+## output: list of dicts, one per cluster, with members and p-value (None without permutations)
+def summarizeClusters(events, labels, baseline=None):
+    clusters = []
+    sizes = clusterNodes(labels, events['loc_code'])
+    for c in range(len(sizes)):
+        idx = np.flatnonzero(labels == c)
+        p = None
+        if baseline is not None and len(baseline):
+            p = (1 + int((baseline[:, 1] >= sizes[c]).sum())) / (1.0 + len(baseline))
+        clusters.append({'cluster': c, 'size': len(idx), 'nodes': int(sizes[c]),
+                         'start': events['time'][idx].min(), 'end': events['time'][idx].max(),
+                         'dbe': int((events['event'][idx] == gc_data.EVENT_DBE).sum()),
+                         'otb': int((events['event'][idx] == gc_data.EVENT_OTB).sum()),
+                         'locations': sorted(set(events['location'][idx].tolist())),
+                         'p_value': p})
+    return clusters
+
+def writeReport(prefix, events, labels, clusters):
+    with open(prefix + '_clusters.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cluster', 'size', 'nodes', 'start', 'end', 'hours', 'dbe', 'otb', 'p_value', 'locations'])
+        for c in clusters:
+            writer.writerow([c['cluster'], c['size'], c['nodes'], gc_data.formatEpochs([c['start']])[0],
+                             gc_data.formatEpochs([c['end']])[0], (c['end'] - c['start']) / SECONDS_PER_HOUR,
+                             c['dbe'], c['otb'], '' if c['p_value'] is None else c['p_value'],
+                             ' '.join(c['locations'])])
+    with open(prefix + '_members.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['SN', 'location', 'time', 'event', 'cluster'])
+        stamps = gc_data.formatEpochs(events['time'])
+        for i in np.flatnonzero(labels >= 0):
+            writer.writerow([events['sn'][i], events['location'][i], stamps[i],
+                             gc_data.EVENT_NAMES[events['event'][i]], labels[i]])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect spatio-temporal clusters of GPU failures.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--k', type=int, default=3, help='failures needed for a burst')
+    parser.add_argument('--d', type=int, default=1, help='max Chebyshev distance in (col,row,cage,slot)')
+    parser.add_argument('--window-hours', type=float, default=24.0)
+    parser.add_argument('--since', help='only failures at or after this time (UTC)')
+    parser.add_argument('--until', help='only failures before this time (UTC)')
+    parser.add_argument('--type', choices=('DBE', 'OTB'), help='only this failure type')
+    parser.add_argument('--perms', type=int, default=99, help='permutations for significance (0: none)')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: all CPUs)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='gc_clusters', help='prefix of the csv outputs')
+    args = parser.parse_args()
+
+    table = gc_data.loadGcFull(args.path)
+    if args.type:
+        table['event'] = np.where(table['event'] == (gc_data.EVENT_DBE if args.type == 'DBE' else gc_data.EVENT_OTB),
+                                  table['event'], gc_data.EVENT_NONE).astype('int8')
+    since = gc_data.parseUTC(args.since) if args.since else None
+    until = gc_data.parseUTC(args.until) if args.until else None
+    events = failureEvents(table, since, until)
+    window = int(args.window_hours * SECONDS_PER_HOUR)
+
+    labels = detectClusters(events['time'], events['coords'], events['loc_code'], args.k, args.d, window)
+    clustered, largest = clusterStats(labels, events['loc_code'])
+    print('Found', labels.max() + 1 if len(labels) else 0, 'clusters with', clustered, 'of',
+          len(labels), 'failures; largest cluster spans', largest, 'nodes')
+
+    baseline = None
+    if args.perms > 0:
+        baseline = permutationBaseline(events['time'], events['coords'], events['loc_code'],
+                                       args.k, args.d, window,
+                                       args.perms, args.seed, args.jobs)
+        p_all = (1 + int((baseline[:, 0] >= clustered).sum())) / (1.0 + len(baseline))
+        print('Permutation baseline: clustered failures mean %.1f, max %d; p-value %.4f'
+              % (baseline[:, 0].mean(), baseline[:, 0].max(), p_all))
+
+    clusters = summarizeClusters(events, labels, baseline)
+    writeReport(args.out, events, labels, clusters)
+    print('Wrote', args.out + '_clusters.csv and', args.out + '_members.csv')
@@ -0,0 +1,162 @@
+#### Shared helpers for the GPU history data ('gc_full.csv' format) ############################
+## Used by the generator, benchmark and analysis scripts in this directory.
+## Locations follow the Cray XK7 cname layout (see paper, Section III, pgs. 3 & 4):
+##   c{col}-{row}c{cage}s{slot}n{node}
+## e.g. 'c11-2c1s4n1' is column 11, row 2, cage 1, slot (blade) 4, node 1.
+####
+
+#### package imports ############################################################################
+import csv
+import re
+import time
+
+import numpy as np
+
+#### machine geometry ###########################################################################
+## Titan: 25 columns x 8 rows of cabinets, 3 cages per cabinet, 8 slots per cage, 4 nodes per slot.
+## 19200 node positions, of which 512 are service nodes (see data/titan.service.txt).
+TITAN_GEOMETRY = {'columns': 25, 'rows': 8, 'cages': 3, 'slots': 8, 'nodes': 4}
+TITAN_TOTAL_NODES = 18688
+
+CNAME_PATTERN = re.compile(r'c(\d+)-(\d+)c(\d+)s(\d+)n(\d+)$')
+
+## number of node positions in a machine of the given geometry
+def geometrySize(geometry):
+    return (geometry['columns'] * geometry['rows'] * geometry['cages'] *
+            geometry['slots'] * geometry['nodes'])
+
+## input: location string, e.g. 'c11-2c1s4n1'
+## output: tuple (col, row, cage, slot, node), or None if the string is not a cname
+def decodeCname(location):
+    m = CNAME_PATTERN.match(location)
+    if m is None:
+        return None
+    return tuple(int(x) for x in m.groups())
+
+def formatCname(col, row, cage, slot, node):
+    return 'c%d-%dc%ds%dn%d' % (col, row, cage, slot, node)
+
+## input: flat position index (0 .. geometrySize-1), scalar or numpy array
+## output: tuple of (col, row, cage, slot, node) with the same shape as the input.
+## node varies fastest, so consecutive positions fill a blade, then a cage, then a cabinet.
+def positionToCoords(position, geometry):
+    position = np.asarray(position)
+    node = position % geometry['nodes']
+    rest = position // geometry['nodes']
+    slot = rest % geometry['slots']
+    rest = rest // geometry['slots']
+    cage = rest % geometry['cages']
+    rest = rest // geometry['cages']
+    row = rest % geometry['rows']
+    col = rest // geometry['rows']
+    return (col, row, cage, slot, node)
+
+#### time helpers ###############################################################################
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+## same conversion as epoch() in tbf_analyses.py
+def epoch(timestring):
+    return int(time.mktime(time.strptime(timestring, TIME_FORMAT)))
+
+## input: numpy array of epoch seconds
+## output: numpy array of 'YYYY-MM-DD HH:MM:SS' strings (UTC)
+def formatEpochs(epochs):
+    stamps = np.datetime_as_string(np.asarray(epochs, dtype='int64').astype('datetime64[s]'), unit='s')
+    return np.char.replace(stamps, 'T', ' ')
+
+## input: 'YYYY-MM-DD HH:MM:SS' string (UTC)
+## output: epoch seconds as int
+def parseUTC(timestring):
+    return int(np.datetime64(timestring.replace(' ', 'T'), 's').astype('int64'))
+
+MISSING = -1  # missing time or duration in loaded tables
+
+## input: sequence of 'YYYY-MM-DD HH:MM:SS' strings (UTC), '' for missing
+## output: int64 array of epoch seconds, MISSING for missing
+def parseTimes(strings):
+    stamps = np.asarray(strings).astype('datetime64[s]').astype('int64')
+    stamps[stamps == np.iinfo('int64').min] = MISSING
+    return stamps
+
+#### column-wise loading of gc_full.csv #########################################################
+## event codes used in the loaded table
+EVENT_NONE = 0
+EVENT_DBE = 1
+EVENT_OTB = 2
+EVENT_NAMES = np.array(['', 'DBE', 'OTB'])
+
+## default old/new batch cutoff, as oldNew_cutoff_epoch in tbf_analyses.py
+OLD_NEW_CUTOFF = 1451620140
+
+## input: path of a csv file in the 'gc_full.csv' format
+## output: dict of numpy arrays, one entry per row of the file:
+##   sn, location (str); insert, remove, duration (int64, MISSING if empty);
+##   out (int8: 1 TRUE, 0 FALSE, -1 empty); event (int8: EVENT_*);
+##   col, row, cage, slot, node (int32, -1 if the location is not a cname);
+##   loc_code (int32) indexes 'locations', the sorted unique location strings.
+## Times are read as UTC.
+def loadGcFull(path):
+    with open(path, newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader)  # skip header
+        columns = list(zip(*csv_reader))
+    if not columns:
+        columns = [()] * 7
+    table = {}
+    table['sn'] = np.array(columns[0], dtype=str)
+    table['location'] = np.array(columns[1], dtype=str)
+    table['insert'] = parseTimes(np.array(columns[2], dtype=str))
+    table['remove'] = parseTimes(np.array(columns[3], dtype=str))
+    duration = np.array(columns[4], dtype='U32')
+    duration[duration == ''] = str(MISSING)
+    table['duration'] = duration.astype('int64')
+    out = np.array(columns[5], dtype=str)
+    table['out'] = np.where(out == 'TRUE', 1, np.where(out == 'FALSE', 0, -1)).astype('int8')
+    event = np.array(columns[6], dtype=str)
+    table['event'] = np.where(event == 'DBE', EVENT_DBE, np.where(event == 'OTB', EVENT_OTB, EVENT_NONE)).astype('int8')
+
+    locations, loc_code = np.unique(table['location'], return_inverse=True)
+    table['locations'] = locations
+    table['loc_code'] = loc_code.astype('int32')
+    coords = np.array([decodeCname(x) or (-1, -1, -1, -1, -1) for x in locations], dtype='int32').reshape(-1, 5)
+    for i, name in enumerate(('col', 'row', 'cage', 'slot', 'node')):
+        table[name] = coords[loc_code, i]
+    return table
+
+#### column-wise loading of gc_summary_loc.csv #################################################
+## input: path of a csv file in the 'gc_summary_loc.csv' format (one row per GPU lifetime,
+##        written by TitanGPUmodel.Rmd)
+## output: dict of numpy arrays, one entry per row of the file:
+##   sn, batch (str: 'old'/'new'); days, years (float64);
+##   out, dead, dead_otb, dead_dbe (bool); col, row, cage, slot, node (int32, -1 if empty)
+def loadSummary(path):
+    with open(path, newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        columns = dict(zip(header, zip(*csv_reader)))
+    if not columns:
+        columns = dict((name, ()) for name in header)
+    table = {}
+    table['sn'] = np.array(columns['SN'], dtype=str)
+    table['batch'] = np.array(columns['batch'], dtype=str)
+    for name in ('days', 'years'):
+        table[name] = np.array(columns[name], dtype='float64')
+    for name in ('out', 'dead', 'dead_otb', 'dead_dbe'):
+        table[name] = np.array(columns[name], dtype=str) == 'TRUE'
+    for name in ('col', 'row', 'cage', 'slot', 'node'):
+        values = np.array(columns[name], dtype='U8')
+        values[values == ''] = '-1'
+        table[name] = values.astype('int32')
+    return table
+
+## input: loaded table, cutoff epoch
+## output: per row, 1 if the row's GPU is in the old batch (earliest insert before the cutoff),
+##         0 if new, -1 if the GPU has no insert time at all (as oldNew_dict_GPUwise in tbf_analyses.py)
+def oldBatch(table, cutoff=OLD_NEW_CUTOFF):
+    serials, inverse = np.unique(table['sn'], return_inverse=True)
+    first = np.full(len(serials), np.iinfo('int64').max, dtype='int64')
+    has = table['insert'] != MISSING
+    np.minimum.at(first, inverse[has], table['insert'][has])
+    old = np.where(first < cutoff, 1, 0).astype('int8')
+    old[first == np.iinfo('int64').max] = -1
+    return old[inverse]
@@ -0,0 +1,450 @@
+#### Partitioned multi-system GPU history dataset ################################################
+## Keeps the histories ('gc_full.csv' format) of several machines in one directory tree, split by
+## system and calendar year (of the remove/event time), one numpy file per column:
+##   root/system=titan/_metadata.json        node count, geometry, cutoffs, partition statistics
+##   root/system=titan/serials.npy           sorted unique serials (sn_code indexes them)
+##   root/system=titan/first_insert.npy      earliest insert of each serial (MISSING if none)
+##   root/system=titan/locations.npy         sorted unique locations (loc_code indexes them)
+##   root/system=titan/period=2016/<column>.npy
+## Columns: row (line in the source file), sn_code, loc_code, insert, remove, duration, out, event,
+## col, row_, cage, slot, node; types and missing values as in gc_data.loadGcFull.
+##
+## Filters are pushed down in three steps, so only the relevant files are read:
+##   1. systems            only the selected system directories are opened
+##   2. partitions         per-partition statistics in _metadata.json (time range of inserts and
+##                         removes, event counts by type, ranges of the location codes present)
+##                         drop partitions that cannot match; loc globs and location levels are
+##                         first turned into the codes of the matching locations of the system,
+##                         so a system without any matching location is not opened at all
+##   3. rows               the filter columns are memory-mapped and only matching rows of the
+##                         requested columns are copied
+## Filters (keyword arguments): since, until (epochs; rows with remove in [since, until), or with
+## overlap=True the stints overlapping it), col, row, cage, slot, node (lists of ints), loc (cname
+## glob patterns), serial (list), batch ('old'/'new', from the system's old/new cutoff) and type
+## ('DBE'/'OTB': event rows of that type).
+##
+## Quarterly MTBF: every partition is reduced in its own process to (count, first, last) of the
+## distinct failure times per quarter, failure type and cohort. MTBF in a quarter is the mean
+## difference of successive failure times, (last - first) / (count - 1), as calcTimeSlicedMTBF in
+## tbf_analyses.py, so partials of several machines merge by adding counts and taking the earliest
+## first and latest last time, without re-reading any rows.
+##
+## tbf_analyses.py reads one system of a dataset, with the system's node count and cutoff, when
+## TBF_DATASET=<root> and TBF_SYSTEM=<name> are set.
+##
+## usage: python gc_dataset.py ingest data/gc_dataset titan ../../data/gc_full.csv --end 2019-07-01
+##        python gc_dataset.py info data/gc_dataset
+##        python gc_dataset.py mtbf data/gc_dataset --since 2017-01-01 --loc 'c1*' --out mtbf.csv
+####
+
+#### package imports ############################################################################
+import argparse
+import concurrent.futures
+import csv
+import fnmatch
+import json
+import os
+import shutil
+
+import numpy as np
+
+import gc_data
+
+METADATA = '_metadata.json'
+COLUMNS = ('row', 'sn_code', 'loc_code', 'insert', 'remove', 'duration', 'out', 'event',
+           'col', 'row_', 'cage', 'slot', 'node')
+LEVELS = ('col', 'row', 'cage', 'slot', 'node')
+TYPES = {'DBE': gc_data.EVENT_DBE, 'OTB': gc_data.EVENT_OTB}
+COHORTS = ('all', 'old', 'new')
+SECONDS_PER_HOUR = 60*60
+
+## sorted codes -> list of [first, last] runs of consecutive codes
+def _codeRanges(codes):
+    if len(codes) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(codes) != 1)
+    firsts = np.r_[codes[0], codes[breaks + 1]]
+    lasts = np.r_[codes[breaks], codes[-1]]
+    return [[int(a), int(b)] for a, b in zip(firsts, lasts)]
+
+## location level -> column name in the partitions ('row' holds the line number)
+def _levelColumn(level):
+    return 'row_' if level == 'row' else level
+
+def _systemDir(root, system):
+    return os.path.join(root, 'system=%s' % system)
+
+def _periodDir(root, system, period):
+    return os.path.join(_systemDir(root, system), 'period=%s' % period)
+
+## years of epoch times
+def _years(epochs):
+    return np.asarray(epochs, dtype='int64').astype('datetime64[s]').astype('datetime64[Y]').astype('int64') + 1970
+
+#### writing ####################################################################################
+## input: dataset root, system name, loaded gc_full table (gc_data.loadGcFull), node count,
+##        geometry, cutoffs (dict name -> epoch, 'old_new' is the old/new batch cutoff)
+## output: metadata written; an existing system of the same name is replaced
+def writeSystem(root, system, table, nodes=gc_data.TITAN_TOTAL_NODES, geometry=None,
+                cutoffs=None, source=None):
+    geometry = dict(geometry or gc_data.TITAN_GEOMETRY)
+    cutoffs = dict(cutoffs or {'old_new': gc_data.OLD_NEW_CUTOFF})
+    final = _systemDir(root, system)
+    tmp = final + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    serials, sn_code = np.unique(table['sn'], return_inverse=True)
+    has = table['insert'] != gc_data.MISSING
+    first = np.full(len(serials), np.iinfo('int64').max, dtype='int64')
+    np.minimum.at(first, sn_code[has], table['insert'][has])
+    first[first == np.iinfo('int64').max] = gc_data.MISSING
+    np.save(os.path.join(tmp, 'serials.npy'), serials)
+    np.save(os.path.join(tmp, 'first_insert.npy'), first)
+    np.save(os.path.join(tmp, 'locations.npy'), table['locations'])
+
+    columns = {'row': np.arange(len(sn_code), dtype='int64'), 'sn_code': sn_code.astype('int32'),
+               'row_': table['row']}
+    for name in COLUMNS:
+        if name not in columns:
+            columns[name] = table[name]
+    years = _years(table['remove'])
+    partitions = {}
+    for year in np.unique(years).tolist():
+        rows = np.flatnonzero(years == year)
+        path = os.path.join(tmp, 'period=%d' % year)
+        os.makedirs(path)
+        for name in COLUMNS:
+            np.save(os.path.join(path, name + '.npy'), columns[name][rows])
+        ins = table['insert'][rows]
+        ins = ins[ins != gc_data.MISSING]
+        ev = table['event'][rows]
+        partitions[str(year)] = {
+            'rows': len(rows),
+            'min_insert': int(ins.min()) if len(ins) else None,
+            'min_remove': int(table['remove'][rows].min()), 'max_remove': int(table['remove'][rows].max()),
+            'events': dict((name, int((ev == code).sum())) for name, code in TYPES.items()),
+            'loc_ranges': _codeRanges(np.unique(columns['loc_code'][rows]))}
+    meta = {'system': system, 'nodes': int(nodes), 'geometry': geometry, 'cutoffs': cutoffs,
+            'source': source, 'rows': len(sn_code), 'serials': len(serials),
+            'locations': len(table['locations']), 'partitions': partitions}
+    with open(os.path.join(tmp, METADATA), 'w') as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+    shutil.rmtree(final, ignore_errors=True)
+    os.rename(tmp, final)
+    return meta
+
+## input: dataset root, system name, path of a 'gc_full.csv'-format file, options of writeSystem
+def ingestCsv(root, system, path, **kwargs):
+    return writeSystem(root, system, gc_data.loadGcFull(path), source=os.path.abspath(path), **kwargs)
+
+#### reading ####################################################################################
+class Dataset(object):
+    ## input: dataset root directory
+    def __init__(self, root):
+        self.root = root
+        self.metadata = {}
+        for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            path = os.path.join(root, name, METADATA)
+            if name.startswith('system=') and os.path.exists(path):
+                with open(path) as f:
+                    self.metadata[name[len('system='):]] = json.load(f)
+        self._dicts = {}
+
+    def systems(self):
+        return list(self.metadata)
+
+    def meta(self, system):
+        if system not in self.metadata:
+            raise KeyError('no system %r in %s (found: %s)' % (system, self.root, ', '.join(self.metadata)))
+        return self.metadata[system]
+
+    ## per-system arrays: serials, first_insert, locations (loaded once)
+    def dictionaries(self, system):
+        if system not in self._dicts:
+            base = _systemDir(self.root, system)
+            self._dicts[system] = dict((name, np.load(os.path.join(base, name + '.npy')))
+                                       for name in ('serials', 'first_insert', 'locations'))
+        return self._dicts[system]
+
+    #### pushdown ###############################################################################
+    ## input: system, cname glob patterns (or None), location levels (lists of ints, or None)
+    ## output: sorted codes of the system's locations matching a pattern and all the levels
+    def locationCodes(self, system, patterns=None, **levels):
+        names = self.dictionaries(system)['locations'].tolist()
+        keep = np.ones(len(names), dtype=bool)
+        if patterns is not None:
+            keep &= np.array([any(fnmatch.fnmatchcase(name, p) for p in patterns) for name in names], dtype=bool)
+        levels = dict((level, values) for level, values in levels.items() if values is not None)
+        if levels:
+            coords = [gc_data.decodeCname(name) or (-1,) * len(LEVELS) for name in names]
+            coords = np.array(coords, dtype='int64').reshape(-1, len(LEVELS))
+            for level, values in levels.items():
+                keep &= np.isin(coords[:, LEVELS.index(level)], values)
+        return np.flatnonzero(keep)
+
+    ## output: list of (system, period) that can hold rows matching the filters
+    def partitions(self, systems=None, since=None, until=None, overlap=False, loc=None, type=None, **rest):
+        levels = dict((level, rest[level]) for level in LEVELS if rest.get(level) is not None)
+        selected = []
+        for system in systems or self.systems():
+            codes = self.locationCodes(system, loc, **levels) if loc is not None or levels else None
+            if codes is not None and len(codes) == 0:
+                continue
+            for period, stats in sorted(self.meta(system)['partitions'].items()):
+                if since is not None and stats['max_remove'] < since:
+                    continue
+                if until is not None:
+                    earliest = stats['min_remove']
+                    if overlap and stats['min_insert'] is not None:
+                        earliest = min(earliest, stats['min_insert'])
+                    if earliest >= until:
+                        continue
+                if codes is not None:
+                    ranges = np.array(stats['loc_ranges'], dtype='int64').reshape(-1, 2)
+                    run = np.searchsorted(ranges[:, 0], codes, side='right') - 1
+                    if not np.any((run >= 0) & (codes <= ranges[np.maximum(run, 0), 1])):
+                        continue
+                if type is not None and not any(stats['events'][t] for t in type):
+                    continue
+                selected.append((system, period))
+        return selected
+
+    ## input: system, period, columns to return, filters
+    ## output: dict of arrays of the matching rows (only the filter and requested columns are read)
+    def readPartition(self, system, period, columns=COLUMNS, since=None, until=None, overlap=False,
+                      loc=None, serial=None, batch=None, type=None, **levels):
+        path = _periodDir(self.root, system, period)
+        cache = {}
+
+        def column(name):
+            if name not in cache:
+                cache[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            return cache[name]
+
+        mask = None
+        def narrow(m):
+            return m if mask is None else mask & m
+
+        remove = None
+        if since is not None or until is not None:
+            remove = column('remove')
+            lo = np.iinfo('int64').min if since is None else since
+            hi = np.iinfo('int64').max if until is None else until
+            if overlap:
+                start = np.where(column('insert') == gc_data.MISSING, remove, column('insert'))
+                mask = narrow((remove >= lo) & (start < hi))
+            else:
+                mask = narrow((remove >= lo) & (remove < hi))
+        for level, values in levels.items():
+            if level not in LEVELS:
+                raise ValueError('unknown filter %r' % level)
+            if values is not None:
+                mask = narrow(np.isin(column(_levelColumn(level)), values))
+        dicts = self.dictionaries(system)
+        if loc is not None:
+            mask = narrow(np.isin(column('loc_code'), self.locationCodes(system, loc)))
+        if serial is not None:
+            codes = np.flatnonzero(np.isin(dicts['serials'], serial))
+            mask = narrow(np.isin(column('sn_code'), codes))
+        if batch is not None:
+            old = self.cohorts(system)[column('sn_code')]
+            mask = narrow(np.isin(old, [{'old': 1, 'new': 0}[b] for b in batch]))
+        if type is not None:
+            mask = narrow(np.isin(column('event'), [TYPES[t] for t in type]))
+
+        rows = slice(None) if mask is None else np.flatnonzero(mask)
+        return dict((name, np.asarray(column(name)[rows])) for name in columns)
+
+    ## per serial code: 1 old batch, 0 new, -1 no insert time (as gc_data.oldBatch)
+    def cohorts(self, system):
+        first = self.dictionaries(system)['first_insert']
+        old = np.where(first < self.meta(system)['cutoffs']['old_new'], 1, 0).astype('int8')
+        old[first == gc_data.MISSING] = -1
+        return old
+
+    ## output: yields (system, period, dict of arrays) for the pruned partitions
+    def scan(self, columns=COLUMNS, systems=None, **filters):
+        for system, period in self.partitions(systems, **filters):
+            yield system, period, self.readPartition(system, period, columns, **filters)
+
+    ## output: one system as a table in the format of gc_data.loadGcFull, rows in source order
+    def load(self, system, **filters):
+        parts = [part for _, _, part in self.scan(COLUMNS, [system], **filters)]
+        data = dict((name, np.concatenate([p[name] for p in parts]) if parts else
+                     np.zeros(0, dtype='int64')) for name in COLUMNS)
+        order = np.argsort(data['row'], kind='stable')
+        dicts = self.dictionaries(system)
+        table = {'sn': dicts['serials'][data['sn_code'][order]],
+                 'location': dicts['locations'][data['loc_code'][order]],
+                 'locations': dicts['locations'], 'loc_code': data['loc_code'][order]}
+        for name in ('insert', 'remove', 'duration', 'out', 'event', 'col', 'cage', 'slot', 'node'):
+            table[name] = data[name][order]
+        table['row'] = data['row_'][order]
+        return table
+
+    ## output: yields the rows of one system as csv fields in the 'gc_full.csv' format, header
+    ##         first, in source order (the strings read by tbf_analyses.py)
+    def csvRows(self, system, **filters):
+        table = self.load(system, **filters)
+        yield ['SN', 'location', 'insert', 'remove', 'duration', 'out', 'event']
+        insert = np.where(table['insert'] == gc_data.MISSING, '', gc_data.formatEpochs(np.maximum(table['insert'], 0)))
+        duration = np.where(table['duration'] == gc_data.MISSING, '', table['duration'].astype(str))
+        out = np.array(['', 'FALSE', 'TRUE'])[table['out'] + 1]
+        columns = (table['sn'], table['location'], insert, gc_data.formatEpochs(table['remove']),
+                   duration, out, gc_data.EVENT_NAMES[table['event']])
+        for row in zip(*(c.tolist() for c in columns)):
+            yield list(row)
+
+#### quarterly MTBF #############################################################################
+## quarter label of epochs, e.g. '2017-Q3'
+def quarterLabels(epochs):
+    months = np.asarray(epochs, dtype='int64').astype('datetime64[s]').astype('datetime64[M]').astype('int64')
+    return np.char.add(np.char.add((months // 12 + 1970).astype(str), '-Q'), (months % 12 // 3 + 1).astype(str))
+
+## one partition, run in a worker process
+## input: (root, system, period, filters)
+## output: dict (system, quarter, type, cohort) -> (count, first, last) of the distinct failure times
+def quarterPartials(args):
+    root, system, period, filters = args
+    dataset = Dataset(root)
+    filters = dict(filters)
+    types = filters.pop('type', None) or list(TYPES)
+    part = dataset.readPartition(system, period, ('sn_code', 'remove', 'event'), type=types, **filters)
+    old = dataset.cohorts(system)[part['sn_code']]
+    quarter = quarterLabels(part['remove'])
+    partials = {}
+    for name in types + ['ANY']:
+        is_type = part['event'] == TYPES[name] if name != 'ANY' else np.ones(len(old), dtype=bool)
+        for cohort, in_cohort in (('all', True), ('old', old == 1), ('new', old == 0)):
+            rows = np.flatnonzero(is_type & in_cohort)
+            if len(rows) == 0:
+                continue
+            # distinct times per quarter, as the set() of epochs in tbf_analyses.py
+            keys, first = np.unique(np.rec.fromarrays([quarter[rows], part['remove'][rows]]), return_index=True)
+            q = keys['f0']
+            bounds = np.flatnonzero(np.r_[True, q[1:] != q[:-1], True])
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                partials[(system, str(q[lo]), name, cohort)] = (int(hi - lo), int(keys['f1'][lo]), int(keys['f1'][hi - 1]))
+    return partials
+
+## merges partials of the same key, and adds fleet-wide keys (system 'all') over the systems
+def mergePartials(partials_list, fleet=True):
+    merged = {}
+    for partials in partials_list:
+        for key, value in partials.items():
+            keys = [key, ('all',) + key[1:]] if fleet else [key]
+            for k in keys:
+                if k in merged:
+                    n, first, last = merged[k]
+                    merged[k] = (n + value[0], min(first, value[1]), max(last, value[2]))
+                else:
+                    merged[k] = value
+    return merged
+
+## input: dataset, filters (see Dataset.readPartition), worker processes
+## output: dict (system or 'all', quarter, type, cohort) -> (failures, first, last, MTBF hours;
+##         inf with fewer than 2 failures)
+def quarterlyMTBF(dataset, systems=None, jobs=None, **filters):
+    filters.setdefault('type', list(TYPES))
+    tasks = [(dataset.root, system, period, filters) for system, period in dataset.partitions(systems, **filters)]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) <= 1:
+        results = [quarterPartials(t) for t in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(quarterPartials, tasks))
+    merged = mergePartials(results, fleet=len(set(t[1] for t in tasks)) > 1)
+    return dict((key, (n, first, last, (last - first) / float(n - 1) / SECONDS_PER_HOUR if n > 1 else float('inf')))
+                for key, (n, first, last) in merged.items())
+
+def writeMTBF(path, mtbf):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['system', 'quarter', 'type', 'cohort', 'failures', 'mtbf_hours'])
+        for key in sorted(mtbf, key=lambda k: (k[0] == 'all', k[0], k[1], k[2], COHORTS.index(k[3]))):
+            writer.writerow(list(key) + [mtbf[key][0], '%.3f' % mtbf[key][3]])
+
+#### command line ###############################################################################
+def parseTime(text):
+    return gc_data.parseUTC(text if len(text) > 10 else text + ' 00:00:00')
+
+## command line filters -> keyword arguments of Dataset.partitions/readPartition
+def parseFilters(args):
+    filters = {}
+    for key in ('since', 'until'):
+        if getattr(args, key):
+            filters[key] = parseTime(getattr(args, key))
+    for level in LEVELS:
+        if getattr(args, level):
+            filters[level] = [int(x) for x in getattr(args, level).split(',')]
+    for key in ('loc', 'serial', 'batch', 'type'):
+        if getattr(args, key):
+            filters[key] = getattr(args, key).split(',')
+    if args.overlap:
+        filters['overlap'] = True
+    return filters
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partitioned multi-system GPU history dataset.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ingest = sub.add_parser('ingest', help='add (or replace) a system from a gc_full.csv-format file')
+    ingest.add_argument('root')
+    ingest.add_argument('system')
+    ingest.add_argument('path')
+    ingest.add_argument('--node-count', type=int, default=gc_data.TITAN_TOTAL_NODES, help='GPU nodes in service')
+    ingest.add_argument('--cutoff', type=parseTime, default=gc_data.OLD_NEW_CUTOFF, help='old/new batch cutoff (UTC)')
+    ingest.add_argument('--end', type=parseTime,
+                        help='end of service (UTC); tbf_analyses.py plots the quarters before it (Titan: 2019-07-01)')
+    for name in gc_data.TITAN_GEOMETRY:
+        ingest.add_argument('--' + name, type=int, help='cabinet geometry (default: Titan)')
+    info = sub.add_parser('info', help='list systems and partitions')
+    info.add_argument('root')
+    mtbf = sub.add_parser('mtbf', help='quarterly MTBF per system and fleet-wide')
+    mtbf.add_argument('root')
+    mtbf.add_argument('--out', default='quarterly_mtbf.csv')
+    mtbf.add_argument('--jobs', type=int, help='worker processes (default: all CPUs)')
+    mtbf.add_argument('--system', help='comma list of systems (default: all)')
+    for p in (info, mtbf):
+        p.add_argument('--since')
+        p.add_argument('--until')
+        p.add_argument('--overlap', action='store_true', help='time filter on stint overlap, not remove time')
+        for level in LEVELS:
+            p.add_argument('--' + level, help='comma list of values')
+        p.add_argument('--loc', help='comma list of cname glob patterns')
+        p.add_argument('--serial')
+        p.add_argument('--batch', help='old, new')
+        p.add_argument('--type', help='DBE, OTB')
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        geometry = dict(gc_data.TITAN_GEOMETRY)
+        for name in geometry:
+            if getattr(args, name) is not None:
+                geometry[name] = getattr(args, name)
+        cutoffs = {'old_new': args.cutoff}
+        if args.end is not None:
+            cutoffs['end'] = args.end
+        meta = ingestCsv(args.root, args.system, args.path, nodes=args.node_count, geometry=geometry,
+                         cutoffs=cutoffs)
+        print('Wrote system %s: %d rows in %d partitions' % (args.system, meta['rows'], len(meta['partitions'])))
+    elif args.command == 'info':
+        dataset = Dataset(args.root)
+        filters = parseFilters(args)
+        selected = set(dataset.partitions(**filters))
+        for system in dataset.systems():
+            meta = dataset.meta(system)
+            print('%s: %d nodes, %d rows, %d serials, old/new cutoff %s' % (
+                system, meta['nodes'], meta['rows'], meta['serials'],
+                gc_data.formatEpochs([meta['cutoffs']['old_new']])[0]))
+            for period, stats in sorted(meta['partitions'].items()):
+                print('  %s %s %8d rows  DBE %5d  OTB %5d' % ('*' if (system, period) in selected else ' ',
+                      period, stats['rows'], stats['events']['DBE'], stats['events']['OTB']))
+        if filters:
+            print('* partitions read for the filters:', len(selected))
+    else:
+        dataset = Dataset(args.root)
+        systems = args.system.split(',') if args.system else None
+        result = quarterlyMTBF(dataset, systems, args.jobs, **parseFilters(args))
+        writeMTBF(args.out, result)
+        print('Wrote', len(result), 'quarterly MTBF values to', args.out)
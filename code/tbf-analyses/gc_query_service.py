@@ -0,0 +1,412 @@
+#### Local query service over the GPU reliability data ########################################
+## Loads a 'gc_full.csv'-format history once and answers filter/group/aggregate queries over HTTP
+## on localhost or on a Unix socket, so one-off questions do not need an edit of tbf_analyses.py.
+##
+## Tables:
+##   events    - DBE/OTB rows (repeated entries, same SN/type/time, are counted once)
+##   stints    - life records (rows with an insert time); exposure is clipped to since/until
+##   lifetimes - one record per GPU serial (first insert, last seen, total time, failures)
+##
+## Requests (GET, JSON responses):
+##   /query?table=events&cage=2&since=2017-01-01&group=batch&agg=mtbf
+##   /query?table=events&loc=c9-*&batch=new&group=type
+##   /query?table=lifetimes&serial=0320117100219
+##   /serial/<SN>          lifetime, stints and events of one GPU
+##   /status               file, load time, row counts, cache statistics
+## Filters: serial, loc (glob on the cname), col, row, cage, slot, node (comma lists of ints),
+##          batch (old/new), type (DBE/OTB), since, until ('YYYY-MM-DD[ HH:MM:SS]', UTC).
+## group: comma list of col, row, cage, slot, node, batch, type, year, quarter, serial.
+## agg:   count (default), hours (stints: GPU-hours), mtbf (events: GPU-hours / failures, with
+##        stints filtered the same way; time grouping is not supported for mtbf).
+##
+## Indexes on serial, each location level and time are built at load. Results are kept in an
+## LRU cache that is dropped when the data file changes (mtime or size).
+##
+## usage: python gc_query_service.py ../../data/gc_full.csv --port 8765
+##        python gc_query_service.py ../../data/gc_full.csv --socket /tmp/gcq.sock
+##        curl 'http://127.0.0.1:8765/query?table=events&cage=2&since=2017-01-01&agg=mtbf'
+####
+
+#### package imports ############################################################################
+import argparse
+import fnmatch
+import functools
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import gc_data
+
+LEVELS = ('col', 'row', 'cage', 'slot', 'node')
+GROUP_KEYS = LEVELS + ('batch', 'type', 'year', 'quarter', 'serial')
+FILTER_KEYS = LEVELS + ('serial', 'loc', 'batch', 'type', 'since', 'until')
+QUERY_KEYS = FILTER_KEYS + ('table', 'group', 'agg', 'limit')
+BATCH_NAMES = {1: 'old', 0: 'new', -1: 'unknown'}
+
+#### tables and indexes #########################################################################
+class Table(object):
+    ## columns: dict of equal-length numpy arrays; time_column: column used for the time index
+    def __init__(self, columns, time_column):
+        self.columns = columns
+        self.n = len(columns['sn'])
+        self.time = columns[time_column]
+        self.by_time = np.argsort(self.time, kind='stable')
+        self.sorted_time = self.time[self.by_time]
+        order = np.argsort(columns['sn'], kind='stable')
+        serials, starts = np.unique(columns['sn'][order], return_index=True)
+        self.by_serial = dict(zip(serials, np.split(order, starts[1:]) if len(order) else []))
+        self.by_level = {}
+        for level in LEVELS:
+            values = columns[level]
+            order = np.argsort(values, kind='stable')
+            keys, starts = np.unique(values[order], return_index=True)
+            self.by_level[level] = dict(zip(keys.tolist(), np.split(order, starts[1:]) if len(order) else []))
+
+    ## input: parsed filters (see parseFilters)
+    ## output: sorted row indices matching all filters
+    def select(self, filters):
+        candidates = None
+        if 'serial' in filters:
+            candidates = np.sort(np.concatenate([self.by_serial.get(s, np.zeros(0, dtype='int64'))
+                                                 for s in filters['serial']]))
+        for level in LEVELS:
+            if level in filters:
+                idx = np.sort(np.concatenate([self.by_level[level].get(v, np.zeros(0, dtype='int64'))
+                                              for v in filters[level]]))
+                candidates = idx if candidates is None else np.intersect1d(candidates, idx, assume_unique=True)
+        if 'since' in filters or 'until' in filters:
+            lo = np.searchsorted(self.sorted_time, filters.get('since', np.iinfo('int64').min), side='left')
+            hi = np.searchsorted(self.sorted_time, filters.get('until', np.iinfo('int64').max), side='left')
+            idx = np.sort(self.by_time[lo:hi])
+            candidates = idx if candidates is None else np.intersect1d(candidates, idx, assume_unique=True)
+        if candidates is None:
+            candidates = np.arange(self.n)
+        mask = np.ones(len(candidates), dtype=bool)
+        if 'loc_codes' in filters:
+            mask &= np.isin(self.columns['loc_code'][candidates], filters['loc_codes'])
+        if 'batch' in filters:
+            mask &= np.isin(self.columns['old'][candidates], filters['batch'])
+        if 'type' in filters and 'event' in self.columns:
+            mask &= np.isin(self.columns['event'][candidates], filters['type'])
+        return candidates[mask]
+
+## builds the events, stints and lifetimes tables from a loaded gc_full table
+def buildTables(raw, cutoff):
+    raw['old'] = gc_data.oldBatch(raw, cutoff)
+    names = ('sn', 'loc_code', 'old') + LEVELS
+
+    # events: drop repeated entries (same SN, type and time)
+    ev = np.flatnonzero(raw['event'] != gc_data.EVENT_NONE)
+    keys = np.rec.fromarrays([raw['sn'][ev], raw['event'][ev], raw['remove'][ev]])
+    _, first = np.unique(keys, return_index=True)
+    ev = np.sort(ev[first])
+    events = {k: raw[k][ev] for k in names}
+    events['event'] = raw['event'][ev]
+    events['time'] = raw['remove'][ev]
+
+    st = np.flatnonzero(raw['insert'] != gc_data.MISSING)
+    stints = {k: raw[k][st] for k in names}
+    stints['insert'] = raw['insert'][st]
+    stints['remove'] = raw['remove'][st]
+
+    # lifetimes: one record per serial
+    serials, inverse = np.unique(raw['sn'], return_inverse=True)
+    n = len(serials)
+    has = raw['insert'] != gc_data.MISSING
+    first_insert = np.full(n, np.iinfo('int64').max, dtype='int64')
+    np.minimum.at(first_insert, inverse[has], raw['insert'][has])
+    last = np.full(n, gc_data.MISSING, dtype='int64')
+    np.maximum.at(last, inverse, raw['remove'])
+    seconds = np.bincount(inverse[has], weights=np.maximum(raw['duration'][has], 0), minlength=n)
+    ev_inv = np.searchsorted(serials, events['sn'])
+    dbe = np.bincount(ev_inv[events['event'] == gc_data.EVENT_DBE], minlength=n)
+    otb = np.bincount(ev_inv[events['event'] == gc_data.EVENT_OTB], minlength=n)
+    nlife = np.bincount(inverse[has], minlength=n)
+    out = np.zeros(n, dtype=bool)
+    np.logical_or.at(out, inverse, raw['out'] == 1)
+    # location with the longest stint, as max_loc in TitanGPUmodel.Rmd
+    order = np.lexsort((np.where(has, raw['duration'], -2), inverse))
+    last_of = np.r_[np.flatnonzero(np.diff(inverse[order])), len(order) - 1] if len(order) else order
+    max_row = order[last_of]
+    lifetimes = {'sn': serials, 'loc_code': raw['loc_code'][max_row],
+                 'old': np.where(first_insert < cutoff, 1, 0).astype('int8')}
+    lifetimes['old'][first_insert == np.iinfo('int64').max] = -1
+    for level in LEVELS:
+        lifetimes[level] = raw[level][max_row]
+    first_insert[first_insert == np.iinfo('int64').max] = gc_data.MISSING
+    lifetimes.update({'first_insert': first_insert, 'last': last, 'years': seconds / (60*60*8760),
+                      'nlife': nlife, 'dbe': dbe, 'otb': otb, 'out': out,
+                      'dead': out & (dbe + otb > 0)})
+    return {'events': Table(events, 'time'), 'stints': Table(stints, 'insert'),
+            'lifetimes': Table(lifetimes, 'first_insert')}
+
+#### query evaluation ###########################################################################
+def parseTime(text):
+    text = text.strip()
+    if len(text) == 10:
+        text += ' 00:00:00'
+    return gc_data.parseUTC(text)
+
+## input: dict of query parameters (single strings), locations of the loaded data
+## output: dict of parsed filters
+def parseFilters(params, locations):
+    filters = {}
+    for level in LEVELS:
+        if level in params:
+            filters[level] = [int(x) for x in params[level].split(',')]
+    if 'serial' in params:
+        filters['serial'] = params['serial'].split(',')
+    if 'loc' in params:
+        patterns = params['loc'].split(',')
+        filters['loc_codes'] = [i for i, name in enumerate(locations)
+                                if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+    if 'batch' in params:
+        filters['batch'] = [{'old': 1, 'new': 0}[b] for b in params['batch'].split(',')]
+    if 'type' in params:
+        filters['type'] = [{'DBE': gc_data.EVENT_DBE, 'OTB': gc_data.EVENT_OTB}[t]
+                           for t in params['type'].upper().split(',')]
+    for key in ('since', 'until'):
+        if key in params:
+            filters[key] = parseTime(params[key])
+    return filters
+
+## numpy scalar -> python value, for JSON
+def pyValue(x):
+    return x.item() if hasattr(x, 'item') else x
+
+## per-row group labels for one group key
+def groupLabels(table, idx, key, time_values):
+    c = table.columns
+    if key in LEVELS:
+        return c[key][idx]
+    if key == 'batch':
+        return np.array([BATCH_NAMES[v] for v in c['old'][idx].tolist()], dtype=object)
+    if key == 'type':
+        return gc_data.EVENT_NAMES[c['event'][idx]] if 'event' in c else np.full(len(idx), '')
+    if key == 'serial':
+        return c['sn'][idx]
+    stamps = time_values.astype('datetime64[s]')
+    years = stamps.astype('datetime64[Y]').astype(int) + 1970
+    if key == 'year':
+        return years
+    months = stamps.astype('datetime64[M]').astype(int) % 12
+    return np.char.add(np.char.add(years.astype(str), '-Q'), (months // 3 + 1).astype(str))
+
+## input: table, selected rows, group keys, weights per row (or None for counts)
+## output: dict group tuple -> summed weight
+def groupSums(table, idx, keys, weights, time_values):
+    if not keys:
+        return {(): float(weights.sum()) if weights is not None else len(idx)}
+    labels = [groupLabels(table, idx, k, time_values) for k in keys]
+    codes = []
+    uniques = []
+    for lab in labels:
+        u, inv = np.unique(lab, return_inverse=True)
+        uniques.append(u)
+        codes.append(inv)
+    flat = np.ravel_multi_index(codes, [len(u) for u in uniques]) if len(idx) else np.zeros(0, dtype='int64')
+    sums = np.bincount(flat, weights=weights, minlength=int(np.prod([len(u) for u in uniques])))
+    result = {}
+    for f in np.flatnonzero(sums):
+        pos = np.unravel_index(f, [len(u) for u in uniques])
+        result[tuple(pyValue(u[p]) for u, p in zip(uniques, pos))] = sums[f].item()
+    return result
+
+## GPU-hours of the selected stints, clipped to the since/until window
+def stintHours(stints, idx, filters):
+    ins = stints.columns['insert'][idx]
+    rem = stints.columns['remove'][idx]
+    lo = filters.get('since', np.iinfo('int64').min)
+    hi = filters.get('until', np.iinfo('int64').max)
+    return np.maximum(np.minimum(rem, hi) - np.maximum(ins, lo), 0) / 3600.0
+
+## stints overlapping [since, until): select() indexes stints by insert, so the 'since'
+## bound cannot use the time index; stints inserted before 'until' are filtered by remove instead.
+def selectStints(stints, filters):
+    window = dict(filters)
+    window.pop('type', None)
+    since = window.pop('since', None)
+    idx = stints.select(window)
+    if since is not None:
+        idx = idx[stints.columns['remove'][idx] > since]
+    return idx
+
+## input: tables, normalized query (tuple of (key, value) pairs)
+## output: JSON-ready dict
+def runQuery(tables, locations, query):
+    params = dict(query)
+    unknown = sorted(set(params) - set(QUERY_KEYS))
+    if unknown:
+        raise ValueError('unknown query parameter(s) %s, expected %s' % (', '.join(unknown), ', '.join(QUERY_KEYS)))
+    table_name = params.get('table', 'events')
+    if table_name not in tables:
+        raise ValueError('unknown table %r' % table_name)
+    table = tables[table_name]
+    filters = parseFilters(params, locations)
+    keys = [k for k in params.get('group', '').split(',') if k]
+    for k in keys:
+        if k not in GROUP_KEYS:
+            raise ValueError('unknown group key %r' % k)
+    agg = params.get('agg', 'count')
+    limit = int(params.get('limit', 1000))
+
+    if table_name == 'stints':
+        idx = selectStints(table, filters)
+    else:
+        idx = table.select(filters)
+    time_values = table.time[idx]
+
+    if agg == 'rows':
+        rows = []
+        for i in idx[:limit]:
+            rows.append({k: pyValue(v[i]) for k, v in table.columns.items() if k != 'loc_code'})
+            rows[-1]['location'] = locations[table.columns['loc_code'][i]]
+        return {'rows': rows, 'matched': len(idx)}
+
+    if agg == 'count':
+        sums = groupSums(table, idx, keys, None, time_values)
+        groups = [{'key': dict(zip(keys, k)), 'count': int(v)} for k, v in sums.items()]
+    elif agg == 'hours' and table_name == 'stints':
+        sums = groupSums(table, idx, keys, stintHours(table, idx, filters), time_values)
+        groups = [{'key': dict(zip(keys, k)), 'gpu_hours': v} for k, v in sums.items()]
+    elif agg == 'mtbf' and table_name == 'events':
+        if set(keys) & {'year', 'quarter'}:
+            raise ValueError('mtbf cannot be grouped by time')
+        counts = groupSums(table, idx, keys, None, time_values)
+        stints = tables['stints']
+        s_idx = selectStints(stints, filters)
+        s_keys = [k for k in keys if k != 'type']
+        hours = groupSums(stints, s_idx, s_keys, stintHours(stints, s_idx, filters), stints.time[s_idx])
+        groups = []
+        for k, n in counts.items():
+            h = hours.get(tuple(v for key, v in zip(keys, k) if key != 'type'), 0.0)
+            groups.append({'key': dict(zip(keys, k)), 'failures': int(n), 'gpu_hours': h,
+                           'mtbf_h': h / n if n else None})
+    else:
+        raise ValueError('aggregate %r is not available for table %r' % (agg, table_name))
+    groups.sort(key=lambda g: [str(v) for v in g['key'].values()])
+    return {'groups': groups, 'matched': len(idx)}
+
+def _runJSON(tables, locations, query):
+    return json.dumps(runQuery(tables, locations, query))
+
+#### service state ##############################################################################
+class QueryService(object):
+    def __init__(self, path, cutoff=gc_data.OLD_NEW_CUTOFF, cache_size=1024):
+        self.path = path
+        self.cutoff = cutoff
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.state = (None, None, None, None)  # (file stamp, locations, tables, cached query)
+        self.reloadIfChanged()
+
+    def _fileStamp(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    ## builds the new tables and cache aside and swaps them in with one assignment: readers take
+    ## self.state once per request and never see the locations of one load with the tables of another
+    def reloadIfChanged(self):
+        stamp = self._fileStamp()
+        if stamp == self.state[0]:
+            return
+        with self.lock:
+            if stamp == self.state[0]:
+                return
+            t0 = time.perf_counter()
+            raw = gc_data.loadGcFull(self.path)
+            locations = raw['locations']
+            tables = buildTables(raw, self.cutoff)
+            cached = functools.lru_cache(maxsize=self.cache_size)(functools.partial(_runJSON, tables, locations))
+            self.load_s = time.perf_counter() - t0
+            self.state = (stamp, locations, tables, cached)
+
+    ## input: dict of query parameters
+    ## output: JSON text of the result
+    def query(self, params):
+        self.reloadIfChanged()
+        cached = self.state[3]
+        return cached(tuple(sorted(params.items())))
+
+    def serial(self, sn):
+        self.reloadIfChanged()
+        cached = self.state[3]
+        out = {}
+        for name in ('lifetimes', 'stints', 'events'):
+            out[name] = json.loads(cached((('agg', 'rows'), ('serial', sn), ('table', name))))['rows']
+        return json.dumps(out)
+
+    def status(self):
+        stamp, locations, tables, cached = self.state
+        info = cached.cache_info()
+        return json.dumps({'file': self.path, 'load_s': self.load_s,
+                           'rows': {k: t.n for k, t in tables.items()},
+                           'cache': {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}})
+
+#### HTTP front end #############################################################################
+def makeHandler(service):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+            t0 = time.perf_counter()
+            try:
+                if url.path == '/query':
+                    body = service.query(params)
+                elif url.path.startswith('/serial/'):
+                    body = service.serial(urllib.parse.unquote(url.path[len('/serial/'):]))
+                elif url.path == '/status':
+                    body = service.status()
+                else:
+                    self.reply(404, json.dumps({'error': 'unknown path'}))
+                    return
+            except (ValueError, KeyError) as e:
+                self.reply(400, json.dumps({'error': str(e)}))
+                return
+            self.reply(200, body, time.perf_counter() - t0)
+
+        def reply(self, code, body, elapsed=None):
+            data = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if elapsed is not None:
+                self.send_header('X-Elapsed-ms', '%.3f' % (elapsed * 1000))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):  # quiet; unix socket peers have no address
+            pass
+    return Handler
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query service over a gc_full.csv-format history.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--port', type=int, default=8765, help='HTTP port on 127.0.0.1')
+    parser.add_argument('--socket', help='serve HTTP on this Unix socket instead')
+    parser.add_argument('--cutoff', type=int, default=gc_data.OLD_NEW_CUTOFF, help='old/new batch cutoff epoch')
+    parser.add_argument('--cache-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    service = QueryService(args.path, args.cutoff, args.cache_size)
+    print('Loaded', args.path, 'in %.2f s' % service.load_s)
+    handler = makeHandler(service)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, handler)
+    else:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
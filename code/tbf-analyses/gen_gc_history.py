@@ -0,0 +1,310 @@
+#### Synthetic GPU history generator ############################################################
+## Writes Titan-shaped GPU histories in the 'gc_full.csv' format read by tbf_analyses.py,
+## so the analysis code can be exercised at 10x or 1000x the size of the Titan data.
+##
+## csv file: SN, location, insert, remove, duration, out, event
+## The rows mimic how data/gc_full.csv was produced by TitanGPUmodel.Rmd:
+##   - "life" records: insert/remove times are inventory sweep times, except when a GPU is
+##     pulled at a failure, in which case remove is the failure time and the event is on the same row.
+##   - failures logged after the last sighting of a GPU appear as separate rows with no insert,
+##     duration or out (missing-insert rows). Some of these are logged before the GPU's life record
+##     at that location ends; the parser cannot find a start time for them (bad_serials.dat).
+##   - repeated entries: a second row with the same SN, location and event time.
+##   - relocations: GPUs removed from one location and later re-inserted at another.
+## Rows are sorted by SN, remove and location, as in the original file.
+##
+## usage: python gen_gc_history.py out.csv --gpus 186880 --seed 1
+####
+
+#### package imports ############################################################################
+import argparse
+import csv
+
+import numpy as np
+
+import gc_data
+
+SECONDS_PER_YEAR = 60*60*8760
+SECONDS_PER_DAY = 60*60*24
+
+## defaults roughly follow the Titan history (see paper, Section III)
+DEFAULTS = {
+    'start': '2014-01-01 00:00:00',       # first inventory sweep
+    'end': '2019-08-01 20:07:33',         # last inventory sweep
+    'cutoff': '2016-01-01 03:49:00',      # old/new batch cutoff, as oldNew_cutoff_epoch
+    'campaign_start': '2016-06-01 00:00:00',
+    'campaign_end': '2017-08-01 00:00:00',
+    'campaign_frac': 0.55,                # fraction of positions whose old GPU is replaced by the new batch
+    'dbe_rate': 0.010,                    # DBE failures per GPU-year, before wear-out
+    'otb_rate': 0.004,                    # OTB failures per GPU-year, before wear-out
+    'new_dbe_rate': 0.030,                # same, for GPUs first inserted after the cutoff
+    'new_otb_rate': 0.010,
+    'wearout_age': 3.0,                   # years; old batch failure rates are multiplied after this age
+    'wearout_factor': 12.0,
+    'relocate_rate': 0.02,                # moves without a failure, per GPU-year
+    'reuse_frac': 0.5,                    # fraction of moved or repaired GPUs that are re-inserted elsewhere
+    'repair_frac': 0.2,                   # fraction of failed GPUs that come back after repair
+    'swap_days': 3.0,                     # mean delay until a position is refilled
+    'sweep_days': 3.0,                    # mean interval between inventory sweeps
+    'sweep_gap_frac': 0.01,               # fraction of sweep intervals that are long outages (up to 56 days)
+    'missing_insert': 0.2,                # fraction of failures logged after the last sighting
+    'orphan_frac': 0.02,                  # fraction of those logged before the life record ends
+    'repeat_frac': 0.005,                 # fraction of failures with a repeated entry
+}
+
+#### inventory sweeps ###########################################################################
+## sorted epochs of inventory sweeps between start and end (both included)
+def makeSweeps(rng, start, end, mean_days, gap_frac):
+    n = int((end - start) / (mean_days * SECONDS_PER_DAY) * 1.5) + 16
+    gaps = rng.exponential(mean_days * SECONDS_PER_DAY, n)
+    outages = rng.random(n) < gap_frac
+    gaps[outages] = rng.uniform(14, 56, outages.sum()) * SECONDS_PER_DAY
+    gaps = np.maximum(gaps, 3600).astype('int64')
+    sweeps = start + np.cumsum(np.concatenate(([0], gaps)))
+    sweeps = sweeps[sweeps < end]
+    return np.append(sweeps, end)
+
+## first sweep at or after t (end of history if none)
+def nextSweep(sweeps, t):
+    idx = np.searchsorted(sweeps, t, side='left')
+    return sweeps[np.minimum(idx, len(sweeps) - 1)]
+
+## last sweep at or before t
+def lastSweep(sweeps, t):
+    idx = np.searchsorted(sweeps, t, side='right') - 1
+    return sweeps[np.maximum(idx, 0)]
+
+#### failure times ##############################################################################
+## piecewise-exponential draw: rate applies until 'knee' seconds from now, rate*factor afterwards.
+## input: arrays of rates (per second) and knees (seconds, may be <= 0)
+## output: array of waiting times in seconds (inf for zero rates)
+def drawWaits(rng, rate, knee, factor):
+    e = rng.exponential(1.0, len(rate))
+    knee = np.maximum(knee, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        before = e / rate
+        after = knee + (e - rate * knee) / (rate * factor)
+    waits = np.where(e < rate * knee, before, after)
+    waits[rate <= 0] = np.inf
+    return waits
+
+#### simulation #################################################################################
+## Simulates every node position as a chain of GPU stints and returns the rows as column arrays.
+## Stints are simulated generation by generation: one vectorized step ends the current stint of
+## every active position and (possibly) starts the next one.
+def simulate(opts, rng):
+    geometry = opts['geometry']
+    P = opts['gpus']
+    start = gc_data.parseUTC(opts['start'])
+    end = gc_data.parseUTC(opts['end'])
+    cutoff = gc_data.parseUTC(opts['cutoff'])
+    c_start = gc_data.parseUTC(opts['campaign_start'])
+    c_end = gc_data.parseUTC(opts['campaign_end'])
+
+    sweeps = makeSweeps(rng, start, end, opts['sweep_days'], opts['sweep_gap_frac'])
+
+    # serial registry: first insert time of every GPU serial (index = serial id)
+    first_insert = [np.full(P, start, dtype='int64')]
+    n_serials = P
+
+    # position state
+    pos = np.arange(P, dtype='int64')
+    serial = np.arange(P, dtype='int64')
+    s0 = np.full(P, start, dtype='int64')  # insert (sweep) time of the current stint
+
+    # planned replacement of old GPUs by the new batch
+    campaign = np.full(P, np.inf)
+    chosen = rng.random(P) < opts['campaign_frac']
+    campaign[chosen] = rng.uniform(c_start, c_end, chosen.sum())
+
+    rows = {k: [] for k in ('serial', 'pos', 'insert', 'remove', 'event', 'life')}
+
+    def emit(sel_serial, sel_pos, ins, rem, ev, life):
+        rows['serial'].append(sel_serial)
+        rows['pos'].append(sel_pos)
+        rows['insert'].append(ins)
+        rows['remove'].append(rem)
+        rows['event'].append(ev)
+        rows['life'].append(life)
+
+    while len(pos) > 0:
+        fi = np.concatenate(first_insert)[serial]
+        old = fi < cutoff
+        n = len(pos)
+
+        # failure rates of the current occupants
+        dbe = np.where(old, opts['dbe_rate'], opts['new_dbe_rate']) / SECONDS_PER_YEAR
+        otb = np.where(old, opts['otb_rate'], opts['new_otb_rate']) / SECONDS_PER_YEAR
+        knee = np.where(old, fi + opts['wearout_age'] * SECONDS_PER_YEAR - s0, np.inf)
+        factor = np.where(old, opts['wearout_factor'], 1.0)
+        t_fail = s0 + 1 + drawWaits(rng, dbe + otb, knee, factor)
+        is_dbe = rng.random(n) < dbe / (dbe + otb)
+
+        t_move = s0 + 1 + rng.exponential(SECONDS_PER_YEAR / max(opts['relocate_rate'], 1e-12), n)
+        t_camp = np.where(old & (campaign[pos] > s0), campaign[pos], np.inf)
+
+        t_end = np.minimum(np.minimum(t_fail, t_move), np.minimum(t_camp, end))
+        failed = (t_fail <= t_end) & (t_fail < end)
+        finished = t_end >= end
+        t_end = np.minimum(t_end, end).astype('int64')
+
+        # a. stints running to the end of history
+        sel = finished & ~failed
+        emit(serial[sel], pos[sel], s0[sel], np.full(sel.sum(), end, dtype='int64'),
+             np.zeros(sel.sum(), dtype='int8'), np.ones(sel.sum(), dtype=bool))
+
+        # b. stints ended by a move or the replacement campaign: last seen at the last sweep
+        sel = ~finished & ~failed
+        rem = np.maximum(lastSweep(sweeps, t_end[sel]), nextSweep(sweeps, s0[sel] + 1))
+        emit(serial[sel], pos[sel], s0[sel], rem,
+             np.zeros(sel.sum(), dtype='int8'), np.ones(sel.sum(), dtype=bool))
+
+        # c. failures
+        ev = np.where(is_dbe, gc_data.EVENT_DBE, gc_data.EVENT_OTB).astype('int8')
+        f_idx = np.flatnonzero(failed)
+        seen = lastSweep(sweeps, t_end[f_idx])
+        missing = (rng.random(len(f_idx)) < opts['missing_insert']) & (seen > s0[f_idx])
+        orphan = missing & (rng.random(len(f_idx)) < opts['orphan_frac'])
+        joined = f_idx[~missing]
+        emit(serial[joined], pos[joined], s0[joined], t_end[joined], ev[joined],
+             np.ones(len(joined), dtype=bool))
+        late = f_idx[missing & ~orphan]   # logged after the last sighting
+        emit(serial[late], pos[late], s0[late], seen[missing & ~orphan],
+             np.zeros(len(late), dtype='int8'), np.ones(len(late), dtype=bool))
+        orph = f_idx[orphan]              # logged while the life record continues
+        emit(serial[orph], pos[orph], s0[orph], nextSweep(sweeps, t_end[orph] + 1),
+             np.zeros(len(orph), dtype='int8'), np.ones(len(orph), dtype=bool))
+        logged = f_idx[missing]
+        emit(serial[logged], pos[logged], np.full(len(logged), -1, dtype='int64'), t_end[logged],
+             ev[logged], np.zeros(len(logged), dtype=bool))
+        rep = f_idx[rng.random(len(f_idx)) < opts['repeat_frac']]
+        emit(serial[rep], pos[rep], np.full(len(rep), -1, dtype='int64'), t_end[rep],
+             ev[rep], np.zeros(len(rep), dtype=bool))
+
+        # refill the positions whose stint ended before the end of history
+        nxt = np.flatnonzero(~finished)
+        t_in = t_end[nxt] + rng.exponential(opts['swap_days'] * SECONDS_PER_DAY, len(nxt)).astype('int64') + 1
+        t_in = nextSweep(sweeps, t_in)
+        keep = t_in < end
+        nxt, t_in = nxt[keep], t_in[keep]
+
+        # moved and repaired GPUs go back into the pool (campaign removals are retired)
+        gone = np.flatnonzero(~finished)
+        back = (~failed[gone]) | (rng.random(len(gone)) < opts['repair_frac'])
+        back &= rng.random(len(gone)) < opts['reuse_frac']
+        back &= np.isinf(t_camp[gone]) | failed[gone]
+        r = t_end[gone][back]
+        o = np.argsort(r, kind='stable')
+        r, pool = r[o], serial[gone][back][o]
+
+        # match pooled GPUs to refill slots in time order, so a GPU is only re-inserted
+        # after it was removed: pool item i goes to the i-th free slot after its removal.
+        slot_order = np.argsort(t_in, kind='stable')
+        k = np.arange(len(r))
+        target = k + np.maximum.accumulate(np.searchsorted(t_in[slot_order], r, side='right') - k) \
+            if len(r) else k
+        ok = target < len(nxt)
+        incoming = np.full(len(nxt), -1, dtype='int64')
+        incoming[slot_order[target[ok]]] = pool[ok]
+
+        # the rest of the positions get fresh serials
+        is_new = incoming < 0
+        fresh = int(is_new.sum())
+        incoming[is_new] = np.arange(n_serials, n_serials + fresh, dtype='int64')
+        n_serials += fresh
+        first_insert.append(t_in[is_new])
+
+        pos = pos[nxt]
+        serial = incoming
+        s0 = t_in
+
+    out = {k: np.concatenate(v) for k, v in rows.items()}
+    out['first_insert'] = np.concatenate(first_insert)
+    out['end'] = end
+    out['cutoff'] = cutoff
+    return out
+
+#### output #####################################################################################
+## input: simulated rows (see simulate()), output path
+## output: writes a csv file in the 'gc_full.csv' format, returns number of rows written
+def writeHistory(sim, path, geometry):
+    serial = sim['serial']
+    life = sim['life']
+    insert = sim['insert']
+    remove = sim['remove']
+
+    # out: last life record of a GPU, removed before the last inventory
+    last = np.full(len(sim['first_insert']), -1, dtype='int64')
+    np.maximum.at(last, serial[life], remove[life])
+    out = life & (remove == last[serial]) & (remove < sim['end'])
+
+    order = np.lexsort((sim['pos'], remove, serial))
+
+    # serials: old batch '0323...', new batch '0320...', by time of first insert
+    prefix = np.where(sim['first_insert'] < sim['cutoff'], '0323', '0320')
+    sn_text = np.char.add(prefix, np.char.zfill(np.arange(len(prefix)).astype(str), 9))
+
+    col, row, cage, slot, node = gc_data.positionToCoords(sim['pos'], geometry)
+    ins_text = gc_data.formatEpochs(np.maximum(insert, 0))
+    rem_text = gc_data.formatEpochs(remove)
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',', lineterminator='\n')
+        writer.writerow(['SN', 'location', 'insert', 'remove', 'duration', 'out', 'event'])
+        for i in order:
+            if life[i]:
+                writer.writerow([sn_text[serial[i]],
+                                 gc_data.formatCname(col[i], row[i], cage[i], slot[i], node[i]),
+                                 ins_text[i], rem_text[i], remove[i] - insert[i],
+                                 'TRUE' if out[i] else 'FALSE', gc_data.EVENT_NAMES[sim['event'][i]]])
+            else:
+                writer.writerow([sn_text[serial[i]],
+                                 gc_data.formatCname(col[i], row[i], cage[i], slot[i], node[i]),
+                                 '', rem_text[i], '', '', gc_data.EVENT_NAMES[sim['event'][i]]])
+    return len(order)
+
+## generate and write a history; keyword arguments override DEFAULTS.
+## 'gpus' is the number of node positions; the number of columns grows with it unless given.
+def generate(path, gpus=gc_data.TITAN_TOTAL_NODES, seed=0, geometry=None, **kwargs):
+    opts = dict(DEFAULTS)
+    opts.update(kwargs)
+    if geometry is None:
+        geometry = dict(gc_data.TITAN_GEOMETRY)
+        per_column = gc_data.geometrySize(geometry) // geometry['columns']
+        geometry['columns'] = max(geometry['columns'], -(-gpus // per_column))
+    if gpus > gc_data.geometrySize(geometry):
+        raise ValueError('%d GPUs do not fit in geometry %s' % (gpus, geometry))
+    opts['gpus'] = gpus
+    opts['geometry'] = geometry
+    rng = np.random.default_rng(seed)
+    sim = simulate(opts, rng)
+    return writeHistory(sim, path, geometry)
+
+#### command line ###############################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic GPU history in gc_full.csv format.')
+    parser.add_argument('path', help='output csv file')
+    parser.add_argument('--gpus', type=int, default=gc_data.TITAN_TOTAL_NODES,
+                        help='number of node positions (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    for name in ('columns', 'rows', 'cages', 'slots', 'nodes'):
+        parser.add_argument('--' + name, type=int, help='cabinet geometry (default: Titan)')
+    for key, value in DEFAULTS.items():
+        parser.add_argument('--' + key.replace('_', '-'), dest=key, type=type(value), default=value,
+                            help='(default: %(default)s)')
+    args = vars(parser.parse_args())
+
+    geometry = None
+    if any(args[name] is not None for name in gc_data.TITAN_GEOMETRY):
+        geometry = dict(gc_data.TITAN_GEOMETRY)
+        for name in gc_data.TITAN_GEOMETRY:
+            if args[name] is not None:
+                geometry[name] = args[name]
+    path = args.pop('path')
+    gpus = args.pop('gpus')
+    seed = args.pop('seed')
+    for name in gc_data.TITAN_GEOMETRY:
+        args.pop(name)
+
+    count = generate(path, gpus=gpus, seed=seed, geometry=geometry, **args)
+    print('Wrote', count, 'lines to', path)
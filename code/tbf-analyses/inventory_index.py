@@ -0,0 +1,207 @@
+#### Inventory-snapshot index ###################################################################
+## Insert and remove times in gc_full.csv are the first and last inventory sweeps that saw a GPU at
+## a location. This index keeps
+##   - the sorted distinct sweep times (unique insert and remove times of the stints), from which
+##     the inventory gaps follow, as the "attention intervals" in TitanGPUmodel.Rmd;
+##   - per location, the occupancy intervals (stints) sorted by insert, with the running maximum of
+##     their remove times, so "who was at location L at time t" is a bisection (plus a step back
+##     over stints that ended before t when stints overlap);
+##   - per serial, the stints sorted by insert, for the same question about a GPU.
+##
+## Imputation of missing insert times (event rows without one), with a confidence flag:
+##   IMPUTE_STINT     a stint of the same serial and location contains the event: its insert
+##   IMPUTE_SERIAL    a stint of the same serial at another location contains the event (e.g. the
+##                    event was logged on the neighboring node): that stint's insert
+##   IMPUTE_SNAPSHOT  no stint contains the event: the last sweep before the event, but not before
+##                    the serial was last seen; the GPU was inserted at or after that snapshot
+##   IMPUTE_NONE      no sweep before the event
+## tbf_analyses.py uses these for rows it cannot match when TBF_IMPUTE_INSERTS is set.
+##
+## usage: python inventory_index.py ../../data/gc_full.csv --gaps 7
+##        python inventory_index.py ../../data/gc_full.csv --who c11-2c1s4n1 '2017-03-01 00:00:00'
+####
+
+#### package imports ############################################################################
+import argparse
+import bisect
+
+import numpy as np
+
+import gc_data
+
+SECONDS_PER_DAY = 60*60*24
+
+IMPUTE_NONE = 0
+IMPUTE_SNAPSHOT = 1
+IMPUTE_SERIAL = 2
+IMPUTE_STINT = 3
+IMPUTE_NAMES = ('none', 'snapshot', 'serial', 'stint')
+
+## input: keys (any sortable array)
+## output: order sorting the items by (key, times), and the start offset of each key's run
+def _segments(keys, times):
+    order = np.lexsort((times, keys))
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(keys) else np.zeros(0, 'int64')
+    return order, sorted_keys[starts], np.append(starts, len(keys))
+
+## input: values in run order, run offsets
+## output: running maximum of the values within each run
+def _runMax(values, offsets):
+    runs = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)).astype('int64')
+    span = 1 << 40  # larger than any epoch, so each run starts above the maximum of the previous one
+    return np.maximum.accumulate(values + runs * span) - runs * span
+
+class InventoryIndex(object):
+    ## input: loaded gc_full table (gc_data.loadGcFull)
+    def __init__(self, table):
+        rows = np.flatnonzero(table['insert'] != gc_data.MISSING)
+        self.sn = table['sn'][rows]
+        self.location = table['location'][rows]
+        self.insert = table['insert'][rows]
+        self.remove = table['remove'][rows]
+        self.sweeps = np.unique(np.concatenate([self.insert, self.remove]))
+
+        # per location and per serial: stint indices sorted by insert, in runs (CSR layout)
+        self.by_loc, self.loc_keys, self.loc_offsets = _segments(self.location, self.insert)
+        self.by_sn, self.sn_keys, self.sn_offsets = _segments(self.sn, self.insert)
+        self.loc_inserts = self.insert[self.by_loc].tolist()
+        self.sn_inserts = self.insert[self.by_sn].tolist()
+        # latest remove among the stints inserted so far in the run
+        self.loc_reach = _runMax(self.remove[self.by_loc], self.loc_offsets).tolist()
+        self.sn_reach = _runMax(self.remove[self.by_sn], self.sn_offsets).tolist()
+        self.loc_lookup = dict((k, i) for i, k in enumerate(self.loc_keys.tolist()))
+        self.sn_lookup = dict((k, i) for i, k in enumerate(self.sn_keys.tolist()))
+
+    #### gaps ###################################################################################
+    ## output: arrays (start, end, days) of the intervals between consecutive sweeps of at least
+    ##         min_days, i.e. periods without any inventory
+    def gaps(self, min_days=1.0):
+        days = np.diff(self.sweeps) / float(SECONDS_PER_DAY)
+        keep = np.flatnonzero(days >= min_days)
+        return self.sweeps[keep], self.sweeps[keep + 1], days[keep]
+
+    ## sweeps bracketing t: (last sweep <= t, first sweep > t), None where there is none
+    def bracket(self, t):
+        i = bisect.bisect_right(self.sweeps, t)
+        return (int(self.sweeps[i - 1]) if i > 0 else None,
+                int(self.sweeps[i]) if i < len(self.sweeps) else None)
+
+    #### lookups ################################################################################
+    ## stint index of the last stint in run 'run' of (order, offsets, inserts) with insert <= t
+    def _last(self, lookup, key, order, offsets, inserts, t):
+        run = lookup.get(key)
+        if run is None:
+            return None
+        lo, hi = offsets[run], offsets[run + 1]
+        i = bisect.bisect_right(inserts, t, lo, hi) - 1
+        return int(order[i]) if i >= lo else None
+
+    ## stint index of the stint with the latest insert <= t that still covers t (remove >= t), or
+    ## None. The running maximum of the removes tells whether one exists; the scan back only
+    ## steps over stints that ended before t.
+    def _covering(self, lookup, key, order, offsets, inserts, reach, t):
+        run = lookup.get(key)
+        if run is None:
+            return None
+        lo, hi = offsets[run], offsets[run + 1]
+        i = bisect.bisect_right(inserts, t, lo, hi) - 1
+        if i < lo or reach[i] < t:
+            return None
+        while self.remove[order[i]] < t:
+            i -= 1
+        return int(order[i])
+
+    ## output: (serial, insert, remove) of the GPU seen at the location at time t, or None.
+    ## With overlapping stints (incomplete inventories) the covering one inserted last is returned.
+    def occupant(self, location, t):
+        i = self._covering(self.loc_lookup, location, self.by_loc, self.loc_offsets, self.loc_inserts,
+                           self.loc_reach, t)
+        if i is None:
+            return None
+        return (self.sn[i], int(self.insert[i]), int(self.remove[i]))
+
+    ## output: (location, insert, remove) of the stint of the serial containing t, or None
+    def whereabouts(self, serial, t):
+        i = self._covering(self.sn_lookup, serial, self.by_sn, self.sn_offsets, self.sn_inserts,
+                           self.sn_reach, t)
+        if i is None:
+            return None
+        return (self.location[i], int(self.insert[i]), int(self.remove[i]))
+
+    ## latest remove time of the serial's stints that started at or before t (None if none)
+    def lastSeen(self, serial, t):
+        run = self.sn_lookup.get(serial)
+        if run is None:
+            return None
+        lo, hi = self.sn_offsets[run], self.sn_offsets[run + 1]
+        i = bisect.bisect_right(self.sn_inserts, t, lo, hi) - 1
+        return int(self.sn_reach[i]) if i >= lo else None
+
+    #### imputation #############################################################################
+    ## input: serial, location and time of an event without an insert time
+    ## output: (imputed insert epoch or None, IMPUTE_* confidence)
+    def impute(self, serial, location, t):
+        i = self._last(self.loc_lookup, location, self.by_loc, self.loc_offsets, self.loc_inserts, t)
+        run = self.loc_lookup.get(location)
+        if i is not None:  # stints at this location are sorted by insert; check the serial's own
+            lo = self.loc_offsets[run]
+            k = bisect.bisect_right(self.loc_inserts, t, lo, self.loc_offsets[run + 1])
+            for j in self.by_loc[lo:k][::-1]:
+                if self.sn[j] == serial and self.remove[j] >= t:
+                    return int(self.insert[j]), IMPUTE_STINT
+        seen = self.whereabouts(serial, t)
+        if seen is not None:
+            return seen[1], IMPUTE_SERIAL
+        before, _ = self.bracket(t)
+        if before is None:
+            return None, IMPUTE_NONE
+        last = self.lastSeen(serial, t)
+        return (before if last is None else max(before, last)), IMPUTE_SNAPSHOT
+
+## input: loaded table, index
+## output: dict (serial, location, remove time string) -> (insert time string, confidence) for
+##         the event rows without an insert time; times as in gc_full.csv
+def imputeInserts(table, index=None):
+    index = index or InventoryIndex(table)
+    rows = np.flatnonzero((table['insert'] == gc_data.MISSING) & (table['event'] != gc_data.EVENT_NONE))
+    out = {}
+    for r in rows:
+        start, confidence = index.impute(table['sn'][r], table['location'][r], int(table['remove'][r]))
+        if start is not None:
+            key = (str(table['sn'][r]), str(table['location'][r]), str(gc_data.formatEpochs([table['remove'][r]])[0]))
+            out[key] = (str(gc_data.formatEpochs([start])[0]), confidence)
+    return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inventory sweeps, gaps, occupancy and insert-time imputation.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--gaps', type=float, default=1.0, help='list inventory gaps of at least this many days')
+    parser.add_argument('--who', nargs=2, metavar=('LOCATION', 'TIME'), help='GPU at LOCATION at TIME (UTC)')
+    parser.add_argument('--impute', help='write imputed insert times of rows without one to this csv')
+    args = parser.parse_args()
+
+    table = gc_data.loadGcFull(args.path)
+    index = InventoryIndex(table)
+    start, end, days = index.gaps(args.gaps)
+    print(len(index.sweeps), 'distinct sweep times;', len(days), 'gaps of at least', args.gaps, 'days')
+    for s, e, d in zip(gc_data.formatEpochs(start), gc_data.formatEpochs(end), days):
+        print('  %s .. %s  %6.1f days' % (s, e, d))
+
+    if args.who:
+        found = index.occupant(args.who[0], gc_data.parseUTC(args.who[1]))
+        if found is None:
+            print('Nobody at', args.who[0], 'at', args.who[1])
+        else:
+            print('%s at %s: %s (inserted %s, removed %s)' % ((args.who[1], args.who[0], found[0]) +
+                  tuple(gc_data.formatEpochs(found[1:]))))
+
+    if args.impute:
+        imputed = imputeInserts(table, index)
+        counts = np.bincount([c for _, c in imputed.values()], minlength=len(IMPUTE_NAMES))
+        with open(args.impute, 'w') as f:
+            f.write('SN,location,remove,insert,confidence\n')
+            for (sn, loc, remove), (insert, c) in sorted(imputed.items()):
+                f.write('%s,%s,%s,%s,%s\n' % (sn, loc, remove, insert, IMPUTE_NAMES[c]))
+        print('Imputed', len(imputed), 'insert times:',
+              ', '.join('%s %d' % (IMPUTE_NAMES[c], counts[c]) for c in range(1, len(IMPUTE_NAMES))))
@@ -0,0 +1,160 @@
+#### Age by calendar (Lexis) hazard surface #####################################################
+## Failures are shown by calendar quarter in tbf_analyses.py (Figs 7-9) and by age in the survival
+## models of TitanGPUmodel.Rmd. This splits both exposure and events over age x calendar cells, so
+## wear-out (age) and episodes (calendar) can be told apart.
+##
+## The intervals come from the counting-process table (cp_table.py): each one is a diagonal segment
+## in the Lexis diagram (calendar time and age grow together). The segments are cut at every
+## calendar boundary and every age boundary they cross; all cut points of all segments are built
+## at once (np.repeat of the boundary ranges found by searchsorted) and sorted, and each piece
+## falls in one cell. Events are counted in the cell of the end of their interval.
+##
+## Cells: age bins of --age-days days; calendar periods of a month, quarter or year.
+## Per cohort (old/new batch) and cell: GPU-hours at risk, DBE, OTB and any-event counts, and the
+## hazard (events per GPU-year). Saved as a numpy archive for heatmaps, with an optional figure.
+##
+## usage: python lexis_surface.py ../../data/gc_full.csv --period month --out lexis.npz --plot lexis.png
+####
+
+#### package imports ############################################################################
+import argparse
+import time
+
+import numpy as np
+
+import cp_table
+import gc_data
+
+SECONDS_PER_DAY = 60*60*24
+SECONDS_PER_HOUR = 60*60
+PERIODS = {'month': 1, 'quarter': 3, 'year': 12}
+COHORTS = ('new', 'old')  # index = batch code of cp_table (0 new, 1 old)
+
+#### cell boundaries ############################################################################
+## calendar period starts (epochs) covering [t0, t1], periods of 'months' calendar months
+def calendarBounds(t0, t1, months=1):
+    first = np.datetime64(int(t0), 's').astype('datetime64[M]')
+    first = first - (first.astype('int64') % months)  # align quarters and years to January
+    last = np.datetime64(int(t1), 's').astype('datetime64[M]') + months
+    return np.arange(first, last + 1, months).astype('datetime64[s]').astype('int64')
+
+## age bin starts (seconds) covering [0, max_age]
+def ageBounds(max_age, days):
+    width = days * SECONDS_PER_DAY
+    return np.arange(0, max_age + width, width).astype('float64')
+
+#### splitting ##################################################################################
+## input: per segment: calendar start/stop (epochs) and age at start (seconds); sorted boundaries
+## output: per piece: segment index, calendar start, length (seconds), age cell, period cell,
+##         and whether it is the last piece of its segment
+def splitSegments(start, stop, age0, cal_bounds, age_bounds):
+    start = start.astype('float64')
+    stop = stop.astype('float64')
+    age1 = age0 + (stop - start)
+    # boundaries strictly inside each segment, as calendar times
+    c_lo = np.searchsorted(cal_bounds, start, side='right')
+    c_hi = np.searchsorted(cal_bounds, stop, side='left')
+    a_lo = np.searchsorted(age_bounds, age0, side='right')
+    a_hi = np.searchsorted(age_bounds, age1, side='left')
+    nc = np.maximum(c_hi - c_lo, 0)
+    na = np.maximum(a_hi - a_lo, 0)
+    n = len(start)
+    seg = np.concatenate([np.arange(n), np.repeat(np.arange(n), nc), np.repeat(np.arange(n), na)])
+    within_c = np.arange(nc.sum()) - np.repeat(np.cumsum(nc) - nc, nc)
+    within_a = np.arange(na.sum()) - np.repeat(np.cumsum(na) - na, na)
+    cuts = np.concatenate([
+        start,
+        cal_bounds[np.repeat(c_lo, nc) + within_c].astype('float64'),
+        start[np.repeat(np.arange(n), na)] + age_bounds[np.repeat(a_lo, na) + within_a]
+        - age0[np.repeat(np.arange(n), na)]])
+    order = np.lexsort((cuts, seg))
+    seg, cuts = seg[order], cuts[order]
+    ends = np.append(cuts[1:], 0.0)
+    last = np.append(seg[1:] != seg[:-1], True)
+    ends[last] = stop[seg[last]]
+    length = ends - cuts
+    mid = cuts + length / 2
+    age_cell = np.searchsorted(age_bounds, age0[seg] + (mid - start[seg]), side='right') - 1
+    period_cell = np.searchsorted(cal_bounds, mid, side='right') - 1
+    return seg, cuts, length, age_cell, period_cell, last
+
+#### surface ####################################################################################
+## input: counting-process table (cp_table.buildTable), age bin days, months per period
+## output: dict with 'age_bounds' (days), 'period_bounds' (epochs), 'cohorts', and arrays
+##         [cohort, age, period]: hours, dbe, otb, events, hazard (events per GPU-year, nan
+##         without exposure)
+def lexisSurface(cp, age_days=365.0/12, months=1):
+    start, stop = cp['start'], cp['stop']
+    age0 = cp['age_start'] * cp_table.SECONDS_PER_YEAR
+    cal_bounds = calendarBounds(start.min(), stop.max(), months)
+    age_bounds = ageBounds(cp['age_stop'].max() * cp_table.SECONDS_PER_YEAR, age_days)
+    seg, _, length, age_cell, period_cell, last = splitSegments(start, stop, age0, cal_bounds, age_bounds)
+
+    shape = (len(COHORTS), len(age_bounds) - 1, len(cal_bounds) - 1)
+    cells = np.ravel_multi_index((cp['batch'][seg], age_cell, period_cell), shape)
+    size = int(np.prod(shape))
+    surface = {'hours': (np.bincount(cells, weights=length, minlength=size) / SECONDS_PER_HOUR).reshape(shape)}
+    # events at the end of their interval: cell of the interval's last piece
+    for name in ('dbe', 'otb', 'event'):
+        surface[name] = np.bincount(cells[last], weights=cp[name][seg[last]], minlength=size).reshape(shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        surface['hazard'] = surface['event'] / (surface['hours'] * SECONDS_PER_HOUR / cp_table.SECONDS_PER_YEAR)
+    surface['age_bounds'] = age_bounds / SECONDS_PER_DAY
+    surface['period_bounds'] = cal_bounds
+    surface['cohorts'] = np.array(COHORTS)
+    return surface
+
+## heatmaps of the hazard (all cohorts together, then per cohort); cells with less than min_hours
+## of exposure are left blank
+def plotSurface(surface, path, min_hours=1000.0):
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+    import matplotlib.dates as mdates
+    panels = [('all', slice(None))] + [(c, i) for i, c in enumerate(COHORTS)]
+    fig, axes = plt.subplots(len(panels), 1, figsize=(12, 4 * len(panels)), sharex=True)
+    days = mdates.date2num(surface['period_bounds'].astype('datetime64[s]'))
+    years = surface['age_bounds'] / 365.0
+    cmap = plt.get_cmap('viridis').copy()
+    cmap.set_under('lightgray')
+    for ax, (name, idx) in zip(axes, panels):
+        hours = surface['hours'][idx]
+        events = surface['event'][idx]
+        if hours.ndim == 3:
+            hours, events = hours.sum(axis=0), events.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(hours >= min_hours, events / (hours / 8760.0), np.nan)
+        rate[rate == 0] = 1e-4  # no failures: below the color range, drawn in gray
+        mesh = ax.pcolormesh(days, years, np.ma.masked_invalid(rate), shading='flat',
+                             norm=mcolors.LogNorm(vmin=1e-3, vmax=1.0), cmap=cmap)
+        fig.colorbar(mesh, ax=ax, label='failures per GPU-year')
+        ax.set_ylabel('age (years)')
+        ax.set_title('DBE+OTB hazard by age and calendar time: %s' % name)
+    axes[-1].xaxis_date()
+    plt.tight_layout()
+    plt.savefig(path, dpi=150)
+    plt.close(fig)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Failures, exposure and hazard by GPU age and calendar period.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--period', choices=sorted(PERIODS), default='month')
+    parser.add_argument('--age-days', type=float, default=365.0/12, help='width of the age bins in days')
+    parser.add_argument('--cutoff', type=int, default=gc_data.OLD_NEW_CUTOFF, help='old/new batch cutoff epoch')
+    parser.add_argument('--out', default='lexis_surface.npz', help='numpy archive of the surface')
+    parser.add_argument('--plot', help='also write hazard heatmaps to this file')
+    args = parser.parse_args()
+
+    table = gc_data.loadGcFull(args.path)
+    t0 = time.perf_counter()
+    cp, _ = cp_table.buildTable(table, args.cutoff)
+    surface = lexisSurface(cp, args.age_days, PERIODS[args.period])
+    t1 = time.perf_counter()
+    np.savez(args.out, **surface)
+    print('%d age bins x %d periods; %.0f GPU-hours, %d events; %.3f s'
+          % (surface['hours'].shape[1], surface['hours'].shape[2], surface['hours'].sum(),
+             surface['event'].sum(), t1 - t0))
+    if args.plot:
+        plotSurface(surface, args.plot)
+        print('Wrote', args.out, 'and', args.plot)
+    else:
+        print('Wrote', args.out)
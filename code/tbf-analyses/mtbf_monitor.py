@@ -0,0 +1,316 @@
+#### Live sliding-window MTBF monitor ###########################################################
+## Follows an append-only history in the 'gc_full.csv' format (a file that keeps growing, a pipe,
+## or lines sent to a local Unix socket) and keeps trailing-window failure counts and MTBF by
+## failure type (DBE, OTB, ANY), cohort (old/new batch, see oldNew_cutoff_epoch in tbf_analyses.py)
+## and cage. Snapshots and threshold alerts are written as JSON lines.
+##
+## Each window keeps a sorted deque of event times per (type, group); a new event is appended to
+## the deques it belongs to and expired events are popped from the left, so the work per event is
+## O(1) amortized for rows in time order and history is never rescanned. An event older than the
+## newest one in a deque is inserted in place (bisect.insort), which is O(window size).
+## MTBF in a window is window length / number of failures in it (inf with no failures).
+##
+## The windows end at the monitor clock: the newest time seen in any row (remove or insert time,
+## so inventory rows without a failure move it too), or with --wall-clock also the current time
+## while a followed file or the socket is idle. Alerts are re-evaluated whenever the clock moves,
+## so failures expire and alerts clear in quiet periods.
+##
+## Rows may come in any order: an event is added only to the windows that still contain it
+## (relative to the clock), and events older than the longest window are counted as
+## 'late' and ignored. The windows at the newest time are therefore exact for any row order, e.g.
+## when replaying data/gc_full.csv, which is sorted by SN; snapshots and alerts written during
+## such a replay reflect only the rows read so far. Repeated entries (same SN, type and time, on
+## consecutive events of the GPU) are counted once, like the set() of event times in tbf_analyses.py.
+## Times are read as UTC.
+##
+## usage: python mtbf_monitor.py history.csv --follow
+##        tail -f history.csv | python mtbf_monitor.py -
+##        python mtbf_monitor.py --socket /tmp/mtbf.sock --alert ANY/all/30=200
+####
+
+#### package imports ############################################################################
+import argparse
+import bisect
+import collections
+import csv
+import json
+import os
+import socketserver
+import sys
+import time
+
+import gc_data
+
+SECONDS_PER_DAY = 60*60*24
+DEFAULT_WINDOWS = (7, 30, 90)                 # days
+EVENT_TYPES = ('DBE', 'OTB')
+
+#### monitor state ##############################################################################
+class MTBFMonitor(object):
+    ## windows: window lengths in days
+    ## alerts: list of (type, group, window days, MTBF threshold in hours)
+    def __init__(self, windows=DEFAULT_WINDOWS, cutoff=gc_data.OLD_NEW_CUTOFF, alerts=()):
+        self.windows = tuple(sorted(windows))
+        self.horizon = max(self.windows) * SECONDS_PER_DAY
+        self.cutoff = cutoff
+        self.alerts = list(alerts)
+        self.alerting = set()           # alerts currently below threshold
+        self.first_insert = {}          # SN -> earliest insert epoch, decides the cohort
+        self.last_event = {}            # (SN, type) -> last event epoch, to drop repeated entries
+        self.deques = {}                # (type, group, window days) -> deque of event epochs
+        self.clock = None               # newest epoch seen (rows, or wall time)
+        self.counts = {'rows': 0, 'events': 0, 'repeats': 0, 'late': 0, 'bad': 0}
+
+    ## groups an event belongs to: all, cohort, cage
+    def groups(self, serial, location):
+        first = self.first_insert.get(serial)
+        if first is None:
+            cohort = 'cohort:unknown'
+        else:
+            cohort = 'cohort:old' if first < self.cutoff else 'cohort:new'
+        coords = gc_data.decodeCname(location)
+        cage = 'cage:%d' % coords[2] if coords is not None else 'cage:unknown'
+        return ('all', cohort, cage)
+
+    ## moves the clock forward to t (epoch); output: True if it moved
+    def advance(self, t):
+        if self.clock is not None and t <= self.clock:
+            return False
+        self.clock = t
+        return True
+
+    ## input: one csv row (list of strings) in the gc_full.csv format
+    ## output: True if the row was a (new) failure event
+    def addRow(self, row):
+        if len(row) < 7 or row[0] == 'SN':
+            if row and row[0] != 'SN':
+                self.counts['bad'] += 1
+            return False
+        self.counts['rows'] += 1
+        serial, location, insert, remove, event = row[0], row[1], row[2], row[3], row[6]
+        try:
+            if insert != '':
+                t_in = gc_data.parseUTC(insert)
+                if serial not in self.first_insert or t_in < self.first_insert[serial]:
+                    self.first_insert[serial] = t_in
+                self.advance(t_in)
+            t = gc_data.parseUTC(remove) if remove != '' else None
+            if t is not None:
+                self.advance(t)
+        except ValueError:
+            self.counts['bad'] += 1
+            return False
+        if event not in EVENT_TYPES:
+            return False
+        if t is None:  # failure without a time
+            self.counts['bad'] += 1
+            return False
+        return self.addEvent(serial, location, event, t)
+
+    def addEvent(self, serial, location, event, t):
+        if self.last_event.get((serial, event)) == t:
+            self.counts['repeats'] += 1
+            return False
+        self.last_event[(serial, event)] = t
+        self.advance(t)
+        if t < self.clock - self.horizon:
+            self.counts['late'] += 1
+            return False
+        self.counts['events'] += 1
+        for group in self.groups(serial, location):
+            for etype in (event, 'ANY'):
+                for days in self.windows:
+                    key = (etype, group, days)
+                    dq = self.deques.get(key)
+                    if dq is None:
+                        dq = self.deques[key] = collections.deque()
+                    if t <= self.clock - days * SECONDS_PER_DAY:
+                        continue  # already out of this window
+                    if not dq or dq[-1] <= t:
+                        dq.append(t)
+                    else:
+                        bisect.insort(dq, t)  # out of order: keep the deque sorted
+                    self.expire(dq, days)
+        return True
+
+    ## pop events that fell out of the window (relative to the clock)
+    def expire(self, dq, days):
+        start = self.clock - days * SECONDS_PER_DAY
+        while dq and dq[0] <= start:
+            dq.popleft()
+
+    ## number of failures and MTBF (hours) in a window
+    def estimate(self, etype, group, days):
+        dq = self.deques.get((etype, group, days))
+        if dq is None:
+            return 0, float('inf')
+        self.expire(dq, days)
+        n = len(dq)
+        return n, (days * 24.0 / n if n > 0 else float('inf'))
+
+    ## output: dict with the current counts and MTBF estimates of every (type, group, window)
+    def snapshot(self):
+        windows = {}
+        for etype, group, days in sorted(self.deques):
+            n, mtbf = self.estimate(etype, group, days)
+            windows.setdefault('%dd' % days, {}).setdefault(etype, {})[group] = \
+                {'failures': n, 'mtbf_h': mtbf if n > 0 else None}
+        return {'kind': 'snapshot',
+                'clock': gc_data.formatEpochs([self.clock])[0] if self.clock is not None else None,
+                'wall': time.time(), 'counts': dict(self.counts), 'windows': windows}
+
+    ## output: list of alert records for thresholds crossed since the last call
+    def checkAlerts(self):
+        out = []
+        for alert in self.alerts:
+            etype, group, days, threshold = alert
+            n, mtbf = self.estimate(etype, group, days)
+            below = mtbf < threshold
+            if below and alert not in self.alerting:
+                self.alerting.add(alert)
+                state = 'alert'
+            elif not below and alert in self.alerting:
+                self.alerting.discard(alert)
+                state = 'clear'
+            else:
+                continue
+            out.append({'kind': state, 'type': etype, 'group': group, 'window_days': days,
+                        'failures': n, 'mtbf_h': mtbf if n > 0 else None, 'threshold_h': threshold,
+                        'clock': gc_data.formatEpochs([self.clock])[0]})
+        return out
+
+#### publishing #################################################################################
+## feeds lines to the monitor and writes snapshots every 'every' events or 'interval' seconds;
+## wall_clock: idle() also moves the monitor clock to the current time
+class Publisher(object):
+    def __init__(self, monitor, out, every=100, interval=60.0, wall_clock=False):
+        self.monitor = monitor
+        self.out = out
+        self.every = every
+        self.interval = interval
+        self.wall_clock = wall_clock
+        self.pending = 0
+        self.moved = False              # clock moved since the last snapshot
+        self.last = time.time()
+
+    def write(self, record):
+        self.out.write(json.dumps(record) + '\n')
+        self.out.flush()
+
+    def feedLines(self, lines):
+        for row in csv.reader(lines):
+            clock = self.monitor.clock
+            added = self.monitor.addRow(row)
+            if added or self.monitor.clock != clock:
+                self.pending += added
+                self.moved = True
+                self.alert()
+                if self.pending >= self.every:
+                    self.tick()
+        self.tick()
+
+    def alert(self):
+        for alert in self.monitor.checkAlerts():
+            self.write(alert)
+
+    ## called while waiting for rows
+    def idle(self):
+        if self.wall_clock and self.monitor.advance(int(time.time())):
+            self.moved = True
+            self.alert()
+        self.tick()
+
+    def tick(self, force=False):
+        changed = self.pending > 0 or self.moved
+        due = self.pending >= self.every or (changed and time.time() - self.last >= self.interval)
+        if due or force:
+            self.write(self.monitor.snapshot())
+            self.pending = 0
+            self.moved = False
+            self.last = time.time()
+
+#### sources ####################################################################################
+## read a file, then keep reading what is appended (like tail -f); partial lines wait for the rest
+def followFile(path, publisher, follow=True, from_end=False, poll=1.0):
+    with open(path, newline='') as f:
+        if from_end:
+            f.seek(0, os.SEEK_END)
+        partial = ''
+        while True:
+            chunk = f.read(1 << 20)
+            if chunk:
+                chunk = partial + chunk
+                cut = chunk.rfind('\n') + 1
+                partial = chunk[cut:]
+                publisher.feedLines(chunk[:cut].splitlines())
+                continue
+            if not follow:
+                break
+            publisher.idle()
+            time.sleep(poll)
+            if os.stat(path).st_size < f.tell():  # truncated or rotated: start over
+                f.seek(0)
+                partial = ''
+        if partial:
+            publisher.feedLines([partial])
+
+## read rows from a stream (stdin or a pipe) until it closes
+def readStream(stream, publisher):
+    for line in stream:
+        publisher.feedLines([line])
+
+## accept connections on a Unix socket; each connection sends rows, one per line
+def serveSocket(path, publisher):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                publisher.feedLines([raw.decode('utf-8', 'replace')])
+            publisher.tick(force=True)
+
+    class Server(socketserver.UnixStreamServer):
+        def service_actions(self):  # called between connections, every poll interval
+            publisher.idle()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with Server(path, Handler) as server:
+        server.serve_forever(poll_interval=1.0)
+
+#### command line ###############################################################################
+## 'TYPE/GROUP/DAYS=HOURS', e.g. 'ANY/all/30=200' or 'DBE/cage:2/7=24'
+def parseAlert(text):
+    key, threshold = text.split('=')
+    etype, group, days = key.split('/')
+    return (etype, group, int(days), float(threshold))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trailing-window MTBF monitor for gc_full.csv-format rows.')
+    parser.add_argument('source', nargs='?', help="history file, or '-' for stdin")
+    parser.add_argument('--follow', action='store_true', help='keep reading as the file grows')
+    parser.add_argument('--from-end', action='store_true', help='skip the rows already in the file')
+    parser.add_argument('--socket', help='listen on this Unix socket instead of reading a file')
+    parser.add_argument('--windows', default=','.join(str(d) for d in DEFAULT_WINDOWS),
+                        help='window lengths in days (default: %(default)s)')
+    parser.add_argument('--cutoff', type=int, default=gc_data.OLD_NEW_CUTOFF, help='old/new batch cutoff epoch')
+    parser.add_argument('--alert', action='append', default=[], type=parseAlert,
+                        help='TYPE/GROUP/DAYS=HOURS: alert when MTBF falls below HOURS')
+    parser.add_argument('--every', type=int, default=100, help='snapshot every N events')
+    parser.add_argument('--interval', type=float, default=60.0, help='or every N seconds with new events')
+    parser.add_argument('--out', help='append JSON lines here instead of stdout')
+    parser.add_argument('--wall-clock', action='store_true',
+                        help='with --follow or --socket, move the windows with the current time while idle')
+    args = parser.parse_args()
+
+    monitor = MTBFMonitor([int(d) for d in args.windows.split(',')], args.cutoff, args.alert)
+    out = open(args.out, 'a') if args.out else sys.stdout
+    publisher = Publisher(monitor, out, args.every, args.interval, args.wall_clock)
+    try:
+        if args.socket:
+            serveSocket(args.socket, publisher)
+        elif args.source == '-' or args.source is None:
+            readStream(sys.stdin, publisher)
+        else:
+            followFile(args.source, publisher, follow=args.follow, from_end=args.from_end)
+    except KeyboardInterrupt:
+        pass
+    publisher.tick(force=True)
@@ -0,0 +1,356 @@
+#### Node id (NID) <-> cname mapping and interval join with job logs ############################
+## NIDs number the node positions of Titan (0 .. 19199); cnames are the physical locations used in
+## gc_full.csv. The mapping below is derived from the cabinet geometry and checked against all 512
+## service nodes listed in data/titan.service.txt (python nid_map.py --check):
+##   - each cabinet holds 96 consecutive NIDs; cabinets are numbered along the columns in the
+##     order 0,2,4,..,24,23,21,..,1 and, within a column, along the rows 0,2,4,6,7,5,3,1
+##     (reversed in every other column), 8 cabinets per column;
+##   - within a cabinet, the 24 blades (cage, slot) are numbered in a snake: the cages run
+##     forward (0,1,2) or backward (2,1,0), alternating from cabinet to cabinet (the first cabinet
+##     of every other column starts backward), and the slots run forward in the outer cages and
+##     backward in the middle one;
+##   - nodes 0,1 of blade b are NIDs 2b, 2b+1 and nodes 2,3 are 94-2b, 95-2b of the cabinet
+##     (the other way round in every other column).
+##
+## Interval join: GPU lifetimes (stints) and DBE/OTB events of gc_full.csv against a job log with
+## one job per line: job_id, node list, start, end (csv; node list like '12-15,40' of NIDs, or
+## cnames separated by spaces; times as epochs or 'YYYY-MM-DD HH:MM:SS' UTC). The log is streamed
+## in chunks and the per-node job intervals are spooled to one file per cabinet; the cabinets are
+## then joined in parallel processes. Per node, job intervals are sorted by start, so the jobs
+## running at an event time are found by bisection (searchsorted over (node, start) keys), and
+## the GPU-hours under jobs come from a running sum of GPU presence per node (np.interp), with no
+## loop over pairs.
+## Outputs: jobs hit by each failure, and failures per job-hour and per GPU-hour under jobs.
+##
+## usage: python nid_map.py --check
+##        python nid_map.py --map nid_map.csv
+##        python nid_map.py ../../data/gc_full.csv --jobs-log jobs.csv --out joined
+####
+
+#### package imports ############################################################################
+import argparse
+import concurrent.futures
+import csv
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import cp_table
+import gc_data
+
+COLUMN_ORDER = list(range(0, 25, 2)) + list(range(23, 0, -2))
+ROW_ORDER = [0, 2, 4, 6, 7, 5, 3, 1]
+NODES_PER_CABINET = 96
+SECONDS_PER_HOUR = 60*60
+SERVICE_FILE_LOCATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/titan.service.txt')
+
+_COLUMN_POS = np.argsort(COLUMN_ORDER)  # column -> position in the order
+_ROW_POS = np.argsort(ROW_ORDER)
+
+#### mapping ####################################################################################
+## input: col, row, cage, slot, node (scalars or numpy arrays), Titan geometry
+## output: NIDs with the same shape
+def cnameToNid(col, row, cage, slot, node):
+    col, row, cage, slot, node = (np.asarray(x, dtype='int64') for x in (col, row, cage, slot, node))
+    cpos = _COLUMN_POS[col]
+    rpos = np.where(cpos % 2 == 0, _ROW_POS[row], 7 - _ROW_POS[row])
+    cabinet = cpos * 8 + rpos
+    cage_pos = np.where((cpos + rpos) % 2 == 0, cage, 2 - cage)
+    blade = cage_pos * 8 + np.where(cage_pos == 1, 7 - slot, slot)
+    first_half = (node // 2) == (cpos % 2)
+    offset = np.where(first_half, 2 * blade + node % 2,
+                      NODES_PER_CABINET - 2 - 2 * blade + node % 2)
+    return cabinet * NODES_PER_CABINET + offset
+
+## cabinet number (NID // 96) -> 'c{col}-{row}'
+def cabinetCname(cabinet):
+    cpos, rpos = divmod(int(cabinet), 8)
+    return 'c%d-%d' % (COLUMN_ORDER[cpos], ROW_ORDER[rpos if cpos % 2 == 0 else 7 - rpos])
+
+## output: dict of arrays indexed by NID (0 .. 19199): col, row, cage, slot, node, cname
+def nidTable():
+    coords = gc_data.positionToCoords(np.arange(gc_data.geometrySize(gc_data.TITAN_GEOMETRY)),
+                                      gc_data.TITAN_GEOMETRY)
+    nids = cnameToNid(*coords)
+    order = np.argsort(nids)
+    table = dict((k, c[order].astype('int32')) for k, c in zip(('col', 'row', 'cage', 'slot', 'node'), coords))
+    table['cname'] = np.array([gc_data.formatCname(*x) for x in zip(*(table[k].tolist() for k in
+                               ('col', 'row', 'cage', 'slot', 'node')))])
+    return table
+
+## input: path of titan.service.txt (nid, hex nid, cname, type, state, ...)
+## output: (array of NIDs, array of cnames) of the service nodes
+def loadServiceNodes(path=SERVICE_FILE_LOCATION):
+    nids, cnames = [], []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 3 and fields[0].isdigit():
+                nids.append(int(fields[0]))
+                cnames.append(fields[2])
+    return np.array(nids, dtype='int64'), np.array(cnames)
+
+## output: list of (nid, cname in the file, nid computed from the cname) that disagree
+def checkMapping(path=SERVICE_FILE_LOCATION):
+    nids, cnames = loadServiceNodes(path)
+    coords = np.array([gc_data.decodeCname(c) for c in cnames]).T
+    computed = cnameToNid(*coords)
+    bad = np.flatnonzero(computed != nids)
+    return [(int(nids[i]), str(cnames[i]), int(computed[i])) for i in bad]
+
+#### job log ####################################################################################
+## '12-15,40' -> [12, 13, 14, 15, 40]; 'c0-0c0s1n2 c0-0c0s1n3' -> their NIDs
+def parseNodeList(text):
+    nodes = []
+    for item in text.replace(' ', ',').split(','):
+        if not item:
+            continue
+        if item[0] == 'c':
+            nodes.append(int(cnameToNid(*gc_data.decodeCname(item))))
+        elif '-' in item:
+            lo, hi = item.split('-')
+            nodes.extend(range(int(lo), int(hi) + 1))
+        else:
+            nodes.append(int(item))
+    return nodes
+
+def parseTime(text):
+    return int(text) if text.isdigit() else gc_data.parseUTC(text)
+
+## input: job log path, rows per chunk
+## output: yields (job ids, dict of int64 arrays: job (row in the log), nid, start, end) per chunk
+def readJobs(path, chunk_rows=1000000):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        row_no = 0
+        ids, job, nid, start, end = [], [], [], [], []
+        for row in reader:
+            if not row or row[0] == 'job_id':
+                continue
+            nodes = parseNodeList(row[1])
+            t0, t1 = parseTime(row[2]), parseTime(row[3])
+            ids.append(row[0])
+            job.extend([row_no] * len(nodes))
+            nid.extend(nodes)
+            start.extend([t0] * len(nodes))
+            end.extend([t1] * len(nodes))
+            row_no += 1
+            if len(ids) >= chunk_rows:
+                yield ids, _chunk(job, nid, start, end)
+                ids, job, nid, start, end = [], [], [], [], []
+        if ids:
+            yield ids, _chunk(job, nid, start, end)
+
+def _chunk(job, nid, start, end):
+    return dict((k, np.array(v, dtype='int64')) for k, v in
+                (('job', job), ('nid', nid), ('start', start), ('end', end)))
+
+SPOOL_FIELDS = ('job', 'nid', 'start', 'end')
+
+## streams the job log into one binary file per cabinet (records of 4 int64: job, nid, start, end);
+## a cabinet's file is truncated when this run first writes to it, so a reused spool directory
+## never carries records of an earlier run
+## output: list of job ids (row order), wall seconds per job (int64 array), spool file per cabinet
+##         written by this run (dict, cabinet -> path)
+def spoolJobs(path, spool_dir, chunk_rows=1000000):
+    files = {}
+    ids, wall = [], []
+    try:
+        for chunk_ids, chunk in readJobs(path, chunk_rows):
+            first = len(ids)
+            ids.extend(chunk_ids)
+            seconds = np.zeros(len(chunk_ids), dtype='int64')
+            seconds[chunk['job'] - first] = chunk['end'] - chunk['start']
+            wall.append(seconds)
+            records = np.stack([chunk[k] for k in SPOOL_FIELDS], axis=1)
+            cabinet = chunk['nid'] // NODES_PER_CABINET
+            order = np.argsort(cabinet, kind='stable')
+            cabinet, records = cabinet[order], records[order]
+            bounds = np.flatnonzero(np.r_[True, cabinet[1:] != cabinet[:-1], True]) if len(cabinet) else []
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                c = int(cabinet[lo])
+                if c not in files:
+                    files[c] = open(os.path.join(spool_dir, 'cab%03d.bin' % c), 'wb')
+                records[lo:hi].tofile(files[c])
+    finally:
+        for f in files.values():
+            f.close()
+    spools = dict((c, f.name) for c, f in files.items())
+    return ids, (np.concatenate(wall) if wall else np.zeros(0, dtype='int64')), spools
+
+#### join #######################################################################################
+## per node, times are laid out on one axis: key = nid * TIME_SPAN + epoch, exact in float64
+TIME_SPAN = 1 << 33
+
+## running GPU presence per node from the stints (any order, may overlap)
+## output: function (nids, times) -> seconds the node held a GPU before the time
+def presence(nid, start, stop):
+    order = np.lexsort((start, nid))
+    nid, start, stop = nid[order], start[order], stop[order]
+    if len(nid):  # overlapping stints of a node: clip each to the latest earlier remove
+        before = np.r_[gc_data.MISSING, cp_table.groupRunningMax(nid, stop)[:-1]]
+        before[cp_table.runStarts(nid)] = gc_data.MISSING
+        start = np.maximum(start, before)
+        stop = np.maximum(stop, start)
+    keys = np.stack([nid * TIME_SPAN + start, nid * TIME_SPAN + stop], axis=1).ravel().astype('float64')
+    lived = np.cumsum(stop - start).astype('float64')
+    acc = np.stack([lived - (stop - start), lived], axis=1).ravel()
+
+    def upTo(nids, times):
+        if len(keys) == 0:
+            return np.zeros(len(nids))
+        base = np.interp((nids * TIME_SPAN).astype('float64'), keys, acc, left=0.0)
+        return np.interp((nids * TIME_SPAN + times).astype('float64'), keys, acc, left=0.0) - base
+    return upTo
+
+## input: spooled job intervals (job, nid, start, end), failure nids and times
+## output: (event index, job index) pairs with start <= time < end on the failed node
+def jobsAtEvents(job, nid, start, end, ev_nid, ev_time):
+    if len(job) == 0 or len(ev_nid) == 0:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+    key = nid * TIME_SPAN + start
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    # jobs sharing a node may overlap: candidates start in (t - longest job, t] on the node
+    longest = int((end - start).max())
+    q = ev_nid * TIME_SPAN + ev_time
+    hi = np.searchsorted(key, q, side='right')
+    lo = np.searchsorted(key, np.maximum(q - longest, ev_nid * TIME_SPAN), side='left')
+    n = hi - lo
+    pair_ev = np.repeat(np.arange(len(q)), n)
+    pair_job = order[np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)]
+    hit = end[pair_job] > ev_time[pair_ev]
+    return pair_ev[hit], job[pair_job[hit]]
+
+## one cabinet, run in a worker process
+## input: (cabinet, spool file, event table indices, nids, times and types, stint nids, inserts, removes)
+## output: dict with node and GPU seconds under jobs, (event index, job) hits, DBE/OTB under jobs
+def joinCabinet(args):
+    cabinet, spool, ev_index, ev_nid, ev_time, ev_type, st_nid, st_start, st_stop = args
+    records = np.fromfile(spool, dtype='int64').reshape(-1, len(SPOOL_FIELDS))
+    job, nid, start, end = (records[:, i] for i in range(len(SPOOL_FIELDS)))
+    upTo = presence(st_nid, st_start, st_stop)
+    pair_ev, pair_job = jobsAtEvents(job, nid, start, end, ev_nid, ev_time)
+    hit = np.unique(pair_ev)
+    return {'cabinet': cabinet, 'node_seconds': int((end - start).sum()),
+            'gpu_seconds': float((upTo(nid, end) - upTo(nid, start)).sum()),
+            'hits': np.stack([ev_index[pair_ev], pair_job], axis=1),
+            'dbe': int((ev_type[hit] == gc_data.EVENT_DBE).sum()),
+            'otb': int((ev_type[hit] == gc_data.EVENT_OTB).sum())}
+
+## input: loaded gc_full table, job log path, worker processes, spool directory (a temporary one
+##        by default), job log rows per chunk
+## output: dict: 'cabinets' (per cabinet results of joinCabinet, without hits), 'hits' (table row
+##         of the event, job index) sorted, 'job_ids', 'wall_seconds' per job, 'nid' per table row
+def joinJobs(table, log_path, jobs=None, spool_dir=None, chunk_rows=1000000):
+    own_spool = spool_dir is None
+    spool_dir = spool_dir or tempfile.mkdtemp(prefix='nid_join_')
+    try:
+        ids, wall, spools = spoolJobs(log_path, spool_dir, chunk_rows)
+        has_nid = table['col'] >= 0
+        nid = np.full(len(table['sn']), -1, dtype='int64')
+        nid[has_nid] = cnameToNid(*(table[k][has_nid] for k in ('col', 'row', 'cage', 'slot', 'node')))
+        ev = np.flatnonzero((table['event'] != gc_data.EVENT_NONE) & has_nid)
+        st = np.flatnonzero((table['insert'] != gc_data.MISSING) & has_nid)
+        ev_cab = nid[ev] // NODES_PER_CABINET
+        st_cab = nid[st] // NODES_PER_CABINET
+        tasks = []
+        for c in sorted(spools):
+            e, s = ev[ev_cab == c], st[st_cab == c]
+            tasks.append((c, spools[c], e, nid[e], table['remove'][e], table['event'][e],
+                          nid[s], table['insert'][s], table['remove'][s]))
+        jobs = jobs or os.cpu_count() or 1
+        if jobs == 1:
+            results = [joinCabinet(t) for t in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(joinCabinet, tasks))
+    finally:
+        if own_spool:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+    hits = np.concatenate([r.pop('hits') for r in results]) if results else np.zeros((0, 2), dtype='int64')
+    hits = hits[np.lexsort((hits[:, 1], hits[:, 0]))]
+    return {'cabinets': results, 'hits': hits, 'job_ids': ids, 'wall_seconds': wall, 'nid': nid}
+
+#### output #####################################################################################
+## jobs hit by each failure: one line per (failure, job)
+def writeHits(path, table, joined):
+    rows, job = joined['hits'][:, 0], joined['hits'][:, 1]
+    ids = np.array(joined['job_ids'])
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['SN', 'location', 'nid', 'time', 'event', 'job_id'])
+        writer.writerows(zip(table['sn'][rows].tolist(), table['location'][rows].tolist(),
+                             joined['nid'][rows].tolist(), gc_data.formatEpochs(table['remove'][rows]).tolist(),
+                             gc_data.EVENT_NAMES[table['event'][rows]].tolist(), ids[job].tolist()))
+
+## failures under jobs per job-hour (wall), per node-hour and per GPU-hour (node-hours on nodes
+## holding a GPU): one line per cabinet with jobs, then the total
+def writeRates(path, joined):
+    cabs = joined['cabinets']
+    total = {'cabinet': 'total', 'node_seconds': sum(r['node_seconds'] for r in cabs),
+             'gpu_seconds': sum(r['gpu_seconds'] for r in cabs),
+             'dbe': sum(r['dbe'] for r in cabs), 'otb': sum(r['otb'] for r in cabs)}
+    job_hours = joined['wall_seconds'].sum() / float(SECONDS_PER_HOUR)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cabinet', 'cname', 'node_hours', 'gpu_hours', 'dbe', 'otb',
+                         'failures_per_1e6_gpu_hours', 'failures_per_1e6_job_hours'])
+        for r in cabs + [total]:
+            gpu_hours = r['gpu_seconds'] / SECONDS_PER_HOUR
+            failures = r['dbe'] + r['otb']
+            cname = '' if r['cabinet'] == 'total' else cabinetCname(r['cabinet'])
+            writer.writerow([r['cabinet'], cname, '%.1f' % (r['node_seconds'] / float(SECONDS_PER_HOUR)),
+                             '%.1f' % gpu_hours, r['dbe'], r['otb'],
+                             '%.3f' % (1e6 * failures / gpu_hours) if gpu_hours else '',
+                             '%.3f' % (1e6 * failures / job_hours)
+                             if r['cabinet'] == 'total' and job_hours else ''])
+    return total, job_hours
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NID <-> cname mapping; join of GPU failures with a job log.')
+    parser.add_argument('path', nargs='?', default='../../data/gc_full.csv')
+    parser.add_argument('--check', action='store_true', help='check the mapping against titan.service.txt')
+    parser.add_argument('--service', default=SERVICE_FILE_LOCATION)
+    parser.add_argument('--map', help='write the nid, cname, service table to this csv')
+    parser.add_argument('--jobs-log', help='job log csv: job_id, node list, start, end')
+    parser.add_argument('--chunk-rows', type=int, default=1000000, help='job log rows read at a time')
+    parser.add_argument('--spool', help='directory for the per-cabinet job intervals (default: temporary)')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: all CPUs)')
+    parser.add_argument('--out', default='nid_join', help='prefix of the output files')
+    args = parser.parse_args()
+
+    if args.check:
+        bad = checkMapping(args.service)
+        print('%d service nodes, %d mismatches' % (len(loadServiceNodes(args.service)[0]), len(bad)))
+        for nid, cname, computed in bad:
+            print('  nid %d %s: computed %d' % (nid, cname, computed))
+
+    if args.map:
+        nodes = nidTable()
+        service = np.zeros(len(nodes['cname']), dtype=bool)
+        service[loadServiceNodes(args.service)[0]] = True
+        with open(args.map, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['nid', 'cname', 'service'])
+            writer.writerows(zip(range(len(service)), nodes['cname'].tolist(),
+                                 np.where(service, 'TRUE', 'FALSE').tolist()))
+        print('Wrote', args.map)
+
+    if args.jobs_log:
+        table = gc_data.loadGcFull(args.path)
+        t0 = time.perf_counter()
+        joined = joinJobs(table, args.jobs_log, args.jobs, args.spool, args.chunk_rows)
+        t1 = time.perf_counter()
+        writeHits(args.out + '_hits.csv', table, joined)
+        total, job_hours = writeRates(args.out + '_rates.csv', joined)
+        print('%d jobs, %.0f job-hours, %.0f node-hours, %.0f GPU-hours under jobs; '
+              '%d DBE and %d OTB hit %d job(s); %.3f s'
+              % (len(joined['job_ids']), job_hours, total['node_seconds'] / float(SECONDS_PER_HOUR),
+                 total['gpu_seconds'] / SECONDS_PER_HOUR, total['dbe'], total['otb'],
+                 len(np.unique(joined['hits'][:, 1])), t1 - t0))
+        print('Wrote', args.out + '_hits.csv', 'and', args.out + '_rates.csv')
@@ -21,7 +21,10 @@
 
 #### package imports ############################################################################
 ## for data parsing 
+import contextlib
 import csv
+import os
+import sys
 import time
 from datetime import datetime
 import re
@@ -30,6 +33,10 @@ import re
 import numpy as np
 import matplotlib.pyplot as plt
 
+## optional per-stage timing and memory records, see tbf_instrument.py
+import tbf_instrument as instr
+import tbf_kernels as kernels
+
 #### helper functions for parsing temporal data #################################################
 ## takes time string input and convert to epoch
 def epoch(timestring):
@@ -45,8 +52,21 @@ def convertToTime(timestring):
 ## insert times to calculate time to first failure (in some cases, insert times need to be gathered
 ## from clean records based on location in the system. See input data for examples).
 
-# file path where csv file is located
-CSV_FILE_LOCATION = '../../data/gc_full.csv'
+# file path where csv file is located, and directory where figures are written.
+# both can be overridden from the environment, e.g. to run on histories from gen_gc_history.py
+CSV_FILE_LOCATION = os.environ.get('TBF_CSV_FILE', '../../data/gc_full.csv')
+FIGS_LOCATION = os.environ.get('TBF_FIGS_DIR', '../../figs/')
+
+# optional: read one system of a partitioned dataset (see gc_dataset.py) instead of the csv file,
+# e.g. TBF_DATASET=../../data/gc_dataset TBF_SYSTEM=titan. The node count, the old/new cutoff and
+# the end of service (cutoff 'end', optional: all quarters with failures are plotted without it)
+# are then taken from the system's metadata.
+DATASET_LOCATION = os.environ.get('TBF_DATASET')
+DATASET_SYSTEM = os.environ.get('TBF_SYSTEM', 'titan')
+if DATASET_LOCATION:
+    import gc_dataset
+    dataset = gc_dataset.Dataset(DATASET_LOCATION)
+    dataset_meta = dataset.meta(DATASET_SYSTEM)
 
 # for time-wise breakdown of TBF (system-wide MTBF analysis)
 ALL_RAW_DBE_DATETIMES = [] # includes both new and old batch
@@ -74,10 +94,37 @@ oldNew_cutoff_epoch = 1451620140 # January 1, 2016 3:49:00 AM
 
 TOTAL_NODES = 18688
 
+# quarters from here on are not plotted: July 1, 2019 12:00:00 AM, the machine was decommissioned
+# at the end of 2019-Q2
+service_end_epoch = 1561939200
+
+if DATASET_LOCATION:
+    oldNew_cutoff_epoch = dataset_meta['cutoffs']['old_new']
+    TOTAL_NODES = dataset_meta['nodes']
+    service_end_epoch = dataset_meta['cutoffs'].get('end')
+
 # record bad data, write to file at end
 bad_data_serials_set = set([])
 bad_data_repeat = []
 
+# optional: insert times for rows whose insert time cannot be found from a loc match, imputed from
+# the inventory sweeps (see inventory_index.py). TBF_IMPUTE_INSERTS gives the lowest confidence
+# used: stint, serial or snapshot. Off by default.
+imputed_inserts = {}
+imputed_count = 0
+if os.environ.get('TBF_IMPUTE_INSERTS'):
+    import inventory_index
+    import gc_data
+    allowed = inventory_index.IMPUTE_NAMES[inventory_index.IMPUTE_SNAPSHOT:]
+    if os.environ['TBF_IMPUTE_INSERTS'] not in allowed:
+        sys.exit('TBF_IMPUTE_INSERTS=%s is not valid, expected one of: %s'
+                 % (os.environ['TBF_IMPUTE_INSERTS'], ', '.join(reversed(allowed))))
+    min_confidence = inventory_index.IMPUTE_NAMES.index(os.environ['TBF_IMPUTE_INSERTS'])
+    for key, (insert, confidence) in inventory_index.imputeInserts(dataset.load(DATASET_SYSTEM) if DATASET_LOCATION
+                                                                 else gc_data.loadGcFull(CSV_FILE_LOCATION)).items():
+        if confidence >= min_confidence:
+            imputed_inserts[key] = insert
+
 # for accounting only.
 DBE_count = 0
 OTB_count = 0
@@ -88,8 +135,9 @@ OTB_count = 0
 ##           row[4] duration (seconds between insert and remove), 
 ##           row[5] indicates whether the GPU was seen after remove (true/false), 
 ##           row[6] event_type (DBE/OTB/None).
-with open (CSV_FILE_LOCATION) as csv_file:
-    csv_reader = csv.reader(csv_file, delimiter=',')
+instr.stageBegin('ingest') # CSV ingest and DBE/OTB dict building (one loop)
+with (contextlib.nullcontext() if DATASET_LOCATION else open (CSV_FILE_LOCATION)) as csv_file:
+    csv_reader = dataset.csvRows(DATASET_SYSTEM) if DATASET_LOCATION else csv.reader(csv_file, delimiter=',')
     line_count = 0
     for row in csv_reader:
         if line_count == 0: # skip header
@@ -136,6 +184,16 @@ with open (CSV_FILE_LOCATION) as csv_file:
                         else:
                             DBE_dict_GPUwise[row[0]] = [row[1], start_temp, epoch(row[3])]
                         
+                    elif (row[0], row[1], row[3]) in imputed_inserts: # imputed start time
+                        start_temp = epoch(imputed_inserts[(row[0], row[1], row[3])])
+                        imputed_count += 1
+                        if row[0] in DBE_dict_GPUwise: # already exists
+                            DBE_dict_GPUwise[row[0]].append(row[1])
+                            DBE_dict_GPUwise[row[0]].append(start_temp)
+                            DBE_dict_GPUwise[row[0]].append(epoch(row[3]))
+                        else:
+                            DBE_dict_GPUwise[row[0]] = [row[1], start_temp, epoch(row[3])]
+
                     else:
                         # record GPU serial number whose insert time was not found for a particular location.
                         bad_data_serials_set.add((row[0],row[1]))
@@ -196,6 +254,16 @@ with open (CSV_FILE_LOCATION) as csv_file:
                         else:
                             OTB_dict_GPUwise[row[0]] = [row[1], start_temp, epoch(row[3])]
                         
+                    elif (row[0], row[1], row[3]) in imputed_inserts: # imputed start time
+                        start_temp = epoch(imputed_inserts[(row[0], row[1], row[3])])
+                        imputed_count += 1
+                        if row[0] in OTB_dict_GPUwise: # already exists
+                            OTB_dict_GPUwise[row[0]].append(row[1])
+                            OTB_dict_GPUwise[row[0]].append(start_temp)
+                            OTB_dict_GPUwise[row[0]].append(epoch(row[3]))
+                        else:
+                            OTB_dict_GPUwise[row[0]] = [row[1], start_temp, epoch(row[3])]
+
                     else:
                         # record GPU serial number whose insert time was not found for a particular location.
                         bad_data_serials_set.add((row[0],row[1]))
@@ -237,8 +305,11 @@ with open (CSV_FILE_LOCATION) as csv_file:
     print('Found', DBE_count, ' DBE events; ', OTB_count, ' OTB events;\n\n')
 
 print ('Number of GPU SNs found: ', len(oldNew_dict_GPUwise), '\n')
+instr.stageEnd('ingest', rows=line_count-1, dbe_events=DBE_count, otb_events=OTB_count,
+               gpus=len(oldNew_dict_GPUwise), bad_serials=len(bad_data_serials_set), imputed=imputed_count)
 
 #### Create old/new sets for DBE and OTB DATETIME/EPOCH #####################################
+instr.stageBegin('oldnew_split')
 ALL_RAW_DBE_DATETIMES__new = []  # to diff. old and new
 ALL_RAW_DBE_DATETIMES__old = []
 ALL_RAW_OTB_DATETIMES__new = []  # to diff. old and new
@@ -305,123 +376,100 @@ for i in ALL_RAW_OTB_dict:
                 print('ERR: logic issue while separating old and new OTB RAW data for GPU: ', i)
     else:
         print('ERR: logic issue while separating old and new OTB RAW data for GPU: ', i)
+instr.stageEnd('oldnew_split', dbe_old=len(ALL_DBE_EPOCHS__old), dbe_new=len(ALL_DBE_EPOCHS__new),
+               otb_old=len(ALL_OTB_EPOCHS__old), otb_new=len(ALL_OTB_EPOCHS__new))
 
 #### PART A: TBF Analysis #####################################################################
+instr.stageBegin('tbf_differencing')
 cnode = 'c\d+-\d+c(\d)+s\d+n\d+'  # GPU location, see paper: Section III (pgs. 3 & 4)
 
 ### Take simple difference of successive failure (DBE, OTB) times.
-
-### *** 1. DBE *** ###
-DBE_TBF_dict_GPUwise = {}
-
-for i in DBE_dict_GPUwise:
-
-    times = []
-    new = []
-    first = 1 # for 2D list
-
-    for val in DBE_dict_GPUwise[i]:
-        if isinstance(val, str) and re.match(cnode, val):
-            if first == 1:
-                first = 2
+### The per-GPU lists (location, start time, event times, location, ...) are flattened into one
+### array of times with one segment per stint, and differenced by the kernels in tbf_kernels.py.
+
+## input: dict of GPU-wise records (DBE_dict_GPUwise or OTB_dict_GPUwise)
+## output: list of serials, times (flat), offsets of the stints, offsets of the GPUs (in stints)
+def flattenStints(theDict):
+    serials = []
+    values = []
+    stint_offsets = [0]
+    gpu_offsets = [0]
+    for i in theDict:
+        first = 1
+        for val in theDict[i]:
+            if isinstance(val, str) and re.match(cnode, val):
+                if first == 1:
+                    first = 2
+                else:
+                    stint_offsets.append(len(values))  # close the previous stint
             else:
-                new.sort() # append sorted epoch list
-                res = [new[ii] - new[ii-1] for ii in range(1, len(new))]  # take difference of successive times
-                times.append(res)
+                values.append(val)
+        stint_offsets.append(len(values))  # close the last stint
+        serials.append(i)
+        gpu_offsets.append(len(stint_offsets) - 1)
+    return serials, values, stint_offsets, gpu_offsets
+
+## input: dict of GPU-wise records
+## output: dict serial -> list of lists of TBFs (one list per stint); serials, TBFs (flat) and
+##         offsets of the TBFs of each GPU, for tbfStats()
+def differenceStints(theDict):
+    serials, values, stint_offsets, gpu_offsets = flattenStints(theDict)
+    diffs, diff_offsets = kernels.stintDiffs(values, stint_offsets)
+    TBF_dict = {}
+    for g in range(len(serials)):
+        TBF_dict[serials[g]] = [diffs[diff_offsets[s]:diff_offsets[s+1]].tolist()
+                                for s in range(gpu_offsets[g], gpu_offsets[g+1])]
+    return TBF_dict, (serials, diffs, diff_offsets[gpu_offsets])
 
-            new = [] # reset inner list
-        else:
-            new.append(val) # append to inner list
+### *** 1. DBE *** ###
+DBE_TBF_dict_GPUwise, DBE_TBF_flat = differenceStints(DBE_dict_GPUwise)
 
-    new.sort() # append sorted epoch list
-    res = [new[ii] - new[ii-1] for ii in range(1, len(new))]  # take difference of successive times
-    times.append(res) # append last set of times
-    # populate dict, everything should be unique
-    DBE_TBF_dict_GPUwise[i] = times
-    
 ### *** 2. OTB *** ###
-OTB_TBF_dict_GPUwise = {}
-
-for i in OTB_dict_GPUwise:
-
-    times = []
-    new = []
-    first = 1 # for 2D list
-    
-    for val in OTB_dict_GPUwise[i]:
-        if isinstance(val, str) and re.match(cnode, val):
-            if first == 1:
-                first = 2
-            else:
-                new.sort() # append sorted epoch list                                                                        
-                res = [new[ii] - new[ii-1] for ii in range(1, len(new))]  # take difference of successive times              
-                times.append(res)
-                
-            new = [] # reset inner list
-        else:
-            new.append(val) # append to inner list
-
-    new.sort() # append sorted epoch list
-    res = [new[ii] - new[ii-1] for ii in range(1, len(new))]  # take difference of successive times
-    times.append(res) # append last set of times 
-    # populate dict, everything should be unique
-    OTB_TBF_dict_GPUwise[i] = times
+OTB_TBF_dict_GPUwise, OTB_TBF_flat = differenceStints(OTB_dict_GPUwise)
+instr.stageEnd('tbf_differencing', dbe_gpus=len(DBE_TBF_dict_GPUwise), otb_gpus=len(OTB_TBF_dict_GPUwise))
 
 #### Calculate MTBF for each GPU #######################################################################
+instr.stageBegin('gpu_mtbf')
 MTBF_DBE_GPUwise__old = []
 MTBF_DBE_GPUwise__new = []
 MTBF_OTB_GPUwise__old = []
 MTBF_OTB_GPUwise__new = []
 
-### *** 1. DBE *** ###
-for i in DBE_TBF_dict_GPUwise:
-    mean = 0.0
-    count = 0
-    for val in DBE_TBF_dict_GPUwise[i]:
-        for tbf in val: 
-            mean += tbf
-            if tbf <= 0:  # check repeat entries (BAD DATA)
-                bad_data_repeat.append((i, 'DBE')) # record serial of GPU with some or all repeat entries
+## input: serials, TBFs and offsets per GPU (from differenceStints), failure type,
+##        lists receiving the MTBF of old and new GPUs
+## records GPUs with repeat entries (TBF <= 0) in bad_data_repeat, once per repeat
+def gpuMTBF(flat, failure_type, MTBF__old, MTBF__new):
+    serials, diffs, offsets = flat
+    sums, counts, repeats = kernels.tbfStats(diffs, offsets)
+    for g in range(len(serials)):
+        i = serials[g]
+        bad_data_repeat.extend([(i, failure_type)] * int(repeats[g])) # record serial of GPU with some or all repeat entries
+
+        # old/new separation
+        if i in oldNew_dict_GPUwise:
+            if oldNew_dict_GPUwise[i] < oldNew_cutoff_epoch:
+                MTBF__old.append(int(sums[g])/int(counts[g]))
             else:
-                count += 1
-
-    # old/new separation
-    if i in oldNew_dict_GPUwise:
-        if oldNew_dict_GPUwise[i] < oldNew_cutoff_epoch: 
-            MTBF_DBE_GPUwise__old.append(mean/count)
+                MTBF__new.append(int(sums[g])/int(counts[g]))
         else:
-            MTBF_DBE_GPUwise__new.append(mean/count)
-    else:
-        print('ERR: old/new record not found during DBE TBF formation for GPU: ', i)
+            print('ERR: old/new record not found during ' + failure_type + ' TBF formation for GPU: ', i)
 
-### *** 2. OTB *** ###
-for i in OTB_TBF_dict_GPUwise:
-    mean = 0.0
-    count = 0
-    for val in OTB_TBF_dict_GPUwise[i]:
-        for tbf in val:
-            mean += tbf
-            if tbf <= 0:  # check repeat entries (BAD DATA)
-                bad_data_repeat.append((i, 'OTB')) 
-            else:
-                count += 1
+### *** 1. DBE *** ###
+gpuMTBF(DBE_TBF_flat, 'DBE', MTBF_DBE_GPUwise__old, MTBF_DBE_GPUwise__new)
 
-    # old/new separation
-    if i in oldNew_dict_GPUwise:
-        if oldNew_dict_GPUwise[i] < oldNew_cutoff_epoch: # 
-            MTBF_OTB_GPUwise__old.append(mean/count)
-        else:
-            MTBF_OTB_GPUwise__new.append(mean/count)
-    else:
-        print('ERR: old/new record not found during OTB TBF formation for GPU: ', i)
+### *** 2. OTB *** ###
+gpuMTBF(OTB_TBF_flat, 'OTB', MTBF_OTB_GPUwise__old, MTBF_OTB_GPUwise__new)
 
 ### Convert MTBF to years for each GPU
 MTBF_DBE_GPUwise_yrs__old = [x/(60*60*8760) for x in MTBF_DBE_GPUwise__old]
 MTBF_DBE_GPUwise_yrs__new = [x/(60*60*8760) for x in MTBF_DBE_GPUwise__new]
 MTBF_OTB_GPUwise_yrs__old = [x/(60*60*8760) for x in MTBF_OTB_GPUwise__old]
 MTBF_OTB_GPUwise_yrs__new = [x/(60*60*8760) for x in MTBF_OTB_GPUwise__new]
+instr.stageEnd('gpu_mtbf', dbe_gpus=len(MTBF_DBE_GPUwise__old)+len(MTBF_DBE_GPUwise__new),
+               otb_gpus=len(MTBF_OTB_GPUwise__old)+len(MTBF_OTB_GPUwise__new), repeats=len(bad_data_repeat))
 
 ### *** fig-6 SC20 paper. See page 6 *** Distribution of device-level MTBFs ###
+instr.stageBegin('plot_fig6')
 plt.figure(figsize=(16,8))
 
 # each bin is approx 2 weeks.
@@ -429,7 +477,7 @@ plt.hist([MTBF_DBE_GPUwise_yrs__old, MTBF_OTB_GPUwise_yrs__old], density=False,
          rwidth=0.8, bins=156, range=[0, 6], label=['Old GPUs: DBE data','Old GPUs: OTB data'])
 
 plt.hist([MTBF_DBE_GPUwise_yrs__new, MTBF_OTB_GPUwise_yrs__new], density=False, color=['blue','olive'], alpha=0.5,
-         edgeColor='yellow', linewidth=0.8, rwidth=0.8, bins=156, range=[0, 6], 
+         edgecolor='yellow', linewidth=0.8, rwidth=0.8, bins=156, range=[0, 6], 
          label=['New GPUs: DBE data','New GPUs: OTB data'])
 
 plt.ylabel('Count', fontsize=14)
@@ -441,7 +489,8 @@ plt.legend(fontsize=14)
 
 plt.tight_layout()
 
-plt.savefig('../../figs/MTBF_GPUwise_yrs_OldNew.pdf', dpi=600)
+plt.savefig(os.path.join(FIGS_LOCATION, 'MTBF_GPUwise_yrs_OldNew.pdf'), dpi=600)
+instr.stageEnd('plot_fig6')
 
 #### PART B: Time sliced System-wide MTBF Analysis #####################################################
 
@@ -471,16 +520,20 @@ def TimeSlicer(theTimes, byYear=True, byMonth=False):
 
 
 ## input: this helper function takes the output from 'TimeSlicer()' function
+## input: years (optional, byMonth/byQuarter): list of years (strings) to slice over, so that several
+##        slicings line up; by default the years found in the input
 ## output: 1) sorted list of years of data analyzed, 
 ## output: 2) based on input: produces a list of list containing number of elements to analyze sorted by time
-def SortTimeSlicer(theDict, byYear=True, byMonth=False, byQuarter=False):
+def SortTimeSlicer(theDict, byYear=True, byMonth=False, byQuarter=False, years=None):
     
-    years = []
     sortedYrs = []
     
     keylist = theDict.keys()
     
-    if byMonth== True or byQuarter== True:
+    if years is not None and (byMonth == True or byQuarter == True):
+        sortedYrs = list(years)
+    elif byMonth== True or byQuarter== True:
+        years = []
         for item in keylist:
             years.append(item.split('_')[0])
         sortedYrs = sorted(set(years))
@@ -605,30 +658,11 @@ def SortTimeSlicer(theDict, byYear=True, byMonth=False, byQuarter=False):
 ## output: list of list with raw TBFs
 def calcTimeSlicedMTBF(sortedFailTimes, slicer):
     ## ignore the naming of variables, this function can be used for any failure type
-    TBF_DBEs_sliced = []
-    MTBF_DBE_sys_sliced = [] 
-    running_idx = 0
-    for j in range(len(slicer)):
-        for k in range(len(slicer[j])):
-            TBF_DBEs = []
-            MTBF_DBE_sys = 0.0
-            # below assumes equal number of elements in each sub-list 
-            for idx in range(slicer[j][k]):
-                if idx == 0: ## skip the first 
-                    continue
-                diff = sortedFailTimes[running_idx + idx] - sortedFailTimes[running_idx + idx - 1]
-                TBF_DBEs.append(diff)  # diff should not be zero here, due to data processing done earlier.
-                MTBF_DBE_sys += diff
-            
-            running_idx += slicer[j][k]
-            
-            if len(TBF_DBEs) == 0:
-                MTBF_DBE_sys_sliced.append(float("inf"))
-            else:
-                MTBF_DBE_sys_sliced.append(MTBF_DBE_sys/len(TBF_DBEs))  
-            TBF_DBEs_sliced.append(TBF_DBEs)
-
-    return (MTBF_DBE_sys_sliced, TBF_DBEs_sliced)
+    ## the bins are walked in order by slicedMTBF() in tbf_kernels.py
+    counts = [n for counts_by_year in slicer for n in counts_by_year]
+    MTBF_sys_sliced, TBFs, offsets = kernels.slicedMTBF(sortedFailTimes, counts)
+    TBFs_sliced = [TBFs[offsets[k]:offsets[k+1]].tolist() for k in range(len(counts))]
+    return (MTBF_sys_sliced.tolist(), TBFs_sliced)
 
 ### data conditioning for plots
 ## input: overallCounts is a list of lists based off byMonth or byQuarter outputs
@@ -642,6 +676,7 @@ def plotCountDataConditioner(overallCounts):
     return outCounts
 
 #### track number of new GPUs over time ################################################
+instr.stageBegin('time_slicer')
 ALL_RAW_DATETIMES__new = []
 
 for i in oldNew_dict_GPUwise:
@@ -658,75 +693,82 @@ ALL_RAW_DBExOTB_DATETIMES = set(ALL_RAW_DBE_DATETIMES).union(set(ALL_RAW_OTB_DAT
 ALL_RAW_DBExOTB_DATETIMES__new = set(ALL_RAW_DBE_DATETIMES__new).union(set(ALL_RAW_OTB_DATETIMES__new))
 ALL_RAW_DBExOTB_DATETIMES__old = set(ALL_RAW_DBE_DATETIMES__old).union(set(ALL_RAW_OTB_DATETIMES__old))
 
+# all slicings below run over the same years, every year from the first to the last failure, so
+# that quarter k is the same quarter in every series (e.g. new GPUs have no failures before 2016)
+failure_years = [item.tm_year for item in ALL_RAW_DBExOTB_DATETIMES]
+QUARTER_YEARS = [str(y) for y in range(min(failure_years), max(failure_years)+1)] if failure_years else []
+
 ### *** 1. DBE *** ###
 ## slice by Months
 byMonthOutput_DBEs = TimeSlicer(set(ALL_RAW_DBE_DATETIMES), byYear=False, byMonth=True)
-_, overall_Counts_Months_DBEs = SortTimeSlicer(byMonthOutput_DBEs, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_DBEs = SortTimeSlicer(byMonthOutput_DBEs, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_DBEs = SortTimeSlicer(byMonthOutput_DBEs, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_DBEs = SortTimeSlicer(byMonthOutput_DBEs, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### *** 2. OTB *** ###
 ## slice by Months
 byMonthOutput_OTBs = TimeSlicer(set(ALL_RAW_OTB_DATETIMES), byYear=False, byMonth=True)
-_, overall_Counts_Months_OTBs = SortTimeSlicer(byMonthOutput_OTBs, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_OTBs = SortTimeSlicer(byMonthOutput_OTBs, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_OTBs = SortTimeSlicer(byMonthOutput_OTBs, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_OTBs = SortTimeSlicer(byMonthOutput_OTBs, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### *** 3. DBE or OTB *** ###
 ## slice by Months
 byMonthOutput_DBExOTBs = TimeSlicer(ALL_RAW_DBExOTB_DATETIMES, byYear=False, byMonth=True)
-_, overall_Counts_Months_DBExOTBs = SortTimeSlicer(byMonthOutput_DBExOTBs, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_DBExOTBs = SortTimeSlicer(byMonthOutput_DBExOTBs, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_DBExOTBs = SortTimeSlicer(byMonthOutput_DBExOTBs, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_DBExOTBs = SortTimeSlicer(byMonthOutput_DBExOTBs, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ## REDO for old/new
 ### *** 1. DBE *** ###
 ### i. new
 ## slice by Months
 byMonthOutput_DBEs__new = TimeSlicer(set(ALL_RAW_DBE_DATETIMES__new), byYear=False, byMonth=True)
-_, overall_Counts_Months_DBEs__new = SortTimeSlicer(byMonthOutput_DBEs__new, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_DBEs__new = SortTimeSlicer(byMonthOutput_DBEs__new, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_DBEs__new = SortTimeSlicer(byMonthOutput_DBEs__new, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_DBEs__new = SortTimeSlicer(byMonthOutput_DBEs__new, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### ii. old
 ## slice by Months
 byMonthOutput_DBEs__old = TimeSlicer(set(ALL_RAW_DBE_DATETIMES__old), byYear=False, byMonth=True)
-_, overall_Counts_Months_DBEs__old = SortTimeSlicer(byMonthOutput_DBEs__old, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_DBEs__old = SortTimeSlicer(byMonthOutput_DBEs__old, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_DBEs__old = SortTimeSlicer(byMonthOutput_DBEs__old, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_DBEs__old = SortTimeSlicer(byMonthOutput_DBEs__old, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### *** 2. OTB *** ###
 ### i. new
 ## slice by Months
 byMonthOutput_OTBs__new = TimeSlicer(set(ALL_RAW_OTB_DATETIMES__new), byYear=False, byMonth=True)
-_, overall_Counts_Months_OTBs__new = SortTimeSlicer(byMonthOutput_OTBs__new, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_OTBs__new = SortTimeSlicer(byMonthOutput_OTBs__new, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_OTBs__new = SortTimeSlicer(byMonthOutput_OTBs__new, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_OTBs__new = SortTimeSlicer(byMonthOutput_OTBs__new, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### ii. old
 ## slice by Months
 byMonthOutput_OTBs__old = TimeSlicer(set(ALL_RAW_OTB_DATETIMES__old), byYear=False, byMonth=True)
-_, overall_Counts_Months_OTBs__old = SortTimeSlicer(byMonthOutput_OTBs__old, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_OTBs__old = SortTimeSlicer(byMonthOutput_OTBs__old, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## c. sliced by Quarters
-_, overall_Counts_Quarters_OTBs__old = SortTimeSlicer(byMonthOutput_OTBs__old, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_OTBs__old = SortTimeSlicer(byMonthOutput_OTBs__old, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### *** 3. DBE or OTB *** ###
 ### i. new
 ## slice by Months
 byMonthOutput_DBExOTBs__new = TimeSlicer(ALL_RAW_DBExOTB_DATETIMES__new, byYear=False, byMonth=True)
-_, overall_Counts_Months_DBExOTBs__new = SortTimeSlicer(byMonthOutput_DBExOTBs__new, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_DBExOTBs__new = SortTimeSlicer(byMonthOutput_DBExOTBs__new, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_DBExOTBs__new = SortTimeSlicer(byMonthOutput_DBExOTBs__new, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_DBExOTBs__new = SortTimeSlicer(byMonthOutput_DBExOTBs__new, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
 
 ### ii. old
 ## slice by Months
 byMonthOutput_DBExOTBs__old = TimeSlicer(ALL_RAW_DBExOTB_DATETIMES__old, byYear=False, byMonth=True)
-_, overall_Counts_Months_DBExOTBs__old = SortTimeSlicer(byMonthOutput_DBExOTBs__old, byYear=False, byMonth=True, byQuarter=False)
+_, overall_Counts_Months_DBExOTBs__old = SortTimeSlicer(byMonthOutput_DBExOTBs__old, byYear=False, byMonth=True, byQuarter=False, years=QUARTER_YEARS)
 ## slice by Quarters
-_, overall_Counts_Quarters_DBExOTBs__old = SortTimeSlicer(byMonthOutput_DBExOTBs__old, byYear=False, byMonth=False, byQuarter=True)
+_, overall_Counts_Quarters_DBExOTBs__old = SortTimeSlicer(byMonthOutput_DBExOTBs__old, byYear=False, byMonth=False, byQuarter=True, years=QUARTER_YEARS)
+instr.stageEnd('time_slicer', new_gpus=len(ALL_RAW_DATETIMES__new), years=len(new_yrs))
 
 
 #### calc. system-wide MTBF for each failure type ####################################################
+instr.stageBegin('binned_mtbf')
 ## sort the absolute times of DBEs and OTBs
 sorted_DBEs = sorted(set(ALL_DBE_EPOCHS))
 sorted_OTBs = sorted(set(ALL_OTB_EPOCHS))
@@ -777,24 +819,42 @@ MTBF_OTB_sys_Quarters__new = [x/(60*60) for x in MTBF_OTB_sys_Quarters__new]
 MTBF_OTB_sys_Quarters__old = [x/(60*60) for x in MTBF_OTB_sys_Quarters__old]
 MTBF_DBExOTB_sys_Quarters__new = [x/(60*60) for x in MTBF_DBExOTB_sys_Quarters__new]
 MTBF_DBExOTB_sys_Quarters__old = [x/(60*60) for x in MTBF_DBExOTB_sys_Quarters__old]
+instr.stageEnd('binned_mtbf', quarters=len(MTBF_DBExOTB_sys_Quarters))
+
+#### quarters plotted ##################################################################################
+## from Q1 of the first failure year to the quarter of the last failure before the end of service,
+## e.g. 2014-Q1 to 2019-Q2 on Titan (2019-Q3 is left out, the machine was decommissioned at the end
+## of 2019-Q2)
+last_plotted = [x for x in sorted_DBExOTBs if service_end_epoch is None or x < service_end_epoch]
+if last_plotted:
+    last_time = time.gmtime(last_plotted[-1])
+    NUM_QUARTERS = (last_time.tm_year - int(QUARTER_YEARS[0]))*4 + (last_time.tm_mon-1)//3 + 1
+else:
+    NUM_QUARTERS = 0
+QUARTER_LABELS = [QUARTER_YEARS[k//4]+'-Q'+str(k%4+1) for k in range(NUM_QUARTERS)]
+
+## the new partition (fig-9) is shown from one year after the first quarter with new GPUs, e.g.
+## 2017-Q1 on Titan; new_first is that first quarter, in the quarters above
+if new_yrs and QUARTER_YEARS:
+    new_first = (int(new_yrs[0]) - int(QUARTER_YEARS[0]))*4
+    NEW_PART_FIRST = min(max(new_first + 4, 0), NUM_QUARTERS)
+else:
+    new_first = 0
+    NEW_PART_FIRST = NUM_QUARTERS
 
 ### *** fig-7 SC20 paper. See page 7 *** system-wide MTBF over time ###
+instr.stageBegin('plot_fig7')
 plt.figure(figsize=(12,6))
 
-# this includes data from 2014-Q1 to 2019-Q2. 2019-Q3 and 2019-Q4 are not included, 
-# since the machine was decommissioned at end of 2019-Q2
-ind = np.arange(len(MTBF_DBE_sys_Quarters[0:22]))
+# this includes the quarters in QUARTER_LABELS (2014-Q1 to 2019-Q2 on Titan, 2019-Q3 is not
+# included since the machine was decommissioned at end of 2019-Q2)
+ind = np.arange(len(MTBF_DBE_sys_Quarters[0:NUM_QUARTERS]))
 
-plt.plot(MTBF_DBE_sys_Quarters[0:22], linestyle='--', marker='o', markersize=10, color='b', lw=2, label='DBE')
-plt.plot( MTBF_OTB_sys_Quarters[0:22], linestyle='-', marker='s', markersize=10, color='olive', lw=2, label='OTB')
-plt.plot( MTBF_DBExOTB_sys_Quarters[0:22], linestyle=':', marker='X', markersize=10, color='red', lw=2, label='DBE or OTB')
+plt.plot(MTBF_DBE_sys_Quarters[0:NUM_QUARTERS], linestyle='--', marker='o', markersize=10, color='b', lw=2, label='DBE')
+plt.plot( MTBF_OTB_sys_Quarters[0:NUM_QUARTERS], linestyle='-', marker='s', markersize=10, color='olive', lw=2, label='OTB')
+plt.plot( MTBF_DBExOTB_sys_Quarters[0:NUM_QUARTERS], linestyle=':', marker='X', markersize=10, color='red', lw=2, label='DBE or OTB')
 
-plt.xticks(ind, ('2014-Q1', '2014-Q2', '2014-Q3', '2014-Q4',
-                '2015-Q1', '2015-Q2', '2015-Q3', '2015-Q4',
-                '2016-Q1', '2016-Q2', '2016-Q3', '2016-Q4',
-                '2017-Q1', '2017-Q2', '2017-Q3', '2017-Q4',
-                '2018-Q1', '2018-Q2', '2018-Q3', '2018-Q4',
-                '2019-Q1', '2019-Q2'), rotation=45, fontsize=12)
+plt.xticks(ind, QUARTER_LABELS, rotation=45, fontsize=12)
 
 plt.legend(fontsize=14)
 
@@ -803,67 +863,46 @@ plt.ylabel('MTBF (hours)', fontsize=14)
 
 plt.tight_layout()
 
-plt.savefig('../../figs/MTBF_quaterly_sys.pdf', dpi=600)
+plt.savefig(os.path.join(FIGS_LOCATION, 'MTBF_quaterly_sys.pdf'), dpi=600)
+instr.stageEnd('plot_fig7')
 
 ### *** fig-9 SC20 paper. See page 7 *** system-wide MTBF over new and old partitions ###
+instr.stageBegin('plot_fig9')
 
-### prepare num over time for plot starting from 2017-Q1 
-proportions = [] # 2017-Q1 to 2019-Q2. the size of the new partition.
-temp_sum = 0
-idx = 0
+### prepare num over time for plot starting from NEW_PART_FIRST (2017-Q1 on Titan)
+proportions = [] # NEW_PART_FIRST to the last quarter plotted. the size of the new partition.
 flatten__overall_Counts_Quarters_num__new = sum(overall_Counts_Quarters_num__new, [])
-for i in range(len(flatten__overall_Counts_Quarters_num__new)):
-    if i < 5:
-        temp_sum += flatten__overall_Counts_Quarters_num__new[i]
-        if i == 4:
-            proportions.append(temp_sum)
-    elif i > 4 and i < 14:
-        proportions.append(proportions[idx]+flatten__overall_Counts_Quarters_num__new[i])
-        idx = idx+1
+temp_sum = 0
+running_sums = [] # new GPUs inserted up to each quarter, from new_first on
+for x in flatten__overall_Counts_Quarters_num__new:
+    temp_sum += x
+    running_sums.append(temp_sum)
+for i in range(NEW_PART_FIRST, NUM_QUARTERS):
+    proportions.append(running_sums[min(i - new_first, len(running_sums)-1)])
 
 proportions = [(x/TOTAL_NODES)*100 for x in proportions]
 
-### put 'inf' to match data lengths for NEW datasets -- REDO: diff b/w new and old
+### the NEW series run over the same quarters as the others (inf before the first new GPUs)
 ## 1. DBE (quarters)
-plot___MTBF_DBE_sys_Quarters__new = []
-for i in range(len(MTBF_DBE_sys_Quarters__old)):
-    if i >= 0 and i <= 7:
-        plot___MTBF_DBE_sys_Quarters__new.append(float("inf"))
-    else:
-        plot___MTBF_DBE_sys_Quarters__new.append(MTBF_DBE_sys_Quarters__new[i-8])
-### put 'inf' to match data lengths for NEW datasets -- REDO: diff b/w new and old
+plot___MTBF_DBE_sys_Quarters__new = MTBF_DBE_sys_Quarters__new
 ## 2. OTB (quarters)
-plot___MTBF_OTB_sys_Quarters__new = []
-for i in range(len(MTBF_OTB_sys_Quarters__old)):
-    if i >= 0 and i <= 7:
-        plot___MTBF_OTB_sys_Quarters__new.append(float("inf"))
-    else:
-        plot___MTBF_OTB_sys_Quarters__new.append(MTBF_OTB_sys_Quarters__new[i-8])
+plot___MTBF_OTB_sys_Quarters__new = MTBF_OTB_sys_Quarters__new
 ## 3. DBE or OTB (quarters)
-plot___MTBF_DBExOTB_sys_Quarters__new = []
-for i in range(len(MTBF_DBExOTB_sys_Quarters__old)):
-    if i >= 0 and i <= 7:
-        plot___MTBF_DBExOTB_sys_Quarters__new.append(float("inf"))
-    else:
-        plot___MTBF_DBExOTB_sys_Quarters__new.append(MTBF_DBExOTB_sys_Quarters__new[i-8])
-
-ind = np.arange(len(MTBF_DBE_sys_Quarters[13:22]))
+plot___MTBF_DBExOTB_sys_Quarters__new = MTBF_DBExOTB_sys_Quarters__new
 
 fig, ax = plt.subplots(figsize=(12,6))
 bar_width = 0.25
 opacity = 0.8
 
-ind = np.arange(len(MTBF_DBE_sys_Quarters[12:22]))
+ind = np.arange(len(MTBF_DBE_sys_Quarters[NEW_PART_FIRST:NUM_QUARTERS]))
 ind2 = [x + bar_width for x in ind]
 ind3 = [x + bar_width for x in ind2]
 
-ax.bar(ind, plot___MTBF_DBExOTB_sys_Quarters__new[12:22], width=bar_width, alpha=opacity*0.25, color='red', label='New GPUs: DBE or OTB')
-ax.bar(ind2, MTBF_DBExOTB_sys_Quarters__old[12:22], width=bar_width, alpha=opacity*0.5, color='red', label='Old GPUs: DBE or OTB')
-ax.bar(ind3, MTBF_DBExOTB_sys_Quarters[12:22], width=bar_width, alpha=opacity, color='red', label='ALL GPUs: DBE or OTB')
+ax.bar(ind, plot___MTBF_DBExOTB_sys_Quarters__new[NEW_PART_FIRST:NUM_QUARTERS], width=bar_width, alpha=opacity*0.25, color='red', label='New GPUs: DBE or OTB')
+ax.bar(ind2, MTBF_DBExOTB_sys_Quarters__old[NEW_PART_FIRST:NUM_QUARTERS], width=bar_width, alpha=opacity*0.5, color='red', label='Old GPUs: DBE or OTB')
+ax.bar(ind3, MTBF_DBExOTB_sys_Quarters[NEW_PART_FIRST:NUM_QUARTERS], width=bar_width, alpha=opacity, color='red', label='ALL GPUs: DBE or OTB')
 
-plt.xticks([r + bar_width for r in range(len(MTBF_DBE_sys_Quarters[12:22]))], ('2017-Q1', '2017-Q2', '2017-Q3', '2017-Q4',
-                '2018-Q1', '2018-Q2', '2018-Q3', '2018-Q4',
-                '2019-Q1', '2019-Q2'), rotation=45, fontsize=12)
+plt.xticks([r + bar_width for r in range(len(ind))], QUARTER_LABELS[NEW_PART_FIRST:NUM_QUARTERS], rotation=45, fontsize=12)
 
 
 ax2 = ax.twinx()  # secondary y-axis  
@@ -882,22 +921,18 @@ for label in ax2.yaxis.get_majorticklabels():
 
 plt.tight_layout()
 
-plt.savefig('../../figs/MTBF_quaterly_sys_NewOldALL_newPart.pdf', dpi=600)
+plt.savefig(os.path.join(FIGS_LOCATION, 'MTBF_quaterly_sys_NewOldALL_newPart.pdf'), dpi=600)
+instr.stageEnd('plot_fig9')
 
 ### *** fig-8 SC20 paper. See page 7 *** Number of DBE and OTB failures over time ###
+instr.stageBegin('plot_fig8')
 ## condition data for plotting using helper function
 plot__overall_Counts_Quarters_DBEs = plotCountDataConditioner(overall_Counts_Quarters_DBEs)
 plot__overall_Counts_Quarters_OTBs = plotCountDataConditioner(overall_Counts_Quarters_OTBs)
 
 ## Redo old/new data 
-### put 'inf' to match data lengths for NEW datasets -- REDO: diff b/w new and old
-plot___overall_Counts_Quarters_DBEs__new = []
-for i in range(len(overall_Counts_Quarters_DBEs__old)):
-    for j in range(len(overall_Counts_Quarters_DBEs__old[i])):
-        if i >= 0 and i <=1:
-            plot___overall_Counts_Quarters_DBEs__new.append(float('inf'))
-        else:
-            plot___overall_Counts_Quarters_DBEs__new.append(overall_Counts_Quarters_DBEs__new[i-2][j])
+### NEW datasets run over the same quarters as the others (0 before the first new GPUs)
+plot___overall_Counts_Quarters_DBEs__new = plotCountDataConditioner(overall_Counts_Quarters_DBEs__new)
 
 plot__overall_Counts_Quarters_DBEs__old = plotCountDataConditioner(overall_Counts_Quarters_DBEs__old)
 plot__overall_Counts_Quarters_OTBs__old = plotCountDataConditioner(overall_Counts_Quarters_OTBs__old)
@@ -905,20 +940,15 @@ plot__overall_Counts_Quarters_OTBs__old = plotCountDataConditioner(overall_Count
 ## do the plot...
 plt.figure(figsize=(12,6))
 
-ind = np.arange(len(plot__overall_Counts_Quarters_DBEs[0:22]))    # the x locations for the groups
+ind = np.arange(len(plot__overall_Counts_Quarters_DBEs[0:NUM_QUARTERS]))    # the x locations for the groups
 
-plt.plot(plot__overall_Counts_Quarters_DBEs[0:22], linestyle='-', marker='X', markersize=10, color='b', lw=2, label='ALL GPUs: DBE')
-plt.plot(plot__overall_Counts_Quarters_OTBs[0:22], linestyle='-', marker='o', markersize=10, color='olive', lw=2, label='ALL GPUs: OTB')
+plt.plot(plot__overall_Counts_Quarters_DBEs[0:NUM_QUARTERS], linestyle='-', marker='X', markersize=10, color='b', lw=2, label='ALL GPUs: DBE')
+plt.plot(plot__overall_Counts_Quarters_OTBs[0:NUM_QUARTERS], linestyle='-', marker='o', markersize=10, color='olive', lw=2, label='ALL GPUs: OTB')
 
-plt.plot(plot__overall_Counts_Quarters_DBEs__old[0:22], linestyle=':', marker='<', markersize=6, color='b', lw=1.5, label='Old GPUs: DBE')
-plt.plot(plot__overall_Counts_Quarters_OTBs__old[0:22], linestyle=':', marker='v', markersize=6, color='olive', lw=1.5, label='Old GPUs: OTB')
+plt.plot(plot__overall_Counts_Quarters_DBEs__old[0:NUM_QUARTERS], linestyle=':', marker='<', markersize=6, color='b', lw=1.5, label='Old GPUs: DBE')
+plt.plot(plot__overall_Counts_Quarters_OTBs__old[0:NUM_QUARTERS], linestyle=':', marker='v', markersize=6, color='olive', lw=1.5, label='Old GPUs: OTB')
 
-plt.xticks(ind, ('2014-Q1', '2014-Q2', '2014-Q3', '2014-Q4',
-                '2015-Q1', '2015-Q2', '2015-Q3', '2015-Q4',
-                '2016-Q1', '2016-Q2', '2016-Q3', '2016-Q4',
-                '2017-Q1', '2017-Q2', '2017-Q3', '2017-Q4',
-                '2018-Q1', '2018-Q2', '2018-Q3', '2018-Q4',
-                '2019-Q1', '2019-Q2'), rotation=45, fontsize=12)
+plt.xticks(ind, QUARTER_LABELS, rotation=45, fontsize=12)
 
 plt.ylim(0, 600)
 plt.yticks(fontsize=14)
@@ -927,10 +957,12 @@ plt.legend(fontsize=14)
 
 plt.tight_layout()
 
-plt.savefig('../../figs/NumFailures_Quarterly_newOld.pdf', dpi=600)
+plt.savefig(os.path.join(FIGS_LOCATION, 'NumFailures_Quarterly_newOld.pdf'), dpi=600)
+instr.stageEnd('plot_fig8')
 
 #### write bad serial numbers ################################################################
 ## for more info: see paper, Section IV, page 4.
+instr.stageBegin('write_bad')
 MyFile=open('bad_serials.dat','w')
 MyFile.write('# no record for loc insert found for following GPU Serial Numbers:\n')
 for element in bad_data_serials_set:
@@ -950,4 +982,5 @@ for element in bad_data_repeat:
     MyFile2.write(temp_str)
     MyFile2.write('\n')
 MyFile2.close()
+instr.stageEnd('write_bad', bad_serials=len(bad_data_serials_set), bad_repeats=len(bad_data_repeat))
 
@@ -0,0 +1,142 @@
+#### Per-stage instrumentation for the TBF analysis scripts ####################################
+## Records wall time, CPU time, peak memory and row/event counts for each stage of a run and
+## hands one record (a dict) per finished stage to a sink. Disabled by default, in which case
+## stageBegin()/stageEnd() return right away.
+##
+## usage in a script:
+##   import tbf_instrument as instr
+##   instr.stageBegin('ingest')
+##   ...
+##   instr.stageEnd('ingest', rows=line_count)
+##
+## Enable from the environment (read at import):
+##   TBF_INSTRUMENT=<file.jsonl>   append one JSON record per line to the file
+##   TBF_INSTRUMENT=stderr         write JSON records to stderr ('stdout' also works)
+##   TBF_INSTRUMENT_MEMORY=1       track the peak Python heap of each stage with tracemalloc
+##                                 (slower), stored as peak_mb; otherwise records carry
+##                                 maxrss_mb, the process high-water mark at the end of the stage
+##                                 (it never goes down, so it is not a per-stage peak)
+## or from code: instr.enable(sink, memory=False), where sink is a file name, an open stream,
+## a list (records are appended) or any callable taking the record.
+####
+
+#### package imports ############################################################################
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+_sink = None        # callable taking a record, None when disabled
+_memory = False     # tracemalloc peaks instead of maxrss
+_open = {}          # stage name -> (wall start, cpu start, peak so far)
+_run = None         # identifies the records of one run
+
+#### sinks ######################################################################################
+## JSON lines appended to a file; the file is opened per record so several runs can share it.
+def jsonFileSink(path):
+    def sink(record):
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    return sink
+
+def jsonStreamSink(stream):
+    def sink(record):
+        stream.write(json.dumps(record) + '\n')
+        stream.flush()
+    return sink
+
+def listSink(records):
+    return records.append
+
+## input: file name, 'stderr'/'stdout', stream, list or callable
+## output: callable taking a record
+def makeSink(target):
+    if callable(target):
+        return target
+    if isinstance(target, list):
+        return listSink(target)
+    if target == 'stderr':
+        return jsonStreamSink(sys.stderr)
+    if target == 'stdout':
+        return jsonStreamSink(sys.stdout)
+    if isinstance(target, str):
+        return jsonFileSink(target)
+    return jsonStreamSink(target)
+
+#### enable/disable #############################################################################
+def enable(sink, memory=False, run=None):
+    global _sink, _memory, _run
+    _sink = makeSink(sink)
+    _memory = memory
+    _run = run if run is not None else '%d-%d' % (int(time.time()), os.getpid())
+    _open.clear()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global _sink, _memory
+    _sink = None
+    _open.clear()
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+
+def enabled():
+    return _sink is not None
+
+#### stages #####################################################################################
+## peak traced memory in MB since the last call
+def _peakMB():
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    for name in _open:  # open stages keep the largest peak seen while they ran
+        wall, cpu, stage_peak = _open[name]
+        _open[name] = (wall, cpu, max(stage_peak, peak))
+    return peak / 2**20
+
+## process high-water mark in MB
+def _maxrssMB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on linux
+
+def stageBegin(name):
+    if _sink is None:
+        return
+    if _memory:
+        _peakMB()
+    _open[name] = (time.perf_counter(), time.process_time(), 0)
+
+## counts: row/event counts etc. to store with the record, e.g. rows=37343
+def stageEnd(name, **counts):
+    if _sink is None or name not in _open:
+        return
+    wall_end = time.perf_counter()
+    cpu_end = time.process_time()
+    peak = _peakMB() if _memory else None
+    wall, cpu, stage_peak = _open.pop(name)
+    record = {'run': _run, 'stage': name, 'wall_s': wall_end - wall, 'cpu_s': cpu_end - cpu}
+    if _memory:
+        record['peak_mb'] = max(peak, stage_peak / 2**20)
+    else:
+        record['maxrss_mb'] = _maxrssMB()
+    record.update(counts)
+    _sink(record)
+
+## context manager form, for new code:  with instr.stage('render'): ...
+class stage(object):
+    def __init__(self, name, **counts):
+        self.name = name
+        self.counts = counts
+
+    def __enter__(self):
+        stageBegin(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        stageEnd(self.name, **self.counts)
+        return False
+
+#### environment ################################################################################
+if os.environ.get('TBF_INSTRUMENT'):
+    enable(os.environ['TBF_INSTRUMENT'], memory=os.environ.get('TBF_INSTRUMENT_MEMORY', '') not in ('', '0'))
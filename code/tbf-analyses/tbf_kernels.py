@@ -0,0 +1,248 @@
+#### Kernels for the per-GPU and per-bin loops of the TBF analysis ###############################
+## The loops of tbf_analyses.py that walk the events of each stint or each time bin in order:
+##   stintDiffs   per stint: sort the insert and event times, take differences of successive
+##                times (TBF differencing, PART A)
+##   tbfStats     per GPU: sum of its TBFs, number of positive ones and number of repeats
+##                (TBF <= 0, written to bad_serials_repeat.dat), for the device-level MTBF
+##   slicedMTBF   per time bin: differences of successive sorted failure times within the bin
+##                and their mean (calcTimeSlicedMTBF, PART B)
+## Variable-length groups are passed as one flat array and offsets (group g is
+## values[offsets[g]:offsets[g+1]]), so every backend sees plain int64 arrays.
+##
+## Backends, all giving identical results:
+##   python   reference loops, as originally written in tbf_analyses.py
+##   numpy    sorts and differences over the flat arrays, no python loop
+##   numba    the reference loops compiled with numba.njit(cache=True): compiled code is kept in
+##            __pycache__ (or NUMBA_CACHE_DIR) and reused by later runs, so only the first run
+##            pays for compilation. Used only if numba can be imported.
+## Selected from the environment (read at import):
+##   TBF_KERNEL_BACKEND=auto|numba|numpy|python   default auto: numba if available, else numpy
+## or from code: tbf_kernels.setBackend(name). Asking for numba without numba installed falls
+## back to numpy with a warning.
+##
+## usage: python tbf_kernels.py [--events N]   (checks that the backends agree, and times them)
+####
+
+#### package imports ############################################################################
+import os
+import sys
+import warnings
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ('python', 'numpy', 'numba')
+
+#### python reference ###########################################################################
+def _stintDiffsPython(values, offsets):
+    diffs = []
+    out_offsets = [0]
+    for s in range(len(offsets) - 1):
+        new = sorted(values[offsets[s]:offsets[s+1]])
+        diffs.extend(new[ii] - new[ii-1] for ii in range(1, len(new)))
+        out_offsets.append(len(diffs))
+    return np.array(diffs, dtype='int64'), np.array(out_offsets, dtype='int64')
+
+def _tbfStatsPython(diffs, offsets):
+    n = len(offsets) - 1
+    sums, positive, repeats = np.zeros(n, 'int64'), np.zeros(n, 'int64'), np.zeros(n, 'int64')
+    for g in range(n):
+        for tbf in diffs[offsets[g]:offsets[g+1]]:
+            sums[g] += tbf
+            if tbf <= 0:
+                repeats[g] += 1
+            else:
+                positive[g] += 1
+    return sums, positive, repeats
+
+def _slicedMTBFPython(times, counts):
+    mtbf = np.zeros(len(counts), dtype='float64')
+    diffs = []
+    out_offsets = [0]
+    running_idx = 0
+    for b in range(len(counts)):
+        total = 0
+        first = len(diffs)
+        for idx in range(1, counts[b]):
+            diff = times[running_idx + idx] - times[running_idx + idx - 1]
+            diffs.append(diff)
+            total += diff
+        running_idx += counts[b]
+        mtbf[b] = float('inf') if len(diffs) == first else total / float(len(diffs) - first)
+        out_offsets.append(len(diffs))
+    return mtbf, np.array(diffs, dtype='int64'), np.array(out_offsets, dtype='int64')
+
+#### numpy ######################################################################################
+## group number of each item, from offsets
+def _groups(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+## offsets of the differences: a group of n items has max(n-1, 0) differences
+def _diffOffsets(offsets):
+    return np.concatenate([[0], np.cumsum(np.maximum(np.diff(offsets) - 1, 0))]).astype('int64')
+
+def _stintDiffsNumpy(values, offsets):
+    groups = _groups(offsets)
+    values = values[:offsets[-1]]
+    ordered = values[np.lexsort((values, groups))]
+    inside = groups[1:] == groups[:-1]
+    return (ordered[1:] - ordered[:-1])[inside], _diffOffsets(offsets)
+
+def _tbfStatsNumpy(diffs, offsets):
+    groups = _groups(offsets)
+    n = len(offsets) - 1
+    # integer sums: np.add.at keeps int64 (bincount would go through float64)
+    sums = np.zeros(n, dtype='int64')
+    np.add.at(sums, groups, diffs)
+    repeats = np.bincount(groups[diffs <= 0], minlength=n).astype('int64')
+    return sums, np.diff(offsets) - repeats, repeats
+
+def _slicedMTBFNumpy(times, counts):
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype('int64')
+    diffs, out_offsets = _stintDiffsNumpy(times[:offsets[-1]], offsets)  # times are sorted already
+    groups = _groups(out_offsets)
+    sums = np.zeros(len(counts), dtype='int64')
+    np.add.at(sums, groups, diffs)
+    n = np.diff(out_offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mtbf = np.where(n > 0, sums / np.maximum(n, 1).astype('float64'), np.inf)
+    return mtbf, diffs, out_offsets
+
+#### numba ######################################################################################
+if numba is not None:
+    @numba.njit(cache=True)
+    def _stintDiffsNumba(values, offsets):
+        n = len(offsets) - 1
+        out_offsets = np.zeros(n + 1, dtype=np.int64)
+        for s in range(n):
+            out_offsets[s+1] = out_offsets[s] + max(offsets[s+1] - offsets[s] - 1, 0)
+        diffs = np.empty(out_offsets[n], dtype=np.int64)
+        for s in range(n):
+            new = np.sort(values[offsets[s]:offsets[s+1]])
+            k = out_offsets[s]
+            for ii in range(1, len(new)):
+                diffs[k] = new[ii] - new[ii-1]
+                k += 1
+        return diffs, out_offsets
+
+    @numba.njit(cache=True)
+    def _tbfStatsNumba(diffs, offsets):
+        n = len(offsets) - 1
+        sums = np.zeros(n, dtype=np.int64)
+        positive = np.zeros(n, dtype=np.int64)
+        repeats = np.zeros(n, dtype=np.int64)
+        for g in range(n):
+            for k in range(offsets[g], offsets[g+1]):
+                sums[g] += diffs[k]
+                if diffs[k] <= 0:
+                    repeats[g] += 1
+                else:
+                    positive[g] += 1
+        return sums, positive, repeats
+
+    @numba.njit(cache=True)
+    def _slicedMTBFNumba(times, counts):
+        n = len(counts)
+        mtbf = np.empty(n, dtype=np.float64)
+        out_offsets = np.zeros(n + 1, dtype=np.int64)
+        for b in range(n):
+            out_offsets[b+1] = out_offsets[b] + max(counts[b] - 1, 0)
+        diffs = np.empty(out_offsets[n], dtype=np.int64)
+        running_idx = 0
+        for b in range(n):
+            total = 0
+            k = out_offsets[b]
+            for idx in range(1, counts[b]):
+                diffs[k] = times[running_idx + idx] - times[running_idx + idx - 1]
+                total += diffs[k]
+                k += 1
+            running_idx += counts[b]
+            if counts[b] <= 1:
+                mtbf[b] = np.inf
+            else:
+                mtbf[b] = total / float(counts[b] - 1)
+        return mtbf, diffs, out_offsets
+
+_KERNELS = {
+    'python': (_stintDiffsPython, _tbfStatsPython, _slicedMTBFPython),
+    'numpy': (_stintDiffsNumpy, _tbfStatsNumpy, _slicedMTBFNumpy),
+}
+if numba is not None:
+    _KERNELS['numba'] = (_stintDiffsNumba, _tbfStatsNumba, _slicedMTBFNumba)
+
+_backend = None
+
+#### backend selection ##########################################################################
+## name: 'auto', 'numba', 'numpy' or 'python'; returns the backend in use
+def setBackend(name='auto'):
+    global _backend
+    if name == 'auto':
+        name = 'numba' if numba is not None else 'numpy'
+    if name not in BACKENDS:
+        raise ValueError('unknown kernel backend %r, expected auto or one of %s' % (name, ', '.join(BACKENDS)))
+    if name not in _KERNELS:
+        warnings.warn('numba is not installed, using the numpy kernels')
+        name = 'numpy'
+    _backend = name
+    return _backend
+
+def backend():
+    return _backend
+
+#### kernels ####################################################################################
+def _int64(x):
+    return np.ascontiguousarray(x, dtype='int64')
+
+## input: times (flat), offsets of the stints
+## output: differences of successive sorted times of each stint (flat), offsets per stint
+def stintDiffs(values, offsets):
+    return _KERNELS[_backend][0](_int64(values), _int64(offsets))
+
+## input: TBFs (flat), offsets per GPU
+## output: per GPU: sum of the TBFs, number of TBFs > 0, number of repeats (TBF <= 0)
+def tbfStats(diffs, offsets):
+    return _KERNELS[_backend][1](_int64(diffs), _int64(offsets))
+
+## input: sorted failure times, number of failures in each bin (bins in time order)
+## output: MTBF per bin (seconds, inf with fewer than 2 failures), TBFs (flat), offsets per bin
+def slicedMTBF(times, counts):
+    return _KERNELS[_backend][2](_int64(times), _int64(counts))
+
+setBackend(os.environ.get('TBF_KERNEL_BACKEND', 'auto'))
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Check that the kernel backends agree, and time them.')
+    parser.add_argument('--events', type=int, default=200000, help='synthetic times per kernel')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    values = rng.integers(1380000000, 1560000000, args.events)
+    values[::50] = values[1::50]  # some repeats
+    offsets = np.concatenate([[0], np.sort(rng.integers(0, args.events, args.events // 4)), [args.events]])
+    times = np.sort(values)
+    counts = np.diff(np.concatenate([[0], np.searchsorted(times, np.linspace(times[0], times[-1], 100)[1:]),
+                                     [len(times)]]))
+    results = {}
+    for name in [b for b in BACKENDS if b in _KERNELS]:
+        setBackend(name)
+        stintDiffs(values[:10], [0, 10])  # compile, or load from the cache
+        slicedMTBF(times[:10], [10])
+        t0 = time.perf_counter()
+        diffs, diff_offsets = stintDiffs(values, offsets)
+        stats = tbfStats(diffs, diff_offsets)
+        sliced = slicedMTBF(times, counts)
+        results[name] = (diffs, diff_offsets) + tuple(stats) + tuple(sliced)
+        print('%-7s %.3f s' % (name, time.perf_counter() - t0))
+    reference = results['python']
+    for name, result in results.items():
+        same = all(np.array_equal(a, b) for a, b in zip(reference, result))
+        print('%-7s %s' % (name, 'identical to python' if same else 'DIFFERENT from python'))
+        if not same:
+            sys.exit(1)